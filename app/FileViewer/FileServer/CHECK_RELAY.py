@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+### script that checks PrepareFiles (relaying a file through a chain of FileServers)
+### without needing several machines: it starts a few FileServers on this machine,
+### each with its own HOME (so its own config, file library and cache) and port,
+### has the first one prepare a file on all the others and checks what they got
+###
+### usage: CHECK_RELAY.py [number of FileServers (default 4)] [first port (default 9800)]
+### SAGE_DIRECTORY has to be set just like for the FileServer itself
+
+import xmlrpclib, sys, os, os.path, shutil, tempfile, subprocess, hashlib, time
+
+opj = os.path.join
+SCRIPT_PATH = os.path.dirname(os.path.abspath(sys.argv[0]))
+CONFIG_FILE = opj(os.environ["SAGE_DIRECTORY"], "sageConfig", "fileServer", "fileServer.conf")
+PORT_STEP = 10    # each FileServer uses its port, port+2 and port+3
+FILE_SIZE = 5*1048576
+START_TIMEOUT = 30
+
+
+def md5(path):
+    m = hashlib.md5()
+    f = open(path, "rb")
+    for chunk in iter(lambda: f.read(65536), ""):
+        m.update(chunk)
+    f.close()
+    return m.hexdigest()
+
+
+def startServer(port, home):
+    os.makedirs(opj(home, ".sageConfig", "fileServer"))
+    shutil.copy(CONFIG_FILE, opj(home, ".sageConfig", "fileServer"))
+    env = dict(os.environ)
+    env["HOME"] = home
+    log = open(opj(home, "output.log"), "w")
+    return subprocess.Popen([sys.executable, opj(SCRIPT_PATH, "fileServer.py"), "-p", str(port), "-r"],
+                            cwd=SCRIPT_PATH, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def waitForServer(server, proc):
+    t = time.time()
+    while time.time() - t < START_TIMEOUT and proc.poll() is None:
+        try:
+            return server.TestConnection()[0]
+        except:
+            time.sleep(0.5)
+    return None
+
+
+def main(argv):
+    count = 4
+    firstPort = 9800
+    if len(argv) > 1: count = int(argv[1])
+    if len(argv) > 2: firstPort = int(argv[2])
+
+    tmpDir = tempfile.mkdtemp(prefix="check_relay_")
+    ports = [firstPort + i*PORT_STEP for i in range(count)]
+    procs = []
+    ok = False
+    try:
+        for i, port in enumerate(ports):
+            procs.append(startServer(port, opj(tmpDir, "site%d" % i)))
+        servers = [xmlrpclib.ServerProxy("http://localhost:%d" % port) for port in ports]
+        libs = [waitForServer(s, p) for s, p in zip(servers, procs)]
+        if None in libs:
+            print "FileServer on port %d didn't start (see %s)" % (ports[libs.index(None)], tmpDir)
+            return False
+
+        # the file to send lives in the library of the first FileServer only
+        fullPath = opj(libs[0], "check_relay.bin")
+        f = open(fullPath, "wb")
+        f.write(os.urandom(FILE_SIZE))
+        f.close()
+        checksum = md5(fullPath)
+
+        hosts = ["localhost:%d" % port for port in ports[1:]]
+        t = time.time()
+        paths = servers[0].PrepareFiles(fullPath, hosts)
+        print "PrepareFiles took %.2fs for %d hosts" % (time.time()-t, len(hosts))
+
+        ok = True
+        for host, server, path in zip(hosts, servers[1:], paths):
+            stats = server.GetCacheStats()
+            good = bool(path) and path != fullPath and os.path.isfile(path) and md5(path) == checksum
+            print "%-16s %-4s %s (%s files cached)" % (host, good and "OK" or "FAIL", path, stats["files"])
+            ok = ok and good
+
+        # a second round has to be served from the caches
+        again = servers[0].PrepareFiles(fullPath, hosts)
+        if again != paths:
+            print "FAIL: second PrepareFiles returned different paths", again
+            ok = False
+        return ok
+
+    finally:
+        for port, p in zip(ports, procs):
+            try:
+                xmlrpclib.ServerProxy("http://localhost:%d" % port).Quit(1)
+            except:
+                pass
+        for p in procs:
+            for i in range(20):
+                if p.poll() is not None:
+                    break
+                time.sleep(0.25)
+            else:
+                p.kill()
+        if ok:
+            shutil.rmtree(tmpDir, True)
+        print ok and "PASSED" or "FAILED (logs are in %s)" % tmpDir
+
+
+
+if __name__ == '__main__':
+    if not main(sys.argv):
+        sys.exit(1)
@@ -0,0 +1,300 @@
+############################################################################
+#
+# -= FileViewer =-
+#
+# fileCache - size bounded cache of files received from other FileServers,
+#             keyed by the md5 of their content
+#
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about FileViewer to www.evl.uic.edu/cavern/forum
+#
+############################################################################
+
+#
+# Every cached file lives in CACHE_DIR/<md5>/<original filename> so the
+# apps still get the real filename (and extension) while two different
+# files with the same name can never be confused. The last use of an entry
+# is kept as the mtime of its directory so the LRU order survives restarts.
+# Uploads still in flight hold a reservation for their full size until they
+# are added (or released), and leftover .part files and the files of the
+# old flat layout count against the limit and get evicted like the rest.
+#
+
+import os, os.path, shutil, threading
+from time import time
+
+opj = os.path.join
+
+MIN_AGE = 300   # entries used in the last 5 minutes are never evicted (the app may still be loading them)
+RESERVATION_TIMEOUT = 3600   # same as the HANDLE_TIMEOUT of the transfers, after that nobody can finish the upload
+PART_EXT = ".part"
+
+
+
+class CacheEntry:
+    def __init__(self, checksum, path, size, lastUsed, legacy=False):
+        self.checksum = checksum
+        self.path = path
+        self.size = size
+        self.lastUsed = lastUsed
+        self.pins = 0
+        self.legacy = legacy   # a file from the old layout, directly in the cache dir
+
+
+
+class FileCache:
+
+    def __init__(self, cacheDir, maxBytes):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.__lock = threading.Lock()
+        self.__entries = {}    # keyed by checksum
+        self.__partial = {}    # .part files nobody is uploading at the moment, keyed by checksum
+        self.__reserved = {}   # checksum --> (size, time) of the uploads in flight
+        self.__usedBytes = 0   # entries and partial files on disk
+        self.__reservedBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evictedBytes = 0
+        self.__load()
+
+
+    def __load(self):
+        """ picks up whatever is already in the cache directory """
+        for checksum in os.listdir(self.cacheDir):
+            entryDir = opj(self.cacheDir, checksum)
+            if os.path.isfile(entryDir):
+                ### the old cache layout kept the files by name, right in the cache dir
+                st = os.stat(entryDir)
+                e = CacheEntry("legacy:"+checksum, entryDir, st.st_size, st.st_mtime, True)
+                self.__entries[e.checksum] = e
+                self.__usedBytes += e.size
+                continue
+            if not os.path.isdir(entryDir) or len(checksum) != 32:
+                continue
+            part = None
+            for name in os.listdir(entryDir):
+                path = opj(entryDir, name)
+                if not os.path.isfile(path):
+                    continue
+                elif name.endswith(PART_EXT):
+                    part = path
+                else:
+                    e = CacheEntry(checksum, path, os.stat(path).st_size, os.stat(entryDir).st_mtime)
+                    self.__entries[checksum] = e
+                    self.__usedBytes += e.size
+                    break
+            else:
+                if part:   # an upload that never finished, it can still be resumed
+                    self.__addPartial(checksum, part)
+
+
+    def lookup(self, checksum):
+        """ returns the path of the cached file with this content or None """
+        self.__lock.acquire()
+        try:
+            e = self.__entries.get(checksum)
+            if e and os.path.isfile(e.path):
+                self.hits += 1
+                self.__touch(e)
+                return e.path
+            elif e:   # someone deleted it behind our back
+                self.__remove(e)
+            self.misses += 1
+            return None
+        finally:
+            self.__lock.release()
+
+
+    def pathFor(self, checksum, filename):
+        """ where a file with this content should be stored """
+        entryDir = opj(self.cacheDir, checksum)
+        if not os.path.isdir(entryDir):
+            os.makedirs(entryDir)
+        return opj(entryDir, filename)
+
+
+    def reserve(self, size, checksum=None):
+        """ evicts the least recently used entries until size more bytes fit,
+            returns False if that's impossible (too much of the cache is pinned)
+            With a checksum the space stays reserved for that upload until
+            add() or release() is called for it (or it times out).
+        """
+        self.__lock.acquire()
+        try:
+            now = time()
+            self.__expireReservations(now)
+            if checksum:
+                self.__release(checksum)         # a retry replaces the old reservation
+                if checksum in self.__partial:   # ... and the reservation covers the .part
+                    self.__usedBytes -= self.__partial.pop(checksum).size
+
+            if not self.__fits(size):
+                lru = [e for e in self.__entries.values() + self.__partial.values()
+                       if e.pins == 0 and now-e.lastUsed > MIN_AGE and e.checksum not in self.__reserved]
+                lru.sort(lambda a, b: cmp(a.lastUsed, b.lastUsed))
+                for e in lru:
+                    if self.__fits(size):
+                        break
+                    self.evictions += 1
+                    self.evictedBytes += e.size
+                    self.__remove(e)
+
+            fits = self.__fits(size)
+            if fits and checksum:
+                self.__reserved[checksum] = (size, now)
+                self.__reservedBytes += size
+            return fits
+        finally:
+            self.__lock.release()
+
+
+    def release(self, checksum):
+        """ gives up the reservation of an upload that failed """
+        self.__lock.acquire()
+        try:
+            self.__release(checksum)
+        finally:
+            self.__lock.release()
+
+
+    def add(self, checksum, path):
+        """ registers a file that was just received """
+        self.__lock.acquire()
+        try:
+            if checksum in self.__reserved:
+                self.__reservedBytes -= self.__reserved.pop(checksum)[0]
+            if checksum in self.__partial:
+                self.__usedBytes -= self.__partial.pop(checksum).size
+            if checksum in self.__entries:
+                self.__usedBytes -= self.__entries[checksum].size
+            e = CacheEntry(checksum, path, os.stat(path).st_size, time())
+            self.__entries[checksum] = e
+            self.__usedBytes += e.size
+        finally:
+            self.__lock.release()
+
+
+    def pin(self, path):
+        """ pinned files are never evicted (until unpinned as many times) """
+        return self.__setPin(path, 1)
+
+    def unpin(self, path):
+        return self.__setPin(path, -1)
+
+
+    def stats(self):
+        self.__lock.acquire()
+        try:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "evictedBytes": str(self.evictedBytes),
+                    "files": len(self.__entries), "usedBytes": str(self.__usedBytes),
+                    "reservedBytes": str(self.__reservedBytes),
+                    "maxBytes": str(self.maxBytes)}
+        finally:
+            self.__lock.release()
+
+
+    #-------------------------------------------------------
+
+    def __fits(self, size):
+        return self.__usedBytes + self.__reservedBytes + size <= self.maxBytes
+
+
+    def __release(self, checksum):
+        """ drops the reservation, whatever was received so far stays as a .part """
+        if checksum not in self.__reserved:
+            return
+        (size, t) = self.__reserved.pop(checksum)
+        self.__reservedBytes -= size
+        if checksum not in self.__entries:
+            entryDir = opj(self.cacheDir, checksum)
+            if os.path.isdir(entryDir):
+                for name in os.listdir(entryDir):
+                    if name.endswith(PART_EXT):
+                        self.__addPartial(checksum, opj(entryDir, name))
+                        break
+
+
+    def __expireReservations(self, now):
+        for checksum, (size, t) in self.__reserved.items():
+            if now - t > RESERVATION_TIMEOUT:
+                self.__release(checksum)
+
+
+    def __addPartial(self, checksum, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        e = CacheEntry(checksum, path, st.st_size, st.st_mtime)
+        self.__partial[checksum] = e
+        self.__usedBytes += e.size
+
+
+    def __setPin(self, path, change):
+        self.__lock.acquire()
+        try:
+            for e in self.__entries.itervalues():
+                if e.path == path:
+                    e.pins = max(0, e.pins + change)
+                    self.__touch(e)
+                    return True
+            return False
+        finally:
+            self.__lock.release()
+
+
+    def __touch(self, e):
+        e.lastUsed = time()
+        try:
+            if e.legacy:
+                os.utime(e.path, None)
+            else:
+                os.utime(os.path.dirname(e.path), None)
+        except OSError:
+            pass
+
+
+    def __remove(self, e):
+        if self.__partial.get(e.checksum) is e:
+            del self.__partial[e.checksum]
+        else:
+            del self.__entries[e.checksum]
+        self.__usedBytes -= e.size
+        if e.legacy:
+            try:
+                os.remove(e.path)
+            except OSError:
+                pass
+        else:
+            shutil.rmtree(os.path.dirname(e.path), True)
@@ -40,11 +40,20 @@
 #
 ############################################################################
  
-import os, base64, os.path, socket, shutil, sys, SocketServer, wx, stat, urllib
+import os, base64, os.path, socket, shutil, sys, SocketServer, wx, stat, urllib, tempfile, hashlib, re
 from SimpleXMLRPCServer import *
-from threading import Thread
+from threading import Thread, Lock
 from time import asctime, time
-import makeThumbs
+import fileTransfer
+import thumbService
+import libraryIndex
+import fileCache
+
+# makes the DXT versions of the images (it's installed here from the ImageViewer)
+try:
+    import dirToDxt
+except ImportError:
+    dirToDxt = None
 
 # miscellaneous stuff (3rd party supporting tools)
 sys.path.append("misc")  #so that we can import packages from "misc" folder
@@ -64,69 +73,113 @@ from sagePath import getUserPath, getPath
 SCRIPT_PATH = sys.path[0]
 CONFIG_FILE = getPath("fileServer", "fileServer.conf")
 CACHE_DIR = getUserPath("fileServer", "file_server_cache")
-FILES_DIR = opj(SCRIPT_PATH, "file_library")
+XMLRPC_PORT = 8800   # the upload port is XMLRPC_PORT+2 and the transfer port is XMLRPC_PORT+3
 REDIRECT = False
-THUMB_DIR = opj(FILES_DIR, "thumbnails")
 RUN_SERVER = True
+SEPARATE_SITE = False   # act as if every other FileServer was on another machine (-r, see CHECK_RELAY.py)
+UPLOAD_CHUNK_SIZE = 1048576   # size of the buffer for receiving uploaded files
+THUMB_WAIT = 60   # how long the old blocking calls wait for a thumbnail (in seconds)
+INDEX_FILE = "library_index.db"   # kept in the library directory
+DEFAULT_CACHE_SIZE = 10240   # in MB, can be changed with CACHE_SIZE in the config file
+CHECKSUM_RE = re.compile("^[0-9a-f]{32}$")   # md5 hexdigests (also used as cache directory names)
+
+## the currently used snapshot of the config file (the library directory and
+## the types that we support), everyone gets it from ParseConfigFile()
+config = None
+configLock = Lock()
+
+
+
+class ConfigSnapshot:
+    """ one parsed version of the config file. It's never modified once it's
+        made, a changed config file produces a new snapshot instead.
+    """
+    def __init__(self, mtime):
+        self.mtime = mtime
+        self.filesDir = ""
+        self.thumbDir = ""
+        self.cacheSize = DEFAULT_CACHE_SIZE
+        self.dirHash = {}    # type --> directory
+        self.types = {}      # type --> extensions
+        self.viewers = {}    # type --> (app, params)
+        self.extTypes = {}   # extension --> type
+
+        # read the config file
+        f = open(CONFIG_FILE, "r")
+        for line in f:
+            line = line.strip()
+            if line.startswith("FILES_DIR"):
+                filesDir = line.split("=")[1].strip()
+                if not os.path.isabs(filesDir):
+                    filesDir = getUserPath("fileServer", filesDir)
+                self.filesDir = os.path.realpath(filesDir)  #expand any symbolic links in the library directory
+                self.thumbDir = opj(self.filesDir, "thumbnails")
+            elif line.startswith("CACHE_SIZE"):
+                self.cacheSize = int(line.split("=")[1].strip())
+            elif line.startswith("type:"):
+                line = line.split(":",1)[1]
+                (type, extensions) = line.split("=")
+                self.types[type.strip()] = extensions.strip().split(" ")
+                self.dirHash[type.strip()] = opj(self.filesDir, type.strip())
+            elif line.startswith("app:"):
+                line = line.split(":", 1)[1].strip()
+                (type, app) = line.split("=")
+                tpl = app.strip().split(" ", 1)
+                if len(tpl) == 1:  params = ""
+                else:  params = tpl[1].strip()
+                app = tpl[0].strip()
+                self.viewers[type.strip()] = (app, params)
+        f.close()
+
+        for type, extensions in self.types.iteritems():
+            for ext in extensions:
+                self.extTypes[ext] = type
+
+
+    def fileType(self, filename):
+        """ the type of the file judging by its extension (False if we don't support it) """
+        return self.extTypes.get(os.path.splitext(filename)[1].lower(), False)
+
+
+    def makeDirs(self):
+        """ create the folders first if they dont exist """
+        if not os.path.isdir(self.filesDir):
+            os.makedirs(self.filesDir)
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        for type, typeDir in self.dirHash.items():
+            if not os.path.isdir( ConvertPath(typeDir) ):
+                os.makedirs(typeDir)
+            if not os.path.isdir( ConvertPath( opj(typeDir, "Trash")) ):
+                os.makedirs( opj(typeDir, "Trash") )
+        if not os.path.isdir(self.thumbDir):
+            os.makedirs(self.thumbDir)
 
-## holds information about the types that we support (read from the config file)
-dirHash = {}
-viewers = {}
-types = {}
 
 
 def ParseConfigFile():
-    global FILES_DIR
-    global THUMB_DIR
-    global dirHash
-    global types
-    global viewers
-
-    # reinitialize everything
-    FILES_DIR = ""
-    THUMB_DIR = ""
-    dirHash = {}
-    types = {}
-    viewers = {}
-
-    # read the config file
-    f = open(CONFIG_FILE, "r")
-    for line in f:
-        line = line.strip()
-        if line.startswith("FILES_DIR"):
-            FILES_DIR = line.split("=")[1].strip()
-            if not os.path.isabs(FILES_DIR):
-                FILES_DIR = getUserPath("fileServer", FILES_DIR)
-            FILES_DIR = os.path.realpath(FILES_DIR)  #expand any symbolic links in the library directory
-            THUMB_DIR = opj(FILES_DIR, "thumbnails")
-        elif line.startswith("type:"):
-            line = line.split(":",1)[1]
-            (type, extensions) = line.split("=")
-            types[type.strip()] = extensions.strip().split(" ")
-            dirHash[type.strip()] = opj(FILES_DIR, type.strip())
-        elif line.startswith("app:"):
-            line = line.split(":", 1)[1].strip()
-            (type, app) = line.split("=")
-            tpl = app.strip().split(" ", 1)
-            if len(tpl) == 1:  params = ""
-            else:  params = tpl[1].strip()
-            app = tpl[0].strip()
-            viewers[type.strip()] = (app, params)
-    f.close()
-
-
-    # create the folders first if they dont exist
-    if not os.path.isdir(FILES_DIR):
-        os.makedirs(FILES_DIR)
-    if not os.path.isdir(CACHE_DIR):
-        os.makedirs(CACHE_DIR)
-    for type, typeDir in dirHash.items():
-        if not os.path.isdir( ConvertPath(typeDir) ):
-            os.makedirs(typeDir)
-        if not os.path.isdir( ConvertPath( opj(typeDir, "Trash")) ):
-            os.makedirs( opj(typeDir, "Trash") )
-    if not os.path.isdir(THUMB_DIR):
-        os.makedirs(THUMB_DIR)
+    """ rereads the config file only if it changed since the last time
+        and returns the current ConfigSnapshot
+    """
+    global config
+
+    mtime = os.stat(CONFIG_FILE).st_mtime
+    cfg = config
+    if cfg and cfg.mtime == mtime:
+        return cfg
+
+    configLock.acquire()
+    try:
+        if config and config.mtime == mtime:   # someone else just reloaded it
+            return config
+
+        cfg = ConfigSnapshot(mtime)
+        cfg.makeDirs()
+
+        config = cfg   # swap in the fully built snapshot
+        return cfg
+    finally:
+        configLock.release()
 
 
 
@@ -172,6 +225,7 @@ class Listener(ThreadingTCPServer):
 class SingleFileUpload(StreamRequestHandler):      
     """ one of these per file upload """
 
+    rbufsize = 0   # so that rfile doesn't read ahead into the file data after the header
     
     def handle(self):
         """ this is where we parse the incoming messages """
@@ -183,102 +237,120 @@ class SingleFileUpload(StreamRequestHandler):
             return
         (fileName, previewWidth, previewHeight, fileSize) = header.strip().split()
         previewSize = (int(previewWidth), int(previewHeight))
-        fileSize = int(fileSize)
+        fileSize = long(fileSize)
         
         # make sure the filename is ok
         fileName = os.path.basename(fileName)   # strip any directory and just keep the filename (for security reasons)
-        fileType = self.server.fileServer.GetFileType(fileName)
+        cfg = ParseConfigFile()
+        fileType = cfg.fileType(fileName)
         if not fileType:
             return #dont allow upload of anything that doesn't have an extension
         
-        # make the file
-        fullPath = opj(dirHash[fileType], fileName)
+        # receive into a temp file in the same directory and rename it when it's all there
+        # so that nobody ever sees a half written file under the real name
+        fullPath = opj(cfg.dirHash[fileType], fileName)
         try:
-            f=open(fullPath, "wb")
+            (fd, tmpPath) = tempfile.mkstemp(".upload", "."+fileName, cfg.dirHash[fileType])
+            f = os.fdopen(fd, "wb")
         except:
-            WriteLog("Cannot create file (have write permissions?):" + filePath)
+            WriteLog("Cannot create file (have write permissions?):" + fullPath)
             return
 
+        # read exactly fileSize bytes with a fixed buffer
+        buf = bytearray(UPLOAD_CHUNK_SIZE)
+        view = memoryview(buf)
         bytesRead = 0
         while RUN_SERVER and bytesRead < fileSize:
             try:
-                line = self.rfile.readline()
-                if not line:   # readline doesn't fail when socket is closed... it returns an empty string
-                    f.close()
-                    os.remove(fullPath)
+                n = self.request.recv_into(view, min(UPLOAD_CHUNK_SIZE, fileSize-bytesRead))
+                if n == 0:   # socket closed before we got the whole file
                     break
-                    
-                bytesRead+=len(line)
-                if bytesRead > fileSize:
-                    line = line.rstrip()   # remove the newline char at the end of transmission
-                f.write(line)
-                
+                f.write(view[:n])
+                bytesRead += n
             except socket.timeout:
                 continue
             except:
                 WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
-                f.close()
-                os.remove(fullPath)
                 break
-        else:
-            f.flush()
-            f.close()
-
-            # tell the client that all went well
-            self.wfile.write("1")  
-            
-            # make the preview if necessary and everything went well
-            self.server.onMsgCallback(fileName, previewSize)
-
 
+        f.close()
+        if bytesRead < fileSize:
+            os.remove(tmpPath)
+            return
 
+        if os.name == "nt" and os.path.exists(fullPath):
+            os.remove(fullPath)   # rename doesn't overwrite on Windows
+        os.rename(tmpPath, fullPath)
 
+        # tell the client that all went well
+        self.wfile.write("1")  
 
+        # make the preview if necessary and everything went well
+        self.server.onMsgCallback(fileName, previewSize)
 
 
 
 class FileLibrary:
     def __init__(self):
-        ParseConfigFile()
+        cfg = ParseConfigFile()
+
+        # the thumbnail worker processes (started before any of our threads)
+        self.thumbnails = thumbService.ThumbnailService()
+
+        # and the ones converting the uploaded images to DXT before the imageviewer needs them
+        if dirToDxt:
+            self.dxt = dirToDxt.DxtConverter(onResult=self.__OnDxtDone)
+        else:
+            self.dxt = None
+
+        # the index of all the files in the library
+        self.index = libraryIndex.LibraryIndex(opj(cfg.filesDir, INDEX_FILE), self.GetFileType)
+        self.index.scan(cfg.dirHash, force=True)
+
+        # files received from other FileServers
+        self.cache = fileCache.FileCache(CACHE_DIR, cfg.cacheSize*1048576L)
 
         # start the server that will accept the file data
-        self.fServer = Listener(8802, self.__MakePreview, self)
+        self.fServer = Listener(XMLRPC_PORT+2, self.__MakePreview, self)
         fServerThread = Thread(target=self.fServer.serve_forever)
         fServerThread.start()
 
+        # start the server for the streaming transfers (handles are given out through XML-RPC)
+        self.transfers = fileTransfer.TransferManager(self.__GetChecksum)
+        self.tServer = fileTransfer.TransferServer(TransferPort(XMLRPC_PORT), self.transfers,
+                                                   lambda: RUN_SERVER, WriteLog)
+        tServerThread = Thread(target=self.tServer.serve_forever)
+        tServerThread.start()
+
 
         ### used by clients to test the connection with the server
     def TestConnection(self):
-        return (FILES_DIR, 0)
+        return (ParseConfigFile().filesDir, 0)
 
 
          ### gets the file info:
         ### full path, file type, application info, size (for images...), file size
     def GetFileInfo(self, filename, fileSize=-1, path=None):
         try:
-            ParseConfigFile()
-            fileType = self.GetFileType(filename)
+            cfg = ParseConfigFile()
+            fileType = cfg.fileType(filename)
             size = (-1, -1)
             fileExists = False
 
             if fileType:  #is file even supported
-                appName = viewers[fileType][0]
-                params = viewers[fileType][1]
+                appName = cfg.viewers[fileType][0]
+                params = cfg.viewers[fileType][1]
                 if path == None:  # the user dropped a new file on there
-                    fullPath = opj(self.__GetFilePath(fileType), filename)  # return a default path if not passed in
-                    res = self.__FileAlreadyThere(filename, fileType, fileSize)
+                    fullPath = opj(self.__GetFilePath(cfg, fileType), filename)  # return a default path if not passed in
+                    self.index.scan(cfg.dirHash)
+                    res = self.index.findFile(filename, fileType, fileSize)
                     if res:  #if the file was found it will return its directory
-                        if fileType == "image":   #if the file is an image, return its size
-                            try:
-                                imsize = imagesize(fullPath)
-                                size = (imsize[1], imsize[0])
-                            except:
-                                size = (-1,-1)
-
                         fullPath = opj(res, filename)  #the path of the found file
                         fileExists = True
+                        if fileType == "image":   #if the file is an image, return its size
+                            size = self.__GetImageSize(fullPath)
                         
-                elif not self.__LegalPath(path):
+                elif not self.__LegalPath(cfg, path):
                     return False
                 else:             # the user is trying to show an existing file
                     path = ConvertPath(path)
@@ -287,11 +359,7 @@ class FileLibrary:
                     if os.path.isfile(fullPath):
                         fileExists = True
                         if fileType == "image":   #if the file is an image, return its size
-                            try:
-                                imsize = imagesize(fullPath)
-                                size = (imsize[1], imsize[0])
-                            except:
-                                size = (-1,-1)
+                            size = self.__GetImageSize(fullPath)
                 return (fileType, size, fullPath, appName, params, fileExists) 
             else:
                 return False  #file type not supported
@@ -302,22 +370,33 @@ class FileLibrary:
 
         ### gets the metadata information about the file
     def GetMetadata(self, fullPath):
+        cfg = ParseConfigFile()
         fullPath = ConvertPath(fullPath)
-        if not self.__LegalPath(fullPath):
+        if not self.__LegalPath(cfg, fullPath):
             return False
 
         try:
-            fileType = self.GetFileType(fullPath)
+            fileType = cfg.fileType(fullPath)
             if not fileType:
                 return False
-            elif fileType == "pdf":    # for pdfs
-                return "Pages: "+str(countPDFpages.getPDFPageCount(fullPath))
+
+            info = self.index.getInfo(fullPath)
+            if info and info["metadata"] is not None:   # parsed before and the file didn't change since
+                return info["metadata"] or False
+            
+            if fileType == "pdf":    # for pdfs
+                pages = countPDFpages.getPDFPageCount(fullPath)
+                metadata = "Pages: "+str(pages)
+                self.index.setInfo(fullPath, pages=pages, metadata=metadata)
+                return metadata
             else:                      # for all other types
                 metadata = mmpython.parse(fullPath)
                 if metadata:   # metadata extracted successfully
-                    return unicode(metadata).encode('latin-1', 'replace')
+                    metadata = unicode(metadata).encode('latin-1', 'replace')
                 else:
-                    return False
+                    metadata = ""    # so that we don't try parsing it again
+                self.index.setInfo(fullPath, metadata=metadata)
+                return metadata or False
         except:
             WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
             return False
@@ -326,13 +405,12 @@ class FileLibrary:
         ### construct a hash of all the files keyed by the directory in which the files
         ### are and return it
     def GetFiles(self):
-        ParseConfigFile()
-        numDirs = 0
-        numFiles = 0
+        cfg = ParseConfigFile()
+        self.index.scan(cfg.dirHash)
         
         fileHash = {}
-        for fileType in dirHash.iterkeys():
-            fileHash[fileType] = self.__TraverseDir( self.__GetFilePath(fileType), fileType )
+        for fileType in cfg.dirHash.iterkeys():
+            fileHash[fileType] = self.index.listTree( self.__GetFilePath(cfg, fileType), fileType )
         return fileHash
     
 
@@ -340,8 +418,9 @@ class FileLibrary:
     # FIX to delete the thumbnails for all the images in this folder
     def DeleteFolder(self, fullPath):
         try:
-            if self.__LegalPath(fullPath):  # prevent users from deleting anything
+            if self.__LegalPath(ParseConfigFile(), fullPath):  # prevent users from deleting anything
                 shutil.rmtree(ConvertPath(fullPath))
+                self.index.dirRemoved(ConvertPath(fullPath))
                 return True
             else:
                 return False
@@ -353,9 +432,10 @@ class FileLibrary:
         ### makes a new folder
     def NewFolder(self, fullPath):
         try:
-            if self.__LegalPath(fullPath):  # prevent users from deleting anything
+            if self.__LegalPath(ParseConfigFile(), fullPath):  # prevent users from deleting anything
                 os.mkdir(ConvertPath(fullPath))
                 self.__SetWritePermissions(ConvertPath(fullPath))
+                self.index.invalidateDir(os.path.dirname(ConvertPath(fullPath)))
                 return True
             else:
                 return False
@@ -367,14 +447,15 @@ class FileLibrary:
         ### move the file to Trash
     def DeleteFile(self, fullPath):
         try:
+            cfg = ParseConfigFile()
             fullPath = ConvertPath(fullPath)
-            if not self.__LegalPath(fullPath):  # restrict the users to the FILES_DIR folder
+            if not self.__LegalPath(cfg, fullPath):  # restrict the users to the library folder
                 return False
-            fileType = self.GetFileType(fullPath)
+            fileType = cfg.fileType(fullPath)
             if not fileType:  # no extension so don't allow deletion
                 return False
 
-            trashPath = opj( opj(self.__GetFilePath(fileType), "Trash"), os.path.split(fullPath)[1] )
+            trashPath = opj( opj(self.__GetFilePath(cfg, fileType), "Trash"), os.path.split(fullPath)[1] )
             self.MoveFile( fullPath, trashPath )
             return True
         
@@ -386,16 +467,18 @@ class FileLibrary:
         ### deletes the file from the library (also deletes it's thumbnail preview if it exists)
     def DeleteFilePermanently(self, fullPath):
         try:
+            cfg = ParseConfigFile()
             fullPath = ConvertPath(fullPath)
-            if not self.__LegalPath(fullPath):  # restrict the users to the FILES_DIR folder
+            if not self.__LegalPath(cfg, fullPath):  # restrict the users to the library folder
                 return False
-            fileType = self.GetFileType(fullPath)
+            fileType = cfg.fileType(fullPath)
             if not fileType:  # no extension so don't allow deletion
                 return False
 
-            previewPath = self.__GetPreviewName(fullPath)
+            previewPath = self.__GetPreviewName(cfg, fullPath)
             if os.path.isfile(fullPath): # prevent users from deleting anything 
                 os.remove( fullPath )      #remove the file itself
+                self.index.fileRemoved(fullPath)
                 dxtFilePath = fullPath.rstrip(os.path.splitext(fullPath)[1])+".dxt"
                 if os.path.isfile(dxtFilePath):
                     os.remove( dxtFilePath )  # remove the dxt file if it exists
@@ -411,11 +494,13 @@ class FileLibrary:
     def MoveFile(self, oldFullPath, newFullPath):
         oldFullPath = ConvertPath(oldFullPath)
         newFullPath = ConvertPath(newFullPath)
-        if not self.__LegalPath(oldFullPath, newFullPath):  # restrict the movement to the FILES_DIR
+        if not self.__LegalPath(ParseConfigFile(), oldFullPath, newFullPath):  # restrict the movement to the library folder
             return False
         if os.path.isfile(oldFullPath):
             try:
                 shutil.move(oldFullPath, newFullPath)
+                self.index.fileRemoved(oldFullPath)
+                self.index.fileChanged(newFullPath)
                 oldDxtFilePath = oldFullPath.rstrip(os.path.splitext(oldFullPath)[1])+".dxt"
                 newDxtFilePath = newFullPath.rstrip(os.path.splitext(newFullPath)[1])+".dxt"
                 if os.path.isfile(oldDxtFilePath):
@@ -432,12 +517,13 @@ class FileLibrary:
         ### the default directory for that file type
     def UploadFile(self, name, data, previewSize=(150, 150)):
         name = os.path.basename(name)   # strip any directory and just keep the filename (for security reasons)
-        fileType = self.GetFileType(name)
+        cfg = ParseConfigFile()
+        fileType = cfg.fileType(name)
         if not fileType:
             return False  #dont allow upload of anything that doesn't have an extension
         try:
             # write the file
-            f=open( opj(dirHash[fileType], name), "wb")
+            f=open( opj(cfg.dirHash[fileType], name), "wb")
             f.write( base64.decodestring(data) )
             f.close()
             del data
@@ -450,14 +536,50 @@ class FileLibrary:
             return False
 
 
+        ### prepares a streaming upload of a file into the library
+        ### (sizes are passed as strings because XML-RPC ints are only 32 bits)
+        ### returns (handle, offset to resume from) for the transfer channel
+    def OpenUpload(self, name, size, checksum, previewSize=(150, 150)):
+        name = os.path.basename(name)   # strip any directory and just keep the filename (for security reasons)
+        cfg = ParseConfigFile()
+        fileType = cfg.fileType(name)
+        if not fileType:
+            return False  #dont allow upload of anything that doesn't have an extension
+        try:
+            def onDone(fullPath):
+                self.__MakePreview(name, previewSize)
+            t = self.transfers.openUpload(opj(cfg.dirHash[fileType], name), long(size), checksum, onDone)
+            return (t.handle, str(t.bytesReceived()))
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+            return False
+
+
+        ### prepares a streaming download of a file from the library
+        ### returns (handle, size, md5 checksum) for the transfer channel
+    def OpenDownload(self, fullPath):
+        fullPath = ConvertPath(fullPath)
+        if not self.__LegalPath(ParseConfigFile(), fullPath) or not os.path.isfile(fullPath):
+            return False
+        try:
+            t = self.transfers.openDownload(fullPath)
+            return (t.handle, str(t.size), t.checksum)
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+            return False
+
+
     def UploadLink(self, url):
         name = os.path.basename(url)   # strip any directory and just keep the filename (for security reasons)
-        fileType = self.GetFileType(name)
+        cfg = ParseConfigFile()
+        fileType = cfg.fileType(name)
         if not fileType:
             return False  #dont allow upload of anything that doesn't have an extension
 
         try:
-            filename, headers = urllib.urlretrieve(url, opj(dirHash[fileType], name))
+            filename, headers = urllib.urlretrieve(url, opj(cfg.dirHash[fileType], name))
+            self.index.fileChanged(filename)
+            self.__ConvertToDxt(filename, fileType)
             return True
         except:
             return False
@@ -475,6 +597,22 @@ class FileLibrary:
             WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
             return False
 
+
+        ### same as GetPreview but returns a download handle for the
+        ### transfer channel instead of the base64 encoded thumbnail
+        ### or "pending" if the thumbnail is still being made (ask again later)
+    def OpenPreview(self, fullPath):
+        try:
+            res = self.RequestThumbnail(fullPath)
+            if res and res != thumbService.PENDING:
+                t = self.transfers.openDownload(res)
+                return (t.handle, str(t.size), t.checksum)
+            else:
+                return res
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+            return False
+
         
 ##         fullPath = ConvertPath(fullPath)
 ##         if not self.__LegalPath(fullPath):
@@ -508,23 +646,46 @@ class FileLibrary:
 ##             return False
 
 
+        ### makes the thumbnail and waits for it (for older clients)
     def MakeThumbnail(self, fullPath):
+        cfg = ParseConfigFile()
+        res = self.__RequestThumbnail(cfg, fullPath, True)
+        if res == thumbService.PENDING:
+            previewPath = self.__GetPreviewName(cfg, ConvertPath(fullPath))
+            if self.thumbnails.wait(previewPath, THUMB_WAIT) == thumbService.DONE:
+                return previewPath
+            return False
+        return res
+
+
+        ### queues the thumbnail with the worker processes if it doesn't exist yet
+        ### returns its path if it's ready, "pending" if it's being made or False
+    def RequestThumbnail(self, fullPath, visible=True):
+        return self.__RequestThumbnail(ParseConfigFile(), fullPath, visible)
+
+
+    def __RequestThumbnail(self, cfg, fullPath, visible):
         fullPath = ConvertPath(fullPath)
-        if not self.__LegalPath(fullPath):
+        if not self.__LegalPath(cfg, fullPath):
             return False
-        fileType = self.GetFileType(fullPath)
+        fileType = cfg.fileType(fullPath)
         
         try:
             if not os.path.isfile(fullPath):
                 return False
 
-            previewPath = self.__GetPreviewName(fullPath)
-            if not os.path.isfile(previewPath):  #if the preview doesnt exist, make it
-                makeThumbs.makeThumbnail(fullPath, fileType, previewPath)
-                if not os.path.isfile(previewPath):
-                    return False
-                
-            return previewPath
+            if visible:  priority = thumbService.PRIORITY_VISIBLE
+            else:        priority = thumbService.PRIORITY_BACKGROUND
+
+            previewPath = self.__GetPreviewName(cfg, fullPath)
+            res = self.thumbnails.request(fullPath, fileType, previewPath, priority)
+            if res == thumbService.DONE:
+                self.index.setInfo(fullPath, thumb=previewPath)
+                return previewPath
+            elif res == thumbService.PENDING:
+                return thumbService.PENDING
+            else:
+                return False
         except:
             WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]))
             return False
@@ -533,58 +694,135 @@ class FileLibrary:
 
         ### get the file ready for loading by the app on the "host" machine
     def PrepareFile(self, fullPath, host):
-        if not self.__LegalPath(fullPath):
+        if not self.__LegalPath(ParseConfigFile(), fullPath):
             return False
         
         # make the connection with the remote FileServer
-        fileServer = xmlrpclib.ServerProxy("http://"+str(host)+":8800")
+        (host, port) = SplitHost(host)
+        fileServer = xmlrpclib.ServerProxy("http://"+host+":"+str(port))
 
         try:
             # if the file exists already, there's no need to transfer it 
-            filePath = fileServer.FileExists(fullPath, os.stat(fullPath).st_size)
+            fileSize = os.stat(fullPath).st_size
+            filePath = fileServer.FileExists(fullPath, str(fileSize))
         except:
             WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
             return False
         if filePath:
             return filePath  # if the file is already cached, just send the path back
-        else:
+
+        try:
+            # file is not cached so stream it to the remote FileServer
+            res = fileServer.OpenCacheUpload(os.path.basename(fullPath), str(fileSize),
+                                             self.transfers.checksum(fullPath))
+        except xmlrpclib.Fault:
+            return self.__PrepareFileOld(fileServer, fullPath)   # remote FileServer is too old for streaming
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+            return False
+
+        if not res:
+            return False
+        (handle, offset, filePath) = res
+        if not handle:
+            return filePath   # the remote side already has this content cached (maybe under another name)
+        try:
+            if fileTransfer.upload(host, handle, long(offset), fullPath, TransferPort(port)):
+                return filePath
+            else:
+                return False
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+            return False
+
+
+        ### gets the file ready on many hosts at once: the file is sent only once to
+        ### the first host that needs it and each host relays it to the next one
+        ### hosts are "host" or "host:port", returns the paths in the same order
+        ### (the UI only shows files on one SAGE machine at a time so nothing calls
+        ### this yet, CHECK_RELAY.py runs it against several local FileServers)
+    def PrepareFiles(self, fullPath, hosts):
+        if not self.__LegalPath(ParseConfigFile(), fullPath):
+            return False
+
+        try:
+            fileSize = os.stat(fullPath).st_size
+            checksum = self.transfers.checksum(fullPath)
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+            return False
+        filename = os.path.basename(fullPath)
+
+        # open the uploads from the end of the chain so that
+        # every host already knows the handle of the next one
+        paths = {}
+        chain = []   # the hosts the file will be relayed through (in reverse)
+        nextHost = ("", "")
+        for spec in reversed(hosts):
             try:
-                # file is not cached so read it and send it to the remote FileServer
-                fileData = self.__ReadFile(fullPath)
+                (host, port) = SplitHost(spec)
+                fileServer = xmlrpclib.ServerProxy("http://"+host+":"+str(port))
+                filePath = fileServer.FileExists(fullPath, str(fileSize))
+                if filePath:
+                    paths[spec] = filePath
+                    continue
+                res = fileServer.OpenCacheUpload(filename, str(fileSize), checksum, nextHost[0], nextHost[1])
+                if res:
+                    (handle, offset, filePath) = res
+                    paths[spec] = filePath
+                    if handle:
+                        chain.append(spec)
+                        nextHost = (spec, handle)
+            except:   # unreachable or too old for relaying... tried separately below
+                WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+
+        # send it to the head of the chain
+        if chain:
+            (host, port) = SplitHost(nextHost[0])
+            try:
+                if not fileTransfer.upload(host, nextHost[1], 0, fullPath, TransferPort(port)):
+                    for spec in chain:
+                        del paths[spec]   # we don't know who got it... whoever did will report a cache hit
             except:
                 WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
-                return False
-            else:
-                return fileServer.PutFile(os.path.basename(fullPath), fileData)
+                for spec in chain:
+                    del paths[spec]
+
+        # whatever didn't work out is sent directly
+        result = []
+        for spec in hosts:
+            if spec not in paths:
+                paths[spec] = self.PrepareFile(fullPath, spec)
+            result.append(paths[spec])
+        return result
+
+
+        ### the old way of sending the whole file as base64 through XML-RPC
+    def __PrepareFileOld(self, fileServer, fullPath):
+        try:
+            fileData = self.__ReadFile(fullPath)
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+            return False
+        else:
+            return fileServer.PutFile(os.path.basename(fullPath), fileData)
  
 
         ### gets the extension of the file that was passed in
     def GetFileType(self, thefile):
         try:
-            filename = os.path.basename( thefile )
-            extension = os.path.splitext(filename)[1].lower()
-            fileType = False
-            for fType in types.iterkeys():
-                    if extension in types[ fType ]:
-                        fileType = fType
-            return fileType
+            return ParseConfigFile().fileType(thefile)
         except:
             return False
         
 
-        ### does file exist in the cache already?? if not, someone will have to send it here
+        ### is the file on this machine already?? if not, someone will have to send it here
+        ### (cached copies are only found by their content, see OpenCacheUpload)
     def FileExists(self, fullPath, size):
         fullPath = ConvertPath(fullPath)
-        if os.path.isfile(fullPath):  # if the file server is on the same machine then we can 
+        if os.path.isfile(fullPath) and not SEPARATE_SITE:  # if the file server is on the same machine then we can 
             return fullPath           # just read the file directly from the file_library
-        filename = "_".join(os.path.basename(fullPath).split())
-        if filename == "":  # if it's a directory
-            return False
-        path = os.path.abspath( opj(CACHE_DIR, filename) )
-        if os.path.isfile(path) and os.stat(path).st_size==size:  #compare the sizes as well
-            return path
-        else:
-            return False
+        return False
 
 
         ### called by the remote FileServer to upload the file 
@@ -593,23 +831,90 @@ class FileLibrary:
             filename = "_".join(os.path.basename(filename).split()) # strip the directory and keep just the name (security reasons)
             if filename == "":
                 return False
-            f=open( opj(CACHE_DIR, filename), "wb")
-            f.write( base64.decodestring(data) )
-            f.close()
-            self.__SetWritePermissions(opj(CACHE_DIR, filename))
+            data = base64.decodestring(data)
+            checksum = hashlib.md5(data).hexdigest()
+            filePath = self.cache.lookup(checksum)
+            if filePath:
+                return filePath
+            
+            if not self.cache.reserve(len(data), checksum):
+                WriteLog("Cache is full of pinned files, can't accept: " + filename)
+                return False
+            try:
+                filePath = os.path.abspath( self.cache.pathFor(checksum, filename) )
+                f=open( filePath, "wb")
+                f.write( data )
+                f.close()
+                self.__SetWritePermissions(filePath)
+                self.cache.add(checksum, filePath)
+            except:
+                self.cache.release(checksum)
+                raise
 
             del data
-            return os.path.abspath( opj(CACHE_DIR, filename) )  #return the path of the file to be passed to the app
+            return filePath  #return the path of the file to be passed to the app
         except:
             del data
             WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
             return False
 
 
+        ### called by the remote FileServer to start streaming a file into the cache
+        ### returns (handle, offset to resume from, path the file will have here)
+        ### the handle is empty if a file with the same content is cached already
+        ### if relayHost ("host" or "host:port") and relayHandle are given, the data
+        ### is passed on to that FileServer while it's being received
+    def OpenCacheUpload(self, filename, size, checksum, relayHost="", relayHandle=""):
+        try:
+            filename = "_".join(os.path.basename(filename).split()) # strip the directory and keep just the name (security reasons)
+            if filename == "" or not CHECKSUM_RE.match(checksum):
+                return False
+
+            filePath = self.cache.lookup(checksum)
+            if filePath:
+                return ("", "0", filePath)
+
+            if not self.cache.reserve(long(size), checksum):
+                WriteLog("Cache is full of pinned files, can't accept: " + filename)
+                return False
+            
+            def onDone(fullPath):
+                self.__SetWritePermissions(fullPath)
+                self.cache.add(checksum, fullPath)
+            def onFail():
+                self.cache.release(checksum)
+            relay = None
+            if relayHost and relayHandle:
+                (host, port) = SplitHost(relayHost)
+                relay = (host, TransferPort(port), relayHandle)
+            fullPath = os.path.abspath( self.cache.pathFor(checksum, filename) )
+            t = self.transfers.openUpload(fullPath, long(size), checksum, onDone, relay, onFail)
+            return (t.handle, str(t.bytesReceived()), fullPath)
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+            return False
+
+
+        ### cached files that are being displayed can be pinned so they don't get evicted
+    def PinCachedFile(self, fullPath):
+        return self.cache.pin(fullPath)
+
+    def UnpinCachedFile(self, fullPath):
+        return self.cache.unpin(fullPath)
+
+
+        ### hit/miss/eviction counters and the size of the cache
+    def GetCacheStats(self):
+        return self.cache.stats()
+
+
         ### so that the server can be quit remotely
     def Quit(self, var):
         global RUN_SERVER
         RUN_SERVER = False
+        self.thumbnails.stop()
+        if self.dxt:
+            self.dxt.stop()
         return 1
 
 
@@ -623,9 +928,7 @@ class FileLibrary:
         ### constructs the preview name from the filename
         ### preview name is: filename+fileSize+original_extension
         ### (such as trees56893.jpg where 56893 is file size in bytes)
-    def __GetPreviewName(self, fullPath):
-        fileType = self.GetFileType(fullPath)
-
+    def __GetPreviewName(self, cfg, fullPath):
         fileSize = os.stat(fullPath).st_size
         (root, ext) = os.path.splitext( os.path.basename(fullPath) )
         previewName = root+str(fileSize)+ext        #construct the preview name
@@ -633,27 +936,37 @@ class FileLibrary:
         # all the files have .jpg tacked onto the end
         previewName += ".jpg"
             
-        return opj( THUMB_DIR, previewName )
+        return opj( cfg.thumbDir, previewName )
 
 
+        ### queues the preview for a freshly uploaded file with the thumbnail workers
+        ### (all thumbnails are made at the same size so previewSize isn't used anymore)
     def __MakePreview(self, name, previewSize):
         try:
-            wxImageType = self.__GetWxBitmapType(name)
-            if wxImageType:     # some types just cant be saved by wxPython
-                fileType = self.GetFileType(name)
-                # write the preview but name it with a filename and filesize so that they are unique
-                previewPath = self.__GetPreviewName(opj(dirHash[fileType], name))
-                im = wx.Image(opj(dirHash[fileType], name))  # read the original image
-
-                if im.Ok():  #the image may be corrupted...
-                    im.Rescale(previewSize[0], previewSize[1])        # resize it
-                    im.SaveFile(previewPath, wxImageType)    # save it back to a file
-                self.__SetWritePermissions(previewPath, opj(dirHash[fileType], name))
+            cfg = ParseConfigFile()
+            fileType = cfg.fileType(name)
+            fullPath = opj(cfg.dirHash[fileType], name)
+            self.__SetWritePermissions(fullPath)
+            self.index.fileChanged(fullPath)
+            self.thumbnails.request(fullPath, fileType, self.__GetPreviewName(cfg, fullPath),
+                                    thumbService.PRIORITY_BACKGROUND)
+            self.__ConvertToDxt(fullPath, fileType)
         except:
             WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
             pass    # no preview was saved... oh well
 
 
+        ### queues a new image for the DXT conversion (a stale .dxt is replaced)
+    def __ConvertToDxt(self, fullPath, fileType):
+        if self.dxt and fileType == "image":
+            self.dxt.enqueue(fullPath)
+
+
+    def __OnDxtDone(self, fullPath, pixels, seconds, error):
+        if error:
+            WriteLog("DXT conversion of "+fullPath+" failed: "+error)
+
+
 
         ### change the permission of the settings file to allow everyone to write to it
     def __SetWritePermissions(self, *files):
@@ -665,6 +978,11 @@ class FileLibrary:
                 WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
                 
         
+        ### the md5 of a library file is computed once and kept in the index
+    def __GetChecksum(self, fullPath):
+        return self.index.getChecksum(fullPath, fileTransfer.fileChecksum)
+
+
         ### reads a file and encodes it in a string (for transfer over the network)
     def __ReadFile(self, fullPath):
         f = open(fullPath, "rb")
@@ -673,47 +991,18 @@ class FileLibrary:
         return fileData
 
 
-        ### looks through all the files of the same type 
-        ### and figures out if the files is already there (optionally compare the file sizes as well)
-        ### if the same file is found, it will return its path
-    def __FileAlreadyThere(self, filename, fileType, size):
-        dirPath = self.__GetFilePath(fileType)
-        fileDir = False
-        
-        def LookForFile(dirPath, fileType, fileDir):
-            if fileDir:
-                return fileDir  #this will prevent the recursion to go on if we found a file (base case)
-            dirPath = ConvertPath(dirPath)
-            items = os.listdir(dirPath)
-            files = []
-            dirs = {}
-            for item in items:   #loop through all the items in this directory (files or dirs)
-                if os.path.isfile( opj(dirPath, item) ):  #is it a file
-                    if item.lower() == filename.lower():  #are their filenames equal
-                        if size==-1 or size==os.stat(opj(dirPath, item)).st_size:
-                            fileDir = dirPath
-                            return dirPath
-                elif os.path.isdir( opj(dirPath, item) ):  #is it a directory
-                    LookForFile( opj(dirPath, item), fileType, fileDir)  #if so, search in it
-            return False
-
-        return LookForFile(dirPath, fileType, fileDir)
-
-
-       ### recursively traverses the given directory
-       ### it return a tuple of (dir-path, list-of-dirs, files)
-    def __TraverseDir(self, dirPath, fileType):
-        dirPath = ConvertPath(dirPath)
-        items = os.listdir(dirPath)
-        files = []
-        dirs = {}
-        for item in items:
-            if os.path.isfile( opj(dirPath, item) ):
-                if self.GetFileType(item):  #if the file is supported, add it to the list, otherwise disregard it
-                    files.append(item)
-            elif os.path.isdir( opj(dirPath, item) ):
-                dirs[item] = self.__TraverseDir( opj(dirPath, item), fileType )
-        return (dirPath, dirs, files, fileType)
+        ### returns the (width, height) of the image, read from the header only once
+    def __GetImageSize(self, fullPath):
+        info = self.index.getInfo(fullPath)
+        if info and info["width"] is not None:
+            return (info["width"], info["height"])
+        try:
+            imsize = imagesize(fullPath)
+            size = (imsize[1], imsize[0])
+        except:
+            size = (-1,-1)
+        self.index.setInfo(fullPath, width=size[0], height=size[1])
+        return size
 
 
        ### you pass it in a filename and it figures out the wx.BITMAP_TYPE and returns it
@@ -736,23 +1025,23 @@ class FileLibrary:
 
 
         ### gets the default path for a certain file type
-    def __GetFilePath(self, type=None):
+    def __GetFilePath(self, cfg, type=None):
         if type == None:
-            return FILES_DIR 
+            return cfg.filesDir 
         else:
-            return dirHash[type]
+            return cfg.dirHash[type]
 
 
 
-        ### Checks whether all the paths are still within FILES_DIR (for security issues)
-    def __LegalPath(self, *pathList):
+        ### Checks whether all the paths are still within the library folder (for security issues)
+    def __LegalPath(self, cfg, *pathList):
         try:
             normedPathList = []
-            normedPathList.append(FILES_DIR)
+            normedPathList.append(cfg.filesDir)
             for path in pathList:
                 if path != "":
                     normedPathList.append( os.path.normpath( os.path.realpath(path) ) )  # normalize all the paths (remove ../ kinda stuff)
-            return (os.path.commonprefix(normedPathList) == FILES_DIR)
+            return (os.path.commonprefix(normedPathList) == cfg.filesDir)
         except:
             return False   #if anything fails, it's safer to assume that it's an illegal action
 
@@ -763,6 +1052,21 @@ class FileLibrary:
 
 
 
+# "host" or "host:port" --> (host, XML-RPC port of the FileServer there)
+def SplitHost(host):
+    host = str(host)
+    if ":" in host:
+        (host, port) = host.rsplit(":", 1)
+        return (host, int(port))
+    return (host, 8800)
+
+
+# the streaming transfers of the FileServer listening on that XML-RPC port
+def TransferPort(port):
+    return int(port) + 3
+
+
+
 # to output all the error messages to a file
 def WriteLog(message):
     try:
@@ -814,10 +1118,21 @@ def main(argv):
 ##             sys.__stdin__ = dummyStream()
 
 
+    # a different port can be given with "-p port" so that
+    # more than one FileServer can run on the same machine
+    global XMLRPC_PORT, CACHE_DIR, SEPARATE_SITE
+    if "-p" in argv:
+        XMLRPC_PORT = int(argv[argv.index("-p")+1])
+        CACHE_DIR = getUserPath("fileServer", "file_server_cache_"+str(XMLRPC_PORT))
+
+    # with "-r" files from other FileServers are always sent here even if
+    # they are on the same filesystem (for testing several sites on one machine)
+    SEPARATE_SITE = "-r" in argv
+
     wx.InitAllImageHandlers()
 
     # start the XMLRPC server
-    server = MyServer(("", 8800), SimpleXMLRPCRequestHandler, logRequests=False)
+    server = MyServer(("", XMLRPC_PORT), SimpleXMLRPCRequestHandler, logRequests=False)
     server.register_instance(FileLibrary())
     server.serve_forever()
 
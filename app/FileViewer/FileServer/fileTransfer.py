@@ -0,0 +1,465 @@
+############################################################################
+#
+# -= FileViewer =-
+#
+# fileTransfer - streaming binary transfer channel between FileServers
+#                (and clients) that replaces base64 data inside XML-RPC calls
+#
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about FileViewer to www.evl.uic.edu/cavern/forum
+#
+############################################################################
+
+#
+# The XML-RPC methods only hand out transfer handles. The data itself goes
+# over a plain TCP connection to TRANSFER_PORT:
+#
+#    client -> server:   "GET <handle> <offset>\n"
+#    server -> client:   raw file bytes [offset, size)
+#
+#    client -> server:   "PUT <handle> <offset>\n" + raw bytes [offset, size)
+#    server -> client:   "1" if the whole file arrived and the checksum matched, "0" otherwise
+#
+# A PUT handle can name the handle of another server to relay to. The data
+# is then forwarded chunk by chunk while it's being received so a chain of
+# servers gets the file in about the time of a single transfer. The "1" is
+# only sent back once everybody down the chain has verified the file.
+#
+# Downloads are sent with sendfile() when it's available so the server never
+# copies the file through userspace. Every handle carries the md5 of the whole
+# file and the receiving side hashes the data as it writes it, so a transfer
+# can be resumed from any offset and still be verified end to end.
+#
+
+import os, os.path, sys, socket, threading, binascii, hashlib, errno, select
+from time import time
+from SocketServer import ThreadingTCPServer, StreamRequestHandler
+
+try:
+    from sendfile import sendfile   # pysendfile, zero-copy transfers on Linux/Mac
+except ImportError:
+    sendfile = getattr(os, "sendfile", None)
+
+
+TRANSFER_PORT = 8803
+CHUNK_SIZE = 1048576         # fixed size of every read/write on the data channel
+HANDLE_TIMEOUT = 3600        # unused handles are dropped after this many seconds
+SOCKET_TIMEOUT = 0.5         # so that the server can quit properly
+DATA_TIMEOUT = 60            # a data connection that stalls this long is dropped (and its handle freed for a resume)
+PART_EXT = ".part"           # partially received files (kept around for resuming)
+
+
+
+def fileChecksum(fullPath):
+    """ md5 hexdigest of the file read in fixed size chunks """
+    md5 = hashlib.md5()
+    f = open(fullPath, "rb")
+    try:
+        data = f.read(CHUNK_SIZE)
+        while data:
+            md5.update(data)
+            data = f.read(CHUNK_SIZE)
+    finally:
+        f.close()
+    return md5.hexdigest()
+
+
+
+class Transfer:
+    """ state of one upload or download, referenced by its handle """
+
+    def __init__(self, direction, fullPath, size, checksum, onDone=None, relay=None, onFail=None):
+        self.handle = binascii.hexlify(os.urandom(16))
+        self.direction = direction     # "GET" or "PUT"
+        self.fullPath = fullPath       # the file to send or the final name of the received file
+        self.size = size
+        self.checksum = checksum
+        self.lastUsed = time()
+        self.lock = threading.Lock()   # one connection per handle at a time
+        self.onDone = onDone           # called with the final path once an upload is verified
+        self.relay = relay             # (host, port, handle) of the next server in a chain
+        self.onFail = onFail           # called when an upload is given up (bad checksum or expired handle)
+
+
+    def partPath(self):
+        return self.fullPath + PART_EXT
+
+
+    def bytesReceived(self):
+        """ how much of an upload is already on disk (the offset to resume from) """
+        try:
+            return os.stat(self.partPath()).st_size
+        except OSError:
+            return 0
+
+
+
+class TransferManager:
+    """ keeps track of all the handles handed out through XML-RPC """
+
+    def __init__(self, computeChecksum=None):
+        self.__transfers = {}   # keyed by handle
+        self.__lock = threading.Lock()
+        self.__checksums = {}   # (fullPath, size, mtime) --> md5
+        self.__computeChecksum = computeChecksum   # optional persistent store of the checksums
+
+
+    def checksum(self, fullPath):
+        """ md5 of the file, computed only once per version of the file """
+        if self.__computeChecksum:
+            return self.__computeChecksum(fullPath)
+        st = os.stat(fullPath)
+        key = (fullPath, st.st_size, st.st_mtime)
+        if key not in self.__checksums:
+            self.__checksums[key] = fileChecksum(fullPath)
+        return self.__checksums[key]
+
+
+    def openDownload(self, fullPath):
+        t = Transfer("GET", fullPath, os.stat(fullPath).st_size, self.checksum(fullPath))
+        self.__add(t)
+        return t
+
+
+    def openUpload(self, fullPath, size, checksum, onDone=None, relay=None, onFail=None):
+        """ a new upload of the same file replaces the old handle (without calling its onFail) """
+        t = Transfer("PUT", fullPath, size, checksum, onDone, relay, onFail)
+        if t.bytesReceived() > size:   # a stale leftover, can't be resumed
+            os.remove(t.partPath())
+        self.__add(t)
+        return t
+
+
+    def get(self, handle):
+        self.__lock.acquire()
+        try:
+            t = self.__transfers.get(handle)
+            if t:
+                t.lastUsed = time()
+            return t
+        finally:
+            self.__lock.release()
+
+
+    def close(self, handle):
+        self.__lock.acquire()
+        try:
+            if handle in self.__transfers:
+                del self.__transfers[handle]
+        finally:
+            self.__lock.release()
+
+
+    def fail(self, handle):
+        """ closes an upload that can't be completed anymore and tells its owner """
+        self.__lock.acquire()
+        try:
+            t = self.__transfers.pop(handle, None)
+        finally:
+            self.__lock.release()
+        if t and t.onFail:
+            t.onFail()
+
+
+    def __add(self, t):
+        self.__lock.acquire()
+        try:
+            now = time()
+            expired = []
+            for handle, old in self.__transfers.items():
+                if now - old.lastUsed > HANDLE_TIMEOUT:   # expire forgotten handles
+                    del self.__transfers[handle]
+                    expired.append(old)
+                elif t.direction == "PUT" and old.direction == "PUT" and old.fullPath == t.fullPath:
+                    del self.__transfers[handle]          # replaced by the new one
+            self.__transfers[t.handle] = t
+        finally:
+            self.__lock.release()
+
+        for old in expired:
+            if old.direction == "PUT" and old.onFail:
+                old.onFail()
+
+
+
+class TransferServer(ThreadingTCPServer):
+    """ accepts the data connections for the handles in the TransferManager """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port, manager, isRunning, writeLog):
+        self.manager = manager
+        self.isRunning = isRunning    # function returning False when we should quit
+        self.writeLog = writeLog
+        ThreadingTCPServer.__init__(self, ('', int(port)), TransferRequest)
+        self.socket.settimeout(SOCKET_TIMEOUT)
+
+
+    def serve_forever(self):
+        while self.isRunning():
+            try:
+                self.handle_request()
+            except socket.timeout:
+                pass
+            except KeyboardInterrupt:
+                break
+            except:
+                self.writeLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+                break
+
+
+
+class TransferRequest(StreamRequestHandler):
+    """ one of these per data connection """
+
+    def handle(self):
+        self.request.settimeout(DATA_TIMEOUT)
+        try:
+            (cmd, handle, offset) = self.rfile.readline(1024).split()
+            offset = int(offset)
+        except ValueError:
+            return
+
+        t = self.server.manager.get(handle)
+        if not t or t.direction != cmd or offset < 0 or offset > t.size:
+            return
+        if not t.lock.acquire(False):
+            return   # someone else is already using this handle
+
+        try:
+            try:
+                if cmd == "GET":
+                    self.__sendData(t, offset)
+                else:
+                    self.__receiveData(t, offset)
+            except:
+                self.server.writeLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])+" "+str(sys.exc_info()[2]) )
+        finally:
+            t.lock.release()
+
+
+    def __sendData(self, t, offset):
+        self.wfile.flush()
+        f = open(t.fullPath, "rb")
+        try:
+            sendFileData(self.request, f, offset, t.size - offset)
+        finally:
+            f.close()
+
+
+    def __receiveData(self, t, offset):
+        if offset != 0 and offset != t.bytesReceived():
+            self.wfile.write("0")    # client must resume from where we are (or start over)
+            return
+
+        relay = None
+        if t.relay:
+            if offset != 0:
+                self.wfile.write("0")   # the next server always gets the whole file
+                return
+            relay = Relay(*t.relay)
+
+        try:
+            if relay:
+                ok = receiveFileData(self.rfile, t.partPath(), offset, t.size, t.checksum, relay.send)
+            else:
+                ok = receiveFileData(self.rfile, t.partPath(), offset, t.size, t.checksum)
+        finally:
+            if relay:
+                relayOk = relay.finish()
+
+        if ok:
+            os.rename(t.partPath(), t.fullPath)
+            self.server.manager.close(t.handle)
+            if t.onDone:
+                t.onDone(t.fullPath)
+        elif not os.path.exists(t.partPath()):
+            self.server.manager.fail(t.handle)   # bad checksum, a dropped connection keeps the .part for resuming
+        if ok and (not relay or relayOk):
+            self.wfile.write("1")
+        else:
+            self.wfile.write("0")
+
+
+
+class Relay:
+    """ forwards the chunks of an incoming upload to the next server in the chain """
+
+    def __init__(self, host, port, handle):
+        self.ok = True
+        self.sock = None
+        try:
+            self.sock = socket.create_connection((host, port))
+            self.sock.sendall("PUT %s 0\n" % handle)
+        except socket.error:
+            self.ok = False
+
+
+    def send(self, data):
+        if self.ok:
+            try:
+                self.sock.sendall(data)
+            except socket.error:
+                self.ok = False   # keep receiving our own copy anyway
+
+
+    def finish(self):
+        """ waits for the rest of the chain and returns whether all of it got the file """
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_WR)   # in case we didn't get everything ourselves
+                self.ok = self.ok and self.sock.recv(1) == "1"
+            except socket.error:
+                self.ok = False
+            self.sock.close()
+        return self.ok
+
+
+
+#=======================================#
+######    used by both sides     ########
+
+
+def sendFileData(sock, f, offset, count):
+    """ sends count bytes of the open file f starting at offset """
+    if sendfile:
+        fd = sock.fileno()
+        inFd = f.fileno()
+        while count > 0:
+            try:
+                sent = sendfile(fd, inFd, offset, min(CHUNK_SIZE, count))
+            except OSError, e:
+                # a socket with a timeout is non-blocking underneath
+                if e.errno != errno.EAGAIN:
+                    raise
+                if not select.select([], [fd], [], sock.gettimeout())[1]:
+                    raise socket.timeout("timed out")
+                continue
+            if sent == 0:
+                raise IOError("file shrank during transfer")
+            offset += sent
+            count -= sent
+    else:
+        f.seek(offset)
+        while count > 0:
+            data = f.read(min(CHUNK_SIZE, count))
+            if not data:
+                raise IOError("file shrank during transfer")
+            sock.sendall(data)
+            count -= len(data)
+
+
+def receiveFileData(stream, partPath, offset, size, checksum, onChunk=None):
+    """ appends the incoming data to partPath until it's size bytes long and
+        returns whether the md5 of the whole file matches the checksum
+        (onChunk is called with every chunk as soon as it's received)
+    """
+    if offset > 0:
+        md5 = hashlib.md5()
+        f = open(partPath, "rb")
+        left = offset
+        while left > 0:
+            data = f.read(min(CHUNK_SIZE, left))
+            md5.update(data)
+            left -= len(data)
+        f.close()
+        f = open(partPath, "ab")
+    else:
+        md5 = hashlib.md5()
+        f = open(partPath, "wb")
+
+    try:
+        left = size - offset
+        while left > 0:
+            data = stream.read(min(CHUNK_SIZE, left))
+            if not data:
+                return False    # connection dropped, the .part file stays for resuming
+            f.write(data)
+            md5.update(data)
+            if onChunk:
+                onChunk(data)
+            left -= len(data)
+    finally:
+        f.close()
+
+    if md5.hexdigest() != checksum:
+        os.remove(partPath)
+        return False
+    return True
+
+
+
+#=======================================#
+########    client functions     ########
+
+
+def download(host, handle, size, checksum, destPath, port=TRANSFER_PORT):
+    """ fetches the file behind a GET handle into destPath, resuming
+        from destPath.part if an earlier attempt was interrupted
+    """
+    partPath = destPath + PART_EXT
+    offset = 0
+    if os.path.isfile(partPath):
+        offset = os.stat(partPath).st_size
+        if offset > size:
+            os.remove(partPath)
+            offset = 0
+
+    s = socket.create_connection((host, port))
+    try:
+        s.sendall("GET %s %d\n" % (handle, offset))
+        stream = s.makefile("rb", CHUNK_SIZE)
+        ok = receiveFileData(stream, partPath, offset, size, checksum)
+        stream.close()
+    finally:
+        s.close()
+
+    if ok:
+        os.rename(partPath, destPath)
+    return ok
+
+
+def upload(host, handle, offset, fullPath, port=TRANSFER_PORT):
+    """ streams the file to a PUT handle starting at offset,
+        returns True if the other side verified the whole file
+    """
+    s = socket.create_connection((host, port))
+    try:
+        s.sendall("PUT %s %d\n" % (handle, offset))
+        f = open(fullPath, "rb")
+        try:
+            sendFileData(s, f, offset, os.stat(fullPath).st_size - offset)
+        finally:
+            f.close()
+        return s.recv(1) == "1"
+    finally:
+        s.close()
@@ -0,0 +1,366 @@
+############################################################################
+#
+# -= FileViewer =-
+#
+# libraryIndex - on-disk index of the file library (sizes, types, image
+#                dimensions, metadata, thumbnails...) so that listing and
+#                lookups don't have to walk the whole library every time
+#
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about FileViewer to www.evl.uic.edu/cavern/forum
+#
+############################################################################
+
+#
+# The index is kept up to date by comparing directory mtimes: a directory
+# is only listed again if files were added, removed or renamed in it since
+# the last scan, so a scan of an unchanged library costs one stat per
+# directory. A file rewritten in place doesn't change its directory's mtime
+# so the files are stat'ed again when they are looked up (findFile, getInfo).
+# Everything derived from a file (image size, metadata...) is
+# stored with the size and mtime of the file it was computed from and is
+# thrown away as soon as those change.
+#
+
+import os, os.path, threading, sqlite3
+from time import time
+
+opj = os.path.join
+
+INDEX_VERSION = 2        # bump when the tables change, the index is then rebuilt
+MIN_SCAN_INTERVAL = 1.0  # don't rescan more often than this (in seconds)
+
+
+
+class LibraryIndex:
+
+    def __init__(self, dbPath, getFileType):
+        self.__getFileType = getFileType
+        self.__lock = threading.RLock()
+        self.__lastScan = 0
+        self.__roots = []   # the type directories, only files under these are indexed
+        try:
+            self.__db = sqlite3.connect(dbPath, check_same_thread=False)
+            self.__createTables()
+        except sqlite3.Error:
+            # can't write to the library directory... keep the index in memory then
+            self.__db = sqlite3.connect(":memory:", check_same_thread=False)
+            self.__createTables()
+        self.__db.text_factory = str   # paths are byte strings just like the ones from os.listdir
+
+
+    def __createTables(self):
+        c = self.__db.cursor()
+        if c.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            c.execute("DROP TABLE IF EXISTS files")
+            c.execute("DROP TABLE IF EXISTS dirs")
+        c.execute("""CREATE TABLE IF NOT EXISTS dirs (
+                         path TEXT PRIMARY KEY,
+                         parent TEXT,
+                         type TEXT,
+                         mtime REAL)""")
+        c.execute("""CREATE TABLE IF NOT EXISTS files (
+                         path TEXT PRIMARY KEY,
+                         dir TEXT,
+                         name TEXT,
+                         lname TEXT,
+                         type TEXT,
+                         size INTEGER,
+                         mtime REAL,
+                         width INTEGER,
+                         height INTEGER,
+                         pages INTEGER,
+                         metadata TEXT,
+                         thumb TEXT,
+                         checksum TEXT)""")
+        c.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (dir)")
+        c.execute("CREATE INDEX IF NOT EXISTS files_lname ON files (type, lname)")
+        c.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)")
+        c.execute("PRAGMA user_version = %d" % INDEX_VERSION)
+        self.__db.commit()
+
+
+
+#=======================================#
+########        scanning         ########
+
+
+    def scan(self, dirHash, force=False):
+        """ brings the index up to date with the library directories
+            (dirHash is keyed by file type just like in the fileServer)
+        """
+        self.__lock.acquire()
+        try:
+            if not force and time() - self.__lastScan < MIN_SCAN_INTERVAL:
+                return
+            self.__roots = dirHash.values()
+            for fileType, typeDir in dirHash.items():
+                if os.path.isdir(typeDir):
+                    self.__scanDir(typeDir, None, fileType)
+            self.__db.commit()
+            self.__lastScan = time()
+        finally:
+            self.__lock.release()
+
+
+    def __scanDir(self, dirPath, parent, fileType):
+        c = self.__db.cursor()
+        try:
+            mtime = os.stat(dirPath).st_mtime
+        except OSError:
+            self.__removeDir(dirPath)
+            return
+
+        row = c.execute("SELECT mtime FROM dirs WHERE path=?", (dirPath,)).fetchone()
+        if row and row[0] == mtime:
+            # nothing was added or removed here, just check the subdirectories
+            subDirs = [r[0] for r in c.execute("SELECT path FROM dirs WHERE parent=?", (dirPath,))]
+        else:
+            subDirs = []
+            files = set()
+            for item in os.listdir(dirPath):
+                itemPath = opj(dirPath, item)
+                if os.path.isfile(itemPath):
+                    if self.__getFileType(item):
+                        files.add(itemPath)
+                        self.__updateFile(itemPath, fileType)
+                elif os.path.isdir(itemPath) and not item.startswith("."):   # hidden ones are dirToDxt's work folders
+                    subDirs.append(itemPath)
+
+            # forget about whatever isn't there anymore
+            for (path,) in c.execute("SELECT path FROM files WHERE dir=?", (dirPath,)).fetchall():
+                if path not in files:
+                    c.execute("DELETE FROM files WHERE path=?", (path,))
+            for (path,) in c.execute("SELECT path FROM dirs WHERE parent=?", (dirPath,)).fetchall():
+                if path not in subDirs:
+                    self.__removeDir(path)
+            c.execute("INSERT OR REPLACE INTO dirs VALUES (?,?,?,?)", (dirPath, parent, fileType, mtime))
+
+        for subDir in subDirs:
+            self.__scanDir(subDir, dirPath, fileType)
+
+
+    def __removeDir(self, dirPath):
+        """ removes the directory and everything under it from the index """
+        prefix = dirPath + os.sep
+        c = self.__db.cursor()
+        c.execute("DELETE FROM files WHERE dir=? OR substr(dir, 1, ?)=?", (dirPath, len(prefix), prefix))
+        c.execute("DELETE FROM dirs WHERE path=? OR substr(path, 1, ?)=?", (dirPath, len(prefix), prefix))
+
+
+    def __updateFile(self, fullPath, fileType, st=None):
+        """ adds the file or refreshes it if it changed on disk """
+        if st is None:
+            st = os.stat(fullPath)
+        c = self.__db.cursor()
+        row = c.execute("SELECT size, mtime FROM files WHERE path=?", (fullPath,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            return
+        (dirPath, name) = os.path.split(fullPath)
+        c.execute("INSERT OR REPLACE INTO files (path, dir, name, lname, type, size, mtime) VALUES (?,?,?,?,?,?,?)",
+                  (fullPath, dirPath, name, name.lower(), fileType, st.st_size, st.st_mtime))
+
+
+
+#=======================================#
+######   updates from the server   ######
+
+
+    def fileChanged(self, fullPath):
+        """ call when the server itself adds or modifies a file """
+        self.__lock.acquire()
+        try:
+            fileType = self.__getFileType(fullPath)
+            if fileType and os.path.isfile(fullPath) and self.__inLibrary(fullPath):
+                self.__updateFile(fullPath, fileType)
+            else:
+                self.__db.execute("DELETE FROM files WHERE path=?", (fullPath,))
+            self.__db.commit()
+        finally:
+            self.__lock.release()
+
+
+    def fileRemoved(self, fullPath):
+        self.__lock.acquire()
+        try:
+            self.__db.execute("DELETE FROM files WHERE path=?", (fullPath,))
+            self.__db.commit()
+        finally:
+            self.__lock.release()
+
+
+    def dirRemoved(self, dirPath):
+        self.__lock.acquire()
+        try:
+            self.__removeDir(dirPath)
+            self.__db.commit()
+        finally:
+            self.__lock.release()
+
+
+    def invalidateDir(self, dirPath):
+        """ makes the next scan list this directory again """
+        self.__lock.acquire()
+        try:
+            self.__db.execute("UPDATE dirs SET mtime=-1 WHERE path=?", (dirPath,))
+            self.__db.commit()
+            self.__lastScan = 0
+        finally:
+            self.__lock.release()
+
+
+
+#=======================================#
+########         queries         ########
+
+
+    def listTree(self, typeDir, fileType):
+        """ returns the same (dir-path, dirs, files, fileType) tuples that
+            the fileServer used to build by walking the directories
+        """
+        self.__lock.acquire()
+        try:
+            prefix = typeDir + os.sep
+            c = self.__db.cursor()
+            dirs = c.execute("SELECT path, parent FROM dirs WHERE path=? OR substr(path, 1, ?)=?",
+                             (typeDir, len(prefix), prefix)).fetchall()
+            files = c.execute("SELECT dir, name FROM files WHERE dir=? OR substr(dir, 1, ?)=?",
+                              (typeDir, len(prefix), prefix)).fetchall()
+        finally:
+            self.__lock.release()
+
+        nodes = {}
+        for (path, parent) in dirs:
+            nodes[path] = (path, {}, [], fileType)
+        for (dirPath, name) in files:
+            if dirPath in nodes:
+                nodes[dirPath][2].append(name)
+        for (path, parent) in dirs:
+            if parent in nodes:
+                nodes[parent][1][os.path.basename(path)] = nodes[path]
+
+        return nodes.get(typeDir, (typeDir, {}, [], fileType))
+
+
+    def findFile(self, filename, fileType, size=-1):
+        """ looks for a file with that name (case insensitive) and optionally size
+            anywhere under the type directory and returns the directory it's in
+        """
+        self.__lock.acquire()
+        try:
+            c = self.__db.cursor()
+            rows = c.execute("SELECT path, dir, size, mtime FROM files WHERE type=? AND lname=?",
+                             (fileType, filename.lower())).fetchall()
+
+            # the size in the index may be stale if the file was rewritten in place
+            found = False
+            for (path, dirPath, rowSize, mtime) in rows:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    c.execute("DELETE FROM files WHERE path=?", (path,))
+                    continue
+                if st.st_size != rowSize or st.st_mtime != mtime:
+                    self.__updateFile(path, fileType, st)
+                if size == -1 or st.st_size == size:
+                    found = dirPath
+                    break
+            self.__db.commit()
+        finally:
+            self.__lock.release()
+
+        return found
+
+
+    def getInfo(self, fullPath):
+        """ returns a dict of everything we know about the file or None if it doesn't
+            exist. The cached values are dropped if the file changed on disk.
+        """
+        self.__lock.acquire()
+        try:
+            try:
+                st = os.stat(fullPath)
+            except OSError:
+                self.__db.execute("DELETE FROM files WHERE path=?", (fullPath,))
+                self.__db.commit()
+                return None
+            fileType = self.__getFileType(fullPath)
+            if not fileType or not self.__inLibrary(fullPath):
+                return None
+            self.__updateFile(fullPath, fileType, st)
+            self.__db.commit()
+
+            c = self.__db.cursor()
+            c.execute("SELECT * FROM files WHERE path=?", (fullPath,))
+            names = [d[0] for d in c.description]
+            return dict(zip(names, c.fetchone()))
+        finally:
+            self.__lock.release()
+
+
+    def getChecksum(self, fullPath, computeChecksum):
+        """ returns the stored checksum of the file, computing it with
+            computeChecksum(fullPath) only if the file is new or changed
+        """
+        info = self.getInfo(fullPath)
+        if info and info["checksum"]:
+            return info["checksum"]
+        checksum = computeChecksum(fullPath)
+        if info:
+            self.setInfo(fullPath, checksum=checksum)
+        return checksum
+
+
+    def setInfo(self, fullPath, **values):
+        """ stores derived values (width, height, pages, metadata, thumb, checksum) for the file """
+        self.__lock.acquire()
+        try:
+            cols = values.keys()
+            sql = "UPDATE files SET " + ", ".join([col+"=?" for col in cols]) + " WHERE path=?"
+            self.__db.execute(sql, [values[col] for col in cols] + [fullPath])
+            self.__db.commit()
+        finally:
+            self.__lock.release()
+
+
+    def __inLibrary(self, fullPath):
+        for root in self.__roots:
+            if fullPath.startswith(root + os.sep):
+                return True
+        return False
+
+
+    def close(self):
+        self.__lock.acquire()
+        try:
+            self.__db.close()
+        finally:
+            self.__lock.release()
@@ -1,4 +1,4 @@
-import os, os.path, sys, wx, stat, shutil
+import os, os.path, sys, wx, stat, shutil, tempfile
 import subprocess as sp
 import traceback as tb
 
@@ -38,32 +38,31 @@ def __SetWritePermissions(*files):
 
 def makeVideoThumb(fullPath, thumbPath):
     print "\n", 80*"-", "\ncreating video thumbnail with command: "
+    # mplayer always writes 00000001.jpg... into the current directory
+    # so run it in a directory of its own in case other thumbnails are made at the same time
+    workDir = os.path.dirname(thumbPath)
+    
     # must create two frames because of mplayer bug
     createCmd = MPLAYER_DIR+" -vo jpeg -quiet -frames 2 -ss 5 "+ fullPath
     print createCmd
     try:
-        sp.check_call(createCmd.split())
+        sp.check_call(createCmd.split(), cwd=workDir)
     except:
         print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
         
-    # delete one of them
+    # resize it to 300x300 (the first frame is just thrown away with the directory)
+    frame = opj(workDir, "00000002.jpg")
     try:
-        os.remove("00000001.jpg")
-    except:
-        print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2])) 
-
-    # resize it to 300x300
-    try:
-        im = wx.Image("00000002.jpg")  # read the original image
+        im = wx.Image(frame)  # read the original image
         if im.Ok():  #the image may be corrupted...
             im.Rescale(300, 300)        # resize it
-            im.SaveFile("00000002.jpg", wx.BITMAP_TYPE_JPEG)    # save it back to a file
+            im.SaveFile(frame, wx.BITMAP_TYPE_JPEG)    # save it back to a file
     except: 
         print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
         
     # rename the right one
     try:
-        shutil.move("00000002.jpg", thumbPath)
+        shutil.move(frame, thumbPath)
     except:
         print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2])) 
     
@@ -115,17 +114,25 @@ def makeImageThumb(fullPath, thumbPath):
 
 def makeThumbnail(fullPath, fileType, thumbPath):
     if not os.path.exists(thumbPath):
-        if fileType == "image":
-            makeImageThumb(fullPath, thumbPath)
-        elif fileType == "video":
-            makeVideoThumb(fullPath, thumbPath)
-        elif fileType == "pdf":
-            makePDFThumb(fullPath, thumbPath)
-        else:
-            print "\nERROR:Don't know how to make thumbnail for:", fileType
-
-        if os.path.exists(thumbPath):
-            __SetWritePermissions(thumbPath)
+        # every thumbnail is made in its own temp directory and only moved
+        # to thumbPath once it's finished so that concurrent jobs never collide
+        workDir = tempfile.mkdtemp(prefix="thumb", dir=os.path.dirname(thumbPath))
+        workPath = opj(workDir, os.path.basename(thumbPath))
+        try:
+            if fileType == "image":
+                makeImageThumb(fullPath, workPath)
+            elif fileType == "video":
+                makeVideoThumb(fullPath, workPath)
+            elif fileType == "pdf":
+                makePDFThumb(fullPath, workPath)
+            else:
+                print "\nERROR:Don't know how to make thumbnail for:", fileType
+
+            if os.path.exists(workPath):
+                __SetWritePermissions(workPath)
+                os.rename(workPath, thumbPath)
+        finally:
+            shutil.rmtree(workDir, True)
             
 
 def main():
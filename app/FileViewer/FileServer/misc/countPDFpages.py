@@ -1,18 +1,117 @@
-import re
+import re, mmap
+
+# The page count is normally read from the /Count of the root /Pages node,
+# which is found by following startxref -> xref table(s) -> trailer /Root
+# -> catalog /Pages. That touches a few kilobytes no matter how big the
+# document is. Files whose cross reference is compressed (PDF 1.5 xref
+# streams) or that are damaged fall back to counting the /Type /Page
+# objects in the whole file.
+
+PAGE_RE = re.compile(r"(/Type) ?(/Page)[/ \r\n]")
+XREF_SECTION_RE = re.compile(r"\s*(\d+)\s+(\d+)\s*[\r\n]")
+TAIL_SIZE = 2048     # startxref is within the last 1024 bytes according to the spec
+MAX_OBJ_SIZE = 65536 # how far we look for the end of an object or trailer
+
 
 def getPDFPageCount(filename):    
     """Counts pages in a PDF document. 
     
-    This is GPLed code written by J.Alet on 2004/06/19
+    The fallback scan is GPLed code written by J.Alet on 2004/06/19
     """
     try:
         infile = open(filename, "rb")
-        regexp = re.compile(r"(/Type) ?(/Page)[/ \r\n]")
-        pagecount = 0
-        for line in infile.xreadlines(): 
-            pagecount += len(regexp.findall(line))
-        infile.close()
-        return pagecount
+        try:
+            data = _mapFile(infile)
+            pagecount = _countFromCatalog(data)
+            if pagecount is None:
+                pagecount = len(PAGE_RE.findall(data))
+            return pagecount
+        finally:
+            infile.close()
     except:
         return -1
 
+
+def _mapFile(f):
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, OverflowError, ValueError, mmap.error):
+        return f.read()   # empty file or no address space left
+
+
+def _countFromCatalog(data):
+    """ returns the /Count of the page tree root or None if it can't be found """
+    try:
+        offsets, root = _readXref(data)
+        if root is None:
+            return None
+        catalog = _readObject(data, offsets, root)
+        m = re.search(r"/Pages\s+(\d+)\s+(\d+)\s+R", catalog)
+        if not m:
+            return None
+        pages = _readObject(data, offsets, int(m.group(1)))
+        m = re.search(r"/Count\s+(\d+)", pages)
+        if not m:
+            return None
+        return int(m.group(1))
+    except (ValueError, IndexError, KeyError):
+        return None
+
+
+def _readXref(data):
+    """ reads all the classic xref tables (newest first) and returns
+        {object number: offset} and the object number of the catalog
+    """
+    size = len(data)
+    tail = data[max(0, size-TAIL_SIZE):size]
+    i = tail.rfind("startxref")
+    if i == -1:
+        return {}, None
+    pos = int(tail[i+9:].split()[0])
+
+    offsets = {}
+    root = None
+    seen = set()
+    while pos not in seen:
+        seen.add(pos)
+        if data[pos:pos+4] != "xref":
+            return {}, None   # an xref stream, let the scan handle it
+        pos += 4
+        while 1:
+            m = XREF_SECTION_RE.match(data[pos:pos+64])
+            if not m:
+                break
+            first, count = int(m.group(1)), int(m.group(2))
+            pos += m.end()
+            entries = data[pos:pos+20*count]
+            for n in range(count):
+                entry = entries[20*n:20*n+20]
+                if entry[17:18] == "n" and not offsets.has_key(first+n):
+                    offsets[first+n] = int(entry[:10])
+            pos += 20*count
+
+        trailer = data[pos:pos+MAX_OBJ_SIZE]
+        if not trailer.lstrip().startswith("trailer"):
+            return {}, None
+        end = trailer.find("startxref")
+        if end != -1:
+            trailer = trailer[:end]
+        m = re.search(r"/Root\s+(\d+)\s+(\d+)\s+R", trailer)
+        if m and root is None:
+            root = int(m.group(1))
+        m = re.search(r"/Prev\s+(\d+)", trailer)
+        if not m:
+            break
+        pos = int(m.group(1))
+    return offsets, root
+
+
+def _readObject(data, offsets, num):
+    pos = offsets[num]
+    obj = data[pos:pos+MAX_OBJ_SIZE]
+    if not re.match(r"\s*%d\s+\d+\s+obj" % num, obj):
+        raise ValueError("bad xref offset for object %d" % num)
+    end = obj.find("endobj")
+    if end != -1:
+        obj = obj[:end]
+    return obj
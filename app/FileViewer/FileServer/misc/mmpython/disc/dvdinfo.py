@@ -28,6 +28,7 @@
 import os
 import ifoparser
 from mmpython import mediainfo
+from mmpython.mediafile import MediaFile
 import mmpython
 from discinfo import DiscInfo
 
@@ -67,7 +68,7 @@ class DVDInfo(DiscInfo):
         if mediainfo.DEBUG > 1:
             print 'trying buggy dvd detection'
 
-        if isinstance(device, file):
+        if isinstance(device, (file, MediaFile)):   # an iso image opened by the factory
             self.valid = self.isDVDiso(device)
         elif os.path.isdir(device):
             self.valid = self.isDVDdir(device)
@@ -83,6 +83,7 @@ import os
 import urlparse
 import traceback
 import urllib
+from mediafile import MediaFile
 
 DEBUG = 0
 
@@ -93,9 +94,76 @@ except:
 
 
 
+# bytes a parser of the given mimetype may read before it is stopped.
+# The headers of all these formats are small, the parsers that legitimately
+# look further (e.g. the mpeg length detection at the end of the file) seek
+# there instead of reading everything in between.
+READ_BUDGETS = {
+    'image/jpeg'      : 4*1024*1024,    # EXIF/IPTC segments with embedded thumbnails
+    'image/png'       : 4*1024*1024,
+    'image/gif'       : 64*1024,
+    'image/bmp'       : 64*1024,
+    'image/tiff'      : 4*1024*1024,
+    'text/xml'        : 1024*1024,
+    'video/mpeg'      : 8*1024*1024,
+    }
+DEFAULT_READ_BUDGET = 16*1024*1024
+
+SNIFF_SIZE = 64
+
+
 def isurl(url):
     return url.find('://') > 0
 
+
+def sniff(header):
+    """
+    guess the mimetype from the first bytes of a file, None if unknown
+    """
+    if header.startswith('\xff\xd8\xff'):
+        return 'image/jpeg'
+    if header.startswith('\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if header.startswith('GIF87a') or header.startswith('GIF89a'):
+        return 'image/gif'
+    if header.startswith('II*\x00') or header.startswith('MM\x00*'):
+        return 'image/tiff'
+    if header.startswith('BM') and len(header) > 14 and header[6:10] == '\x00\x00\x00\x00':
+        return 'image/bmp'
+    if header.startswith('RIFF'):
+        if header[8:12] == 'AVI ':
+            return 'video/avi'
+        if header[8:12] == 'WAVE':
+            return 'application/pcm'
+    if header.startswith('FORM') and header[8:12] in ('AIFF', 'AIFC'):
+        return 'application/pcm'
+    if header.startswith('.snd') or header.startswith('Creative Voice File'):
+        return 'application/pcm'
+    if header.startswith('\x00\x00\x01\xba') or header.startswith('\x00\x00\x01\xb3'):
+        return 'video/mpeg'
+    if header.startswith('\x1a\x45\xdf\xa3'):
+        return 'application/mkv'
+    if header.startswith('\x30\x26\xb2\x75\x8e\x66\xcf\x11'):
+        return 'video/asf'
+    if header.startswith('OggS'):
+        return 'application/ogg'
+    if header.startswith('fLaC'):
+        return 'application/flac'
+    if header.startswith('.RMF') or header.startswith('.ra\xfd'):
+        return 'video/real'
+    if header.startswith('ID3'):
+        return 'audio/mp3'
+    if header.startswith('\x0b\x77'):
+        return 'audio/ac3'
+    if header[4:8] == 'ftyp' and header[8:11] == 'M4A':
+        return 'application/m4a'
+    if header[4:8] in ('ftyp', 'moov', 'mdat', 'wide', 'free', 'skip', 'pnot'):
+        return 'video/quicktime'
+    if header.startswith('<?xml'):
+        return 'text/xml'
+    return None
+
+
 class Factory:
     """
     Abstract Factory for the creation of MediaInfo instances. The different Methods
@@ -108,23 +176,30 @@ class Factory:
         self.device_types = []
         self.directory_types = []
         self.stream_types = []
+        self.last_bytes_read = 0
         
     def create_from_file(self, file, ext_only=0):
         """
         create based on the file stream 'file
         """
+        tried = []
+
+        # The magic bytes are the best hint, most files are found on the
+        # first try without touching any other parser
+        file.seek(0,0)
+        mime = sniff(file.read(SNIFF_SIZE))
+        if mime and self.mimemap.has_key(mime):
+            if DEBUG: print "trying magic %s" % mime
+            t = self.__try(file, self.mimemap[mime], tried)
+            if t: return t
+
         # Check extension as a hint
         for e in self.extmap.keys():
             if DEBUG > 1: print "trying ext %s" % e
             if file.name.lower().endswith(e.lower()):
                 if DEBUG == 1: print "trying ext %s" % e
-                try:
-                    file.seek(0,0)
-                    t = self.extmap[e][3](file)
-                    if t.valid: return t
-                except:
-                    if DEBUG:
-                        traceback.print_exc()
+                t = self.__try(file, self.extmap[e], tried)
+                if t: return t
 
         # no searching on all types
         if ext_only:
@@ -135,19 +210,35 @@ class Factory:
 
         for e in self.types:
             if DEBUG: print "Trying %s" % e[0]
-            try:
-                file.seek(0,0)
-                t = e[3](file)
-                if t.valid:
-                    if DEBUG: print 'found'
-                    return t
-            except:
-                if DEBUG:
-                    traceback.print_exc()
+            t = self.__try(file, e, tried)
+            if t:
+                if DEBUG: print 'found'
+                return t
         if DEBUG: print 'not found'
         return None
 
 
+    def __try(self, file, e, tried):
+        """
+        run one parser on the file (each parser only once per file)
+        """
+        if e[3] in tried:
+            return None
+        tried.append(e[3])
+        try:
+            file.seek(0,0)
+            if hasattr(file, 'setBudget'):
+                file.setBudget(READ_BUDGETS.get(e[0], DEFAULT_READ_BUDGET))
+            t = e[3](file)
+            if DEBUG and hasattr(file, 'bytesRead'):
+                print "%s read %d bytes" % (e[0], file.bytesRead)
+            if t.valid: return t
+        except:
+            if DEBUG:
+                traceback.print_exc()
+        return None
+
+
     def create_from_url(self,url):
         """
         Create information for urls. This includes file:// and cd://
@@ -197,12 +288,16 @@ class Factory:
             return None
         if os.path.isfile(filename):
             try:
-                f = open(filename,'rb')
+                f = MediaFile(filename)
             except IOError:
                 print 'IOError reading %s' % filename
                 return None
-            r = self.create_from_file(f, ext_only)
-            f.close()
+            try:
+                r = self.create_from_file(f, ext_only)
+            finally:
+                f.close()
+            self.last_bytes_read = f.totalRead
+            if DEBUG: print "%d of %d bytes read" % (f.totalRead, f.size)
             if r:
                 r.correct_data()
                 r.url = 'file://%s' % os.path.abspath(filename)
@@ -0,0 +1,163 @@
+#if 0
+# -----------------------------------------------------------------------
+# mediafile.py - read-only, memory mapped file object for the parsers
+# -----------------------------------------------------------------------
+# MMPython - Media Metadata for Python
+# Copyright (C) 2003 Thomas Schueppel, Dirk Meyer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------
+#endif
+
+import os
+import mmap
+
+
+class ReadBudgetExceeded(IOError):
+    """
+    raised when a parser asks for more data than its format should ever need
+    """
+    pass
+
+
+
+class MediaFile:
+    """
+    Behaves like a file opened with 'rb' (read, readline, readlines, seek,
+    tell, name) but reads from a memory map of the file, so a parser that
+    seeks around the headers only pages in the parts it looks at instead of
+    copying them through the file buffer.
+
+    Every byte handed to a parser is counted in bytesRead (since the last
+    setBudget) and totalRead. With a budget set, a read that would go over
+    it raises ReadBudgetExceeded so a parser stuck on a damaged or wrongly
+    guessed file gives up instead of scanning a multi gigabyte movie.
+    """
+    def __init__(self, filename):
+        self.name = filename
+        self.__file = open(filename, 'rb')
+        self.size = os.fstat(self.__file.fileno()).st_size
+        self.__map = None
+        self.__pos = 0
+        if self.size > 0:
+            try:
+                self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, OverflowError, ValueError, mmap.error):
+                pass   # e.g. no address space left on 32 bit, use the file itself
+        self.budget = None
+        self.bytesRead = 0
+        self.totalRead = 0
+
+
+    def setBudget(self, budget):
+        """
+        limit the bytes the next parser may read (None for no limit)
+        """
+        self.budget = budget
+        self.bytesRead = 0
+
+
+    def read(self, size=-1):
+        pos = self.tell()
+        if size is None or size < 0:
+            size = max(0, self.size - pos)
+        self.__charge(min(size, max(0, self.size - pos)))
+        if self.__map is None:
+            data = self.__file.read(size)
+        else:
+            data = self.__map[pos:pos+size]
+            self.__pos = pos + len(data)
+        self.__count(len(data))
+        return data
+
+
+    def readline(self, size=-1):
+        if self.__map is None:
+            self.__charge(0)
+            data = self.__file.readline(size)
+        else:
+            pos = self.__pos
+            end = self.__map.find('\n', pos)
+            if end == -1:
+                end = self.size
+            else:
+                end += 1
+            if size is not None and size >= 0:
+                end = min(end, pos + size)
+            self.__charge(end - pos)
+            data = self.__map[pos:end]
+            self.__pos = pos + len(data)
+        self.__count(len(data))
+        return data
+
+
+    def readlines(self, hint=-1):
+        lines = []
+        total = 0
+        while 1:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            total += len(line)
+            if hint > 0 and total >= hint:
+                break
+        return lines
+
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+    def seek(self, offset, whence=0):
+        if self.__map is None:
+            self.__file.seek(offset, whence)
+            return
+        if whence == 1:
+            offset += self.__pos
+        elif whence == 2:
+            offset += self.size
+        if offset < 0:
+            raise IOError(22, 'Invalid argument')
+        self.__pos = offset   # past the end is fine, reads just return ''
+
+
+    def tell(self):
+        if self.__map is None:
+            return self.__file.tell()
+        return self.__pos
+
+
+    def fileno(self):
+        return self.__file.fileno()
+
+
+    def close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        self.__file.close()
+
+
+    def __charge(self, size):
+        if self.budget is not None and self.bytesRead + size > self.budget:
+            raise ReadBudgetExceeded('read budget of %d bytes exceeded in %s' % \
+                                     (self.budget, self.name))
+
+
+    def __count(self, size):
+        self.bytesRead += size
+        self.totalRead += size
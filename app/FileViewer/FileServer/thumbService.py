@@ -0,0 +1,216 @@
+############################################################################
+#
+# -= FileViewer =-
+#
+# thumbService - makes thumbnails in a pool of worker processes so that
+#                the XML-RPC request threads never wait on decoding
+#
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about FileViewer to www.evl.uic.edu/cavern/forum
+#
+############################################################################
+
+import os, os.path, sys, heapq, threading, multiprocessing
+from collections import OrderedDict
+import traceback as tb
+from time import time
+import makeThumbs
+
+
+# job priorities (lower number goes first)
+PRIORITY_VISIBLE = 0       # the user is looking at the file in the library browser
+PRIORITY_BACKGROUND = 10   # everything else (e.g. freshly uploaded files)
+
+# job states returned to the callers
+DONE = "done"
+PENDING = "pending"
+FAILED = "failed"
+
+# how many failed thumbnails are remembered (the oldest failure is forgotten first)
+MAX_FAILED = 10000
+
+
+
+def _makeThumbnail(fullPath, fileType, thumbPath):
+    """ runs in the worker processes """
+    try:
+        makeThumbs.makeThumbnail(fullPath, fileType, thumbPath)
+    except:
+        print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
+    return os.path.isfile(thumbPath)
+
+
+def _mtime(fullPath):
+    try:
+        return os.stat(fullPath).st_mtime
+    except OSError:
+        return None
+
+
+
+class ThumbJob:
+    def __init__(self, fullPath, fileType, thumbPath, priority):
+        self.fullPath = fullPath
+        self.fileType = fileType
+        self.thumbPath = thumbPath
+        self.priority = priority
+        self.started = False
+        self.mtime = None      # of the source when the thumbnail was started
+
+
+
+class ThumbnailService:
+    """ a job queue in front of a process pool. Requests for a thumbnail that
+        is already queued or being made are merged into the existing job.
+    """
+
+    def __init__(self, numWorkers=None):
+        if not numWorkers:
+            numWorkers = multiprocessing.cpu_count()
+        self.__numWorkers = numWorkers
+        self.__pool = multiprocessing.Pool(numWorkers)
+        self.__cond = threading.Condition()
+        self.__jobs = {}      # queued or running jobs keyed by thumbPath
+        self.__queue = []     # heap of (priority, seq, job)
+        self.__seq = 0        # keeps the jobs of the same priority in FIFO order
+        self.__running = 0
+        self.__failed = OrderedDict() # thumbPath --> (fullPath, mtime) of the sources that failed
+
+
+    def request(self, fullPath, fileType, thumbPath, priority=PRIORITY_BACKGROUND):
+        """ queues the thumbnail if it doesn't exist yet and returns its state """
+        if os.path.isfile(thumbPath):
+            return DONE
+
+        self.__cond.acquire()
+        try:
+            if self.__hasFailed(thumbPath):
+                return FAILED
+
+            job = self.__jobs.get(thumbPath)
+            if job:
+                if not job.started and priority < job.priority:   # someone needs it sooner now
+                    job.priority = priority
+                    self.__push(job)
+            else:
+                job = ThumbJob(fullPath, fileType, thumbPath, priority)
+                self.__jobs[thumbPath] = job
+                self.__push(job)
+            self.__dispatch()
+            return PENDING
+        finally:
+            self.__cond.release()
+
+
+    def status(self, thumbPath):
+        if os.path.isfile(thumbPath):
+            return DONE
+        self.__cond.acquire()
+        try:
+            if thumbPath in self.__jobs:
+                return PENDING
+            elif self.__hasFailed(thumbPath):
+                return FAILED
+            else:
+                return None   # never requested
+        finally:
+            self.__cond.release()
+
+
+    def wait(self, thumbPath, timeout=None):
+        """ blocks until the job for thumbPath is finished (or timeout) and returns its state """
+        if timeout is not None:
+            deadline = time() + timeout
+        self.__cond.acquire()
+        try:
+            while thumbPath in self.__jobs:
+                if timeout is None:
+                    self.__cond.wait()
+                else:
+                    left = deadline - time()
+                    if left <= 0:
+                        break
+                    self.__cond.wait(left)
+        finally:
+            self.__cond.release()
+        return self.status(thumbPath)
+
+
+    def stop(self):
+        self.__pool.terminate()
+
+
+    #-------------------------------------------------------
+
+    def __hasFailed(self, thumbPath):
+        """ a failure only counts as long as the source hasn't changed (call with the lock held) """
+        if thumbPath not in self.__failed:
+            return False
+        (fullPath, mtime) = self.__failed[thumbPath]
+        if _mtime(fullPath) != mtime:
+            del self.__failed[thumbPath]   # a new version, worth another try
+            return False
+        return True
+
+
+    def __push(self, job):
+        self.__seq += 1
+        heapq.heappush(self.__queue, (job.priority, self.__seq, job))
+
+
+    def __dispatch(self):
+        """ starts as many queued jobs as there are free workers (call with the lock held) """
+        while self.__queue and self.__running < self.__numWorkers:
+            (priority, seq, job) = heapq.heappop(self.__queue)
+            if job.started or priority != job.priority:
+                continue   # stale entry left behind when the priority was raised
+            job.started = True
+            job.mtime = _mtime(job.fullPath)
+            self.__running += 1
+            self.__pool.apply_async(_makeThumbnail, (job.fullPath, job.fileType, job.thumbPath),
+                                    callback=lambda ok, job=job: self.__onDone(job, ok))
+
+
+    def __onDone(self, job, ok):
+        """ called from the pool's result thread """
+        self.__cond.acquire()
+        try:
+            self.__running -= 1
+            del self.__jobs[job.thumbPath]
+            if not ok:
+                self.__failed.pop(job.thumbPath, None)   # re-added as the newest
+                self.__failed[job.thumbPath] = (job.fullPath, job.mtime)
+                while len(self.__failed) > MAX_FAILED:
+                    self.__failed.popitem(last=False)
+            self.__dispatch()
+            self.__cond.notifyAll()
+        finally:
+            self.__cond.release()
@@ -37,46 +37,320 @@
 ############################################################################
 
 
+
+
 #
-# Processes all the images in the passed in directory name and converts
-# them to DXT using a imgToDxt
+# Converts all the images in the passed in directory to DXT using imgToDxt.
+# The conversions run in a pool of processes (one per core by default) and
+# images whose .dxt is already newer than the image are skipped, so running
+# it again only converts what changed. The FileServer uses the same
+# DxtConverter to convert the images as they are uploaded.
 #
-# Call with: python dirToDxt.py dirName
+# Every result is appended to a manifest in the directory so an interrupted
+# run can be restarted and images that failed before aren't tried again
+# (unless -r is given).
+#
+# Call with: python dirToDxt.py [-n numProcesses] [-r] dirName
 #
 # Author: Ratko Jagodic
 #
 
-import os, sys, os.path
-
-if len(sys.argv) < 2:
-    print "\nUsage: python dirToDxt.py directoryName\n"
-    sys.exit(0)
-
-count = 0
-skippedDirs = []
-for root, dirs, files in os.walk(sys.argv[1]):
-
-    # skip dir if we have no write permissions
-    if not os.access(root, os.W_OK):
-        skippedDirs.append(root)
-        print "\n***** No write permissions. Skipping ", root
-        continue
-    
-    for name in files:
-        # skip existing dxt files
-        if name.endswith(".dxt"):
+import os, sys, os.path, struct, shutil, tempfile, subprocess, threading, multiprocessing
+from optparse import OptionParser
+from time import time
+
+opj = os.path.join
+
+
+# imgToDxt is installed next to this script (in bin/fileServer)
+IMG_TO_DXT = opj(os.path.dirname(os.path.abspath(__file__)), "imgToDxt")
+if not os.path.isfile(IMG_TO_DXT):
+    IMG_TO_DXT = "imgToDxt"   # hope it's in the PATH
+
+IMAGE_EXTS = [".jpg", ".jpeg", ".gif", ".png", ".tif", ".tiff", ".bmp",
+              ".pcx", ".rgb", ".rgba", ".ico"]
+MANIFEST_NAME = ".dxt_manifest"
+TMP_PREFIX = ".dxt_"   # the conversions are done in these folders and then moved into place
+DXT_HEADER = struct.Struct("=III")   # width, height, numBytes as written by imgToDxt
+
+
+
+def dxtPath(imagePath):
+    """ imgToDxt replaces the extension with .dxt """
+    return os.path.splitext(imagePath)[0] + ".dxt"
+
+
+def isImage(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTS
+
+
+def needsConversion(imagePath):
+    """ True if the .dxt doesn't exist or is older than the image """
+    try:
+        return os.stat(dxtPath(imagePath)).st_mtime < os.stat(imagePath).st_mtime
+    except OSError:
+        return True
+
+
+def readDxtSize(path):
+    """ returns (width, height) of a complete .dxt file or None """
+    try:
+        f = open(path, "rb")
+        try:
+            (width, height, numBytes) = DXT_HEADER.unpack(f.read(DXT_HEADER.size))
+        finally:
+            f.close()
+    except (IOError, struct.error):
+        return None
+    if numBytes != width*height/2 or os.path.getsize(path) != DXT_HEADER.size + numBytes:
+        return None
+    return (width, height)
+
+
+def convert(imagePath, imgToDxt=IMG_TO_DXT):
+    """ runs in the worker processes. imgToDxt never overwrites an existing
+        .dxt so it's run on a link to the image in a temporary folder and the
+        result is renamed over the old one (the viewer never sees half a file)
+        returns (imagePath, pixels, seconds, errorMessage or None)
+    """
+    t = time()
+    tmpDir = None
+    try:
+        try:
+            tmpDir = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=os.path.dirname(imagePath))
+            tmpImage = opj(tmpDir, os.path.basename(imagePath))
+            if hasattr(os, "symlink"):
+                os.symlink(imagePath, tmpImage)
+            else:
+                shutil.copy2(imagePath, tmpImage)
+
+            p = subprocess.Popen([imgToDxt, tmpImage], cwd=tmpDir,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = p.communicate()[0]
+
+            size = readDxtSize(dxtPath(tmpImage))
+            if not size:
+                lines = output.strip().splitlines() or ["imgToDxt exited with %s" % p.returncode]
+                return (imagePath, 0, time()-t, lines[-1].strip())
+            os.rename(dxtPath(tmpImage), dxtPath(imagePath))
+            return (imagePath, size[0]*size[1], time()-t, None)
+        except:
+            return (imagePath, 0, time()-t, str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]))
+    finally:
+        if tmpDir:
+            shutil.rmtree(tmpDir, True)
+
+
+def findImages(topDir, skippedDirs=None):
+    """ yields the images under topDir (writable folders only) """
+    for root, dirs, files in os.walk(topDir):
+        dirs[:] = [d for d in dirs if not d.startswith(TMP_PREFIX)]
+
+        # skip dir if we have no write permissions
+        if not os.access(root, os.W_OK):
+            if skippedDirs is not None:
+                skippedDirs.append(root)
             continue
-        
-        count += 1
-        filePath = os.path.abspath(os.path.join(root, name))
-        print "\n\n#",count, "   -------------- ", filePath, " ---------------"
-        cmd = "imgToDxt '%s'" % filePath
-        os.system(cmd)
 
+        for name in files:
+            if isImage(name):
+                yield os.path.abspath(opj(root, name))
+
+
+
+class Manifest:
+    """ an append-only record of the conversion results: status, image mtime, path
+        (the last line for an image wins)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.__failed = {}   # imagePath --> mtime of the image when it failed
+        self.__lock = threading.Lock()
+        self.__load()
+        self.__file = open(path, "a")
+
+
+    def __load(self):
+        if not os.path.isfile(self.path):
+            return
+        for line in open(self.path, "r"):
+            try:
+                (status, mtime, imagePath) = line.rstrip("\n").split("\t", 2)
+                if status == "failed":
+                    self.__failed[imagePath] = float(mtime)
+                else:
+                    self.__failed.pop(imagePath, None)
+            except ValueError:
+                pass   # a line cut short when we were killed
+
+
+    def failedBefore(self, imagePath):
+        """ True if this version of the image couldn't be converted last time """
+        try:
+            return self.__failed.get(imagePath) == os.stat(imagePath).st_mtime
+        except OSError:
+            return False
+
+
+    def record(self, imagePath, ok):
+        try:
+            mtime = os.stat(imagePath).st_mtime
+        except OSError:
+            mtime = 0
+        self.__lock.acquire()
+        try:
+            if ok:
+                status = "done"
+                self.__failed.pop(imagePath, None)
+            else:
+                status = "failed"
+                self.__failed[imagePath] = mtime
+            self.__file.write("%s\t%r\t%s\n" % (status, mtime, imagePath))
+            self.__file.flush()
+        finally:
+            self.__lock.release()
+
+
+    def close(self):
+        self.__file.close()
+
+
+
+class DxtConverter:
+    """ converts images to DXT in a pool of worker processes. Images that are
+        already queued or being converted are not queued again.
+    """
+
+    def __init__(self, numWorkers=None, imgToDxt=IMG_TO_DXT, manifest=None, onResult=None):
+        if not numWorkers:
+            numWorkers = multiprocessing.cpu_count()
+        self.imgToDxt = imgToDxt
+        self.manifest = manifest
+        self.onResult = onResult   # called with (imagePath, pixels, seconds, error) from the pool's thread
+        self.__pool = multiprocessing.Pool(numWorkers)
+        self.__cond = threading.Condition()
+        self.__pending = set()
+
+        # statistics
+        self.converted = 0
+        self.failed = 0
+        self.pixels = 0
+        self.startTime = time()
+
+
+    def enqueue(self, imagePath, force=False):
+        """ queues the image if its .dxt is missing or out of date,
+            returns True if it was queued
+        """
+        if not force and not needsConversion(imagePath):
+            return False
+        self.__cond.acquire()
+        try:
+            if imagePath in self.__pending:
+                return False
+            self.__pending.add(imagePath)
+            self.__pool.apply_async(convert, (imagePath, self.imgToDxt), callback=self.__onDone)
+            return True
+        finally:
+            self.__cond.release()
+
+
+    def wait(self):
+        """ blocks until everything queued so far is converted """
+        self.__cond.acquire()
+        try:
+            while self.__pending:
+                self.__cond.wait(1)
+        finally:
+            self.__cond.release()
+
+
+    def stop(self):
+        self.__pool.terminate()
+
+
+    def report(self):
+        elapsed = max(time() - self.startTime, 0.001)
+        mp = self.pixels / 1000000.0
+        return "%d converted, %d failed, %.1f MP in %.1f s (%.2f MP/s)" % \
+               (self.converted, self.failed, mp, elapsed, mp/elapsed)
+
+
+    def __onDone(self, result):
+        (imagePath, pixels, seconds, error) = result
+        self.__cond.acquire()
+        try:
+            self.__pending.discard(imagePath)
+            if error:
+                self.failed += 1
+            else:
+                self.converted += 1
+                self.pixels += pixels
+            self.__cond.notifyAll()
+        finally:
+            self.__cond.release()
+
+        if self.manifest:
+            self.manifest.record(imagePath, not error)
+        if self.onResult:
+            self.onResult(imagePath, pixels, seconds, error)
+
+
+
+def main():
+    parser = OptionParser(usage="python dirToDxt.py [options] directoryName")
+    parser.add_option("-n", type="int", dest="numWorkers", default=0,
+                      help="number of conversions to run at once (default: number of cores)")
+    parser.add_option("-r", action="store_true", dest="retry", default=False,
+                      help="retry the images that failed to convert in a previous run")
+    (options, args) = parser.parse_args()
+    if len(args) < 1:
+        parser.print_help()
+        sys.exit(0)
+    topDir = args[0]
+
+    failures = []
+    def onResult(imagePath, pixels, seconds, error):
+        if error:
+            failures.append((imagePath, error))
+            print "FAILED   ", imagePath, "   (%s)" % error
+        else:
+            print "%.1f MP in %.2fs  " % (pixels/1000000.0, seconds), imagePath
+
+    manifest = Manifest(opj(topDir, MANIFEST_NAME))
+    converter = DxtConverter(options.numWorkers, manifest=manifest, onResult=onResult)
+    skippedDirs = []
+    upToDate = 0
+    failedBefore = 0
+    try:
+        for imagePath in findImages(topDir, skippedDirs):
+            if not needsConversion(imagePath):
+                upToDate += 1
+            elif not options.retry and manifest.failedBefore(imagePath):
+                failedBefore += 1
+            else:
+                converter.enqueue(imagePath)
+        converter.wait()
+    except KeyboardInterrupt:
+        converter.stop()
+        print "\nInterrupted, run again to continue where it stopped."
+    manifest.close()
+
+    print "\n\n", 10 * "------"
+    print converter.report()
+    print "%d already up to date, %d skipped because they failed before (use -r to retry)" % \
+          (upToDate, failedBefore)
+    if failures:
+        print "\nImages that couldn't be converted:\n"
+        for imagePath, error in failures:
+            print imagePath, "   (%s)" % error
+    if skippedDirs:
+        print "\nDirectories skipped due to insufficient write permissions:\n"
+        for d in skippedDirs:
+            print d
+    print "\n"
 
-print "\n\n", 10 * "------"
-print "Directories skipped due to insufficient write permissions:\n"
-for d in skippedDirs:
-    print d
-print "\n"
 
+if __name__ == '__main__':
+    main()
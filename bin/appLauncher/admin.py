@@ -38,8 +38,8 @@
 
 
 
-import wx, xmlrpclib, string, socket
-import traceback as tb
+import wx, string
+import launcherPoller as lp
 
 
 
@@ -76,120 +76,55 @@ class App:
         return info
     
 
-class AppLauncher:
-
-    def __init__(self, launcherId, name, ip, port, appList):
-        self.port = port
-        self.appList = appList
-        self.ip = ip
-        self.launcherId = launcherId
-        self.name = name
-	self.connected = False
-
-
-    def connect(self):
-	if not self.connected:
-	    socket.setdefaulttimeout(3)  #set the timeout to 3 seconds so that we dont wait forever
-	    self.server = xmlrpclib.ServerProxy("http://" + self.ip + ":" + str(self.port))
-	    try:
-		self.server.test() #just use this as a way of testing whether the server is running or not
-		self.connected = True
-	    except socket.error:
-		return False
-	    except:
-		tb.print_exc()
-		return False
-	return True
-
-
-    def stopApp(self, appId):
-        try:
-            self.connect()  #connect if necessary
-            return self.server.stopApp(appId)
-        except socket.error:
-            wx.MessageBox("No connection to the appLauncher: "+str(self.launcherId), "Failed")
-            self.connected = False
-        except:
-            wx.MessageBox("There was an error stopping application:\n\n"+
-                          str("".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))),
-                          "Failed")
-            
-    def appStatus(self):
-        try:
-            self.connect()  #connect if necessary
-            return self.server.appStatus()
-        except socket.error:
-            wx.MessageBox("No connection to the appLauncher: "+str(self.launcherId), "Failed")
-            self.connected = False
-        except:
-            wx.MessageBox("There was an error getting application list:\n\n"+
-                          str("".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))),
-                          "Failed")
-        return {}
-
-
-    def killLauncher(self):
-        try:
-            self.connect()  #connect if necessary
-            self.server.killLauncher()
-        except socket.error:
-            wx.MessageBox("No connection to the appLauncher: "+str(self.launcherId), "Failed")
-            self.connected = False
-        except:
-            wx.MessageBox("There was an error killing application launcher:\n\n"+
-                          str("".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))),
-                          "Failed")
-
-
-
-    def getId(self):
-        return self.launcherId
-
-    def getIP(self):
-        return self.ip
-
-    def getAppList(self):
-        return self.appList
-
-    def setAppList(self, appList):
-        self.appList = appList
-
-    def getPort(self):
-        return self.port
-
-    def getName(self):
-        return self.name
-
-
-
-
-
 class MainFrame(wx.Frame):
 
     def __init__(self, serverIP, serverPort=8009):
         wx.Frame.__init__(self, None, -1, "AppLauncher Admin", pos = (100,100), size=(550,300))
-        self.server = xmlrpclib.ServerProxy("http://"+serverIP+":"+str(serverPort))
         self.CreateControls()
-        self.updateLauncherList()
+        self.shownLauncher = None   # LauncherStatus whose apps are shown
         self.SetBackgroundColour(wx.Colour(51, 102, 102))
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
         self.Show(True)
 
+        # the launchers are polled in another thread so a dead one can't freeze us
+        self.poller = lp.LauncherPoller(serverIP, serverPort, self.OnPollUpdate, wx.CallAfter)
+        self.poller.start()
+
+        
+    ### called (in the wx thread) with what changed since the last poll
+    def OnPollUpdate(self, result):
+        if not self:   # the frame was closed in the meantime
+            return
         
-    ### connects to the sage server and retrieves the list of all app launchers running
-    def updateLauncherList(self):
-        self.launcherList.Clear()  #clear the ListBox
-	try:
-	    # a hash comes back (key=launcherId, value=appList - that's another hash of appNames and configs)
-	    launcherHash = self.server.GetRegisteredLaunchers()
-	except socket.error:
-            wx.MessageBox("No connection to the sage server.", "No connection")
-	except:
-	    tb.print_exc()
-	else:
-	    for launcherString, appList in launcherHash.iteritems():
-		(name, launcherId) = launcherString.split(":",1)
-		(ip, port) = launcherId.split(":",1)
-                self.launcherList.Insert(name, 0, AppLauncher(launcherId, name, ip, port, appList))
+        if result.serverError:
+            self.launcherLabel.SetLabel("No connection to the sage server")
+        else:
+            self.launcherLabel.SetLabel("Registered AppLaunchers")
+
+        for launcherId in result.removed:
+            for i in range(self.launcherList.GetCount()-1, -1, -1):
+                status = self.launcherList.GetClientData(i)
+                if status.getId() == launcherId:
+                    self.launcherList.Delete(i)
+                    if status is self.shownLauncher:
+                        self.ClearApps()
+
+        for status in result.added:
+            self.launcherList.Insert(self.__getLauncherLabel(status), 0, status)
+
+        for status in result.failed + result.recovered:
+            for i in range(self.launcherList.GetCount()):
+                if self.launcherList.GetClientData(i) is status:
+                    self.launcherList.SetString(i, self.__getLauncherLabel(status))
+
+        if self.shownLauncher in result.changed + result.failed + result.recovered:
+            self.ShowApps(self.shownLauncher)
+
+
+    def __getLauncherLabel(self, status):
+        if status.error:
+            return status.getName() + " (not responding)"
+        return status.getName()
 		
 	
     def CreateControls(self):
@@ -243,14 +178,43 @@ class MainFrame(wx.Frame):
 
         
     def OnLauncherListSelect(self, event=None):
-        selection = self.launcherList.GetStringSelection()
+        self.ShowApps(event.GetClientData())
+
+
+    ### shows the apps we last heard about from this launcher (no waiting for it)
+    def ShowApps(self, appLauncher):
+        selectedId = None
+        selection = self.appList.GetSelection()
+        if not selection == wx.NOT_FOUND and appLauncher is self.shownLauncher:
+            selectedId = self.appList.GetClientData(selection).getId()
+            
+        self.shownLauncher = appLauncher
         self.appList.Clear()
-        self.appLabel.SetLabel("Apps Running On: " + str(selection))
+        label = "Apps Running On: " + str(appLauncher.getName())
+        if appLauncher.getAge() is None:
+            label += " (no answer yet)"
+        elif appLauncher.error:
+            label += " (not responding for %ds)" % appLauncher.getAge()
+        self.appLabel.SetLabel(label)
+
+        for appId, (appName, command, machine) in appLauncher.getApps().iteritems():
+            self.appList.Insert(appName, 0, App(appName, int(appId), command, machine, appLauncher))
+        for i in range(self.appList.GetCount()):
+            if self.appList.GetClientData(i).getId() == selectedId:
+                self.appList.SetSelection(i)
+
+        if self.appList.GetSelection() == wx.NOT_FOUND:
+            self.appInfo.Clear()
+            self.appInfoLabel.SetLabel("Details for: ")
+        self.GetSizer().Layout()
+
+
+    def ClearApps(self):
+        self.shownLauncher = None
+        self.appList.Clear()
+        self.appLabel.SetLabel("Apps Running On: ")
         self.appInfo.Clear()
         self.appInfoLabel.SetLabel("Details for: ")
-        appLauncher = event.GetClientData()
-        for appId, (appName, command, machine) in appLauncher.appStatus().iteritems():
-            self.appList.Insert(appName, 0, App(appName, int(appId), command, machine, appLauncher))
         self.GetSizer().Layout()
 
 
@@ -263,20 +227,15 @@ class MainFrame(wx.Frame):
         
 
     def UpdateLists(self, event=None):
-        self.updateLauncherList()
-        self.appList.Clear()
-        self.appLabel.SetLabel("Apps Running On: ")
-        self.appInfo.Clear()
-        self.appInfoLabel.SetLabel("Details for: ")
-        self.GetSizer().Layout()
+        self.poller.refresh()
 
 
     def OnKillAppBtn(self, event):
         selection = self.appList.GetSelection()
         if not selection == wx.NOT_FOUND:
             app = self.appList.GetClientData(selection)
-            app.getLauncher().stopApp(app.getId())
-            self.UpdateLists()
+            self.poller.call(app.getLauncher().getId(), "stopApp", (app.getId(),),
+                             self.__makeErrorReporter("stopping application"))
 
 
     def OnKillLauncherBtn(self, event):
@@ -286,8 +245,20 @@ class MainFrame(wx.Frame):
             dlg = wx.MessageDialog(None, msg, "Confirm kill", style = wx.OK | wx.CANCEL)
             if dlg.ShowModal() == wx.ID_OK:
                 appLauncher = self.launcherList.GetClientData(selection)
-                appLauncher.killLauncher()
-                self.UpdateLists()
+                self.poller.call(appLauncher.getId(), "killLauncher", (),
+                                 self.__makeErrorReporter("killing application launcher"))
+
+
+    def __makeErrorReporter(self, action):
+        def report(result, error):
+            if error and self:
+                wx.MessageBox("There was an error "+action+":\n\n"+error, "Failed")
+        return report
+
+
+    def OnClose(self, event):
+        self.poller.stop()
+        event.Skip()
 
 
 
@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+
+############################################################################
+#
+# SAGE LAUNCHER - A GUI for launching SAGE and all related components
+#
+# Copyright (C) 2007 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+
+
+#
+# Starts the SAGE components as a dependency graph instead of one after
+# another with a sleep in between. Every component (Step) says what it
+# depends on and how to tell it's ready (a probe: a port that accepts
+# connections, an xmlrpc call or the SAGE registration that gets an
+# answer). All the steps whose dependencies are ready are started at the
+# same time and a step whose dependency failed isn't started at all.
+# Everything that happens is recorded in a Timeline.
+#
+# fanOut() runs a list of commands (e.g. one ssh per tile node) a few at
+# a time and collects their exit statuses and output.
+#
+# Both work without wx so they can be tried with stub components:
+#    python orchestrator.py
+#
+
+import os, sys, socket, time, xmlrpclib
+import subprocess as sp
+import traceback as tb
+from threading import Thread, Condition, Lock
+import Queue
+
+
+PROBE_INTERVAL = 0.1        # seconds between probes
+PROBE_TIMEOUT = 1.0         # seconds one probe may take
+READY_TIMEOUT = 30.0        # seconds a component has to become ready
+MAX_PARALLEL_COMMANDS = 16  # for fanOut
+COMMAND_TIMEOUT = 20.0      # seconds one fanOut command may take
+CLOSE_FDS = not sys.platform.startswith("win")   # python can't close_fds with redirected output on windows
+
+# step states
+WAITING  = "waiting"
+STARTING = "starting"
+READY    = "ready"
+FAILED   = "failed"
+SKIPPED  = "skipped"
+
+
+
+# --------------------------------------------------------
+#
+#                      PROBES
+#
+# --------------------------------------------------------
+
+# a probe is called repeatedly after a component was started
+# and returns True once the component is ready
+
+def _connect(host, port):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.settimeout(PROBE_TIMEOUT)
+    try:
+        s.connect((host, port))
+    except:
+        s.close()
+        raise
+    return s
+
+
+class PortProbe:
+    """ ready once the port accepts connections """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def __call__(self):
+        try:
+            _connect(self.host, self.port).close()
+            return True
+        except socket.error:
+            return False
+
+    def __str__(self):
+        return "port %s:%d" % (self.host, self.port)
+
+
+
+class _TimeoutTransport(xmlrpclib.Transport):
+    def make_connection(self, host):
+        conn = xmlrpclib.Transport.make_connection(self, host)
+        conn.timeout = PROBE_TIMEOUT
+        return conn
+
+
+class XMLRPCProbe:
+    """ ready once the xmlrpc method answers """
+    def __init__(self, host, port, method="system.listMethods"):
+        self.host = host
+        self.port = port
+        self.method = method
+
+    def __call__(self):
+        server = xmlrpclib.ServerProxy("http://%s:%d" % (self.host, self.port), transport=_TimeoutTransport())
+        try:
+            getattr(server, self.method)()
+            return True
+        except:
+            return False
+
+    def __str__(self):
+        return "xmlrpc %s:%d %s()" % (self.host, self.port, self.method)
+
+
+
+class SageProbe:
+    """ ready once fsManager answers the registration of a UI (1000) """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def __call__(self):
+        try:
+            s = _connect(self.host, self.port)
+            try:
+                msg = '%8s\0%8s\0%8s\0%s\0' % ('', 1000, '', '')
+                s.sendall('%8s\0%s' % (len(msg)+9, msg))
+                return len(s.recv(9)) > 0
+            finally:
+                s.close()
+        except socket.error:
+            return False
+
+    def __str__(self):
+        return "sage %s:%d" % (self.host, self.port)
+
+
+
+# --------------------------------------------------------
+#
+#                  STARTUP GRAPH
+#
+# --------------------------------------------------------
+
+class Step:
+    """ one component: start() starts it (False or an exception means it
+        failed), it needs all the deps ready first and it's ready itself
+        once the probe says so (or right after start if there is no probe)
+    """
+    def __init__(self, name, start, deps=(), probe=None, timeout=READY_TIMEOUT):
+        self.name = name
+        self.start = start
+        self.deps = list(deps)
+        self.probe = probe
+        self.timeout = timeout
+        self.state = WAITING
+
+
+
+class Timeline:
+    """ what happened when (in seconds from the start) """
+    def __init__(self):
+        self.startTime = time.time()
+        self.events = []    # (seconds, name, event, detail)
+        self.__lock = Lock()
+
+    def add(self, name, event, detail=""):
+        self.__lock.acquire()
+        e = (time.time() - self.startTime, name, event, detail)
+        self.events.append(e)
+        self.__lock.release()
+        return e
+
+    def getTime(self, name, event):
+        for (t, n, e, d) in self.events:
+            if n == name and e == event:
+                return t
+        return None
+
+    def format(self):
+        lines = []
+        for (t, name, event, detail) in self.events:
+            lines.append("%7.2fs  %-22s %-9s %s" % (t, name, event, detail))
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        try:
+            f = open(path, "a")
+            f.write("\n---- startup at %s ----\n" % time.ctime(self.startTime))
+            f.write(self.format())
+            f.close()
+        except IOError:
+            print "Unable to save the startup timeline to", path
+
+
+
+class Orchestrator:
+    """ starts the steps as soon as their dependencies are ready.
+        onEvent(timelineEvent) is called (in the step's thread) on every change
+    """
+    
+    def __init__(self, steps, onEvent=None):
+        self.steps = {}
+        for step in steps:
+            self.steps[step.name] = step
+        self.onEvent = onEvent
+        self.timeline = Timeline()
+        self.__cond = Condition()
+        self.__check()
+
+
+    def run(self):
+        """ blocks until every step is ready, failed or skipped; returns the Timeline """
+        self.__cond.acquire()
+        try:
+            while True:
+                launched = False
+                for step in self.steps.values():
+                    if step.state != WAITING:
+                        continue
+                    depStates = [self.steps[d].state for d in step.deps]
+                    if FAILED in depStates or SKIPPED in depStates:
+                        step.state = SKIPPED
+                        self.__event(step, SKIPPED, "a dependency didn't start")
+                        launched = True
+                    elif depStates.count(READY) == len(depStates):
+                        step.state = STARTING
+                        t = Thread(target=self.__runStep, args=(step,))
+                        t.setDaemon(True)
+                        t.start()
+                        launched = True
+                        
+                states = [step.state for step in self.steps.values()]
+                if STARTING not in states and (WAITING not in states or not launched):
+                    break
+                if not launched:
+                    self.__cond.wait()
+        finally:
+            self.__cond.release()
+        self.timeline.add("ALL", "done")
+        return self.timeline
+
+
+    def isSuccessful(self):
+        return [s for s in self.steps.values() if s.state != READY] == []
+
+
+    def __runStep(self, step):
+        self.__event(step, "start")
+        try:
+            ok = step.start()
+        except:
+            ok = False
+            detail = str(sys.exc_info()[0])+" "+str(sys.exc_info()[1])
+        else:
+            detail = ""
+        
+        if ok is not False and step.probe:
+            end = time.time() + step.timeout
+            ok = False
+            while time.time() < end:
+                if step.probe():
+                    ok = True
+                    break
+                time.sleep(PROBE_INTERVAL)
+            if not ok:
+                detail = "%s not ready after %ds" % (step.probe, step.timeout)
+
+        self.__cond.acquire()
+        if ok is False:
+            step.state = FAILED
+        else:
+            step.state = READY
+        self.__event(step, step.state, detail)
+        self.__cond.notifyAll()
+        self.__cond.release()
+
+
+    def __event(self, step, event, detail=""):
+        e = self.timeline.add(step.name, event, detail)
+        if self.onEvent:
+            try:
+                self.onEvent(e)
+            except:
+                tb.print_exc()
+
+
+    def __check(self):
+        """ all the dependencies must exist and there can't be any cycles """
+        for step in self.steps.values():
+            for d in step.deps:
+                if d not in self.steps:
+                    raise ValueError("%s depends on unknown %s" % (step.name, d))
+        visiting = {}
+        def visit(name, path):
+            if visiting.get(name) == 1:
+                raise ValueError("dependency cycle: " + " -> ".join(path + [name]))
+            if visiting.get(name) == 2:
+                return
+            visiting[name] = 1
+            for d in self.steps[name].deps:
+                visit(d, path + [name])
+            visiting[name] = 2
+        for name in self.steps:
+            visit(name, [])
+
+
+
+# --------------------------------------------------------
+#
+#                  CLUSTER COMMANDS
+#
+# --------------------------------------------------------
+
+def _kill(p):
+    try:
+        if hasattr(p, "kill"):
+            p.kill()
+        elif sys.platform.startswith("win"):
+            sp.Popen(["taskkill", "/F", "/PID", str(p.pid)])
+        else:
+            os.kill(p.pid, 9)
+    except OSError:
+        pass   # it exited in the meantime
+
+
+def runCommand(cmd, timeout=COMMAND_TIMEOUT):
+    """ returns (returncode, output), returncode is None if it had to be killed """
+    devnull = open(os.devnull)
+    try:
+        # without close_fds every child would also hold the pipes of the
+        # others started at the same time (and they'd only see EOF when
+        # the slowest one is done)
+        p = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.STDOUT, stdin=devnull, close_fds=CLOSE_FDS)
+    except OSError:
+        return (127, str(sys.exc_info()[1]))
+    finally:
+        devnull.close()
+    
+    output = []
+    t = Thread(target=lambda: output.append(p.communicate()[0]))
+    t.setDaemon(True)
+    t.start()
+    t.join(timeout)
+    if t.isAlive():
+        _kill(p)
+        t.join(1)
+        return (None, "".join(output) + "\nkilled after %ds" % timeout)
+    return (p.returncode, "".join(output))
+
+
+def fanOut(cmds, maxParallel=MAX_PARALLEL_COMMANDS, timeout=COMMAND_TIMEOUT):
+    """ runs the commands (lists of args) maxParallel at a time and returns
+        [(cmd, returncode, output)] in the same order as the commands
+    """
+    results = [None] * len(cmds)
+    queue = Queue.Queue()
+    for i in range(len(cmds)):
+        queue.put(i)
+
+    def worker():
+        while True:
+            try:
+                i = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                (returncode, output) = runCommand(cmds[i], timeout)
+            except:   # never leave a hole in the results or the rest of the queue unrun
+                (returncode, output) = (None, "".join(tb.format_exception(*sys.exc_info())))
+            results[i] = (cmds[i], returncode, output)
+
+    workers = []
+    for i in range(min(maxParallel, len(cmds))):
+        t = Thread(target=worker)
+        t.setDaemon(True)
+        t.start()
+        workers.append(t)
+    for t in workers:
+        t.join()
+    return results
+
+
+
+# --------------------------------------------------------
+#
+#      A TRY OUT WITH STUB COMPONENTS ON LOCALHOST
+#
+# --------------------------------------------------------
+
+def _stubServer(port, delay):
+    """ starts listening on the port after delay seconds (like a slow component) """
+    def serve():
+        time.sleep(delay)
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(("127.0.0.1", port))
+        s.listen(5)
+        while True:
+            c = s.accept()[0]
+            c.close()
+    t = Thread(target=serve)
+    t.setDaemon(True)
+    t.start()
+    return True
+
+
+def main():
+    base = 29400
+    steps = [Step("sage", lambda: _stubServer(base, 1.0), [], PortProbe("127.0.0.1", base)),
+             Step("appLauncher", lambda: _stubServer(base+1, 0.5), [], PortProbe("127.0.0.1", base+1)),
+             Step("fileServer", lambda: _stubServer(base+2, 0.3), [], PortProbe("127.0.0.1", base+2)),
+             Step("sageProxy", lambda: _stubServer(base+3, 0.2), ["sage"], PortProbe("127.0.0.1", base+3)),
+             Step("ui", lambda: True, ["sage", "appLauncher"]),
+             Step("broken", lambda: True, [], PortProbe("127.0.0.1", base+4), timeout=2),
+             Step("needsBroken", lambda: True, ["broken"])]
+    print Orchestrator(steps).run().format()
+
+    for (cmd, returncode, output) in fanOut([["true"], ["false"], ["sleep", "5"]], timeout=1):
+        print cmd, returncode
+
+
+if __name__ == '__main__':
+    main()
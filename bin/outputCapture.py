@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+############################################################################
+#
+# SAGE LAUNCHER - A GUI for launching SAGE and all related components
+#
+# Copyright (C) 2007 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+
+
+#
+# Captures the console output of the components started by sageLauncher.
+#
+# A thread per component blocks on its pipe and takes whatever is there
+# as soon as it's there (no sleeping) so a component never blocks on a
+# full pipe no matter how much it prints. The output goes into an
+# OutputBuffer: a bounded ring of the most recent lines plus the text the
+# GUI hasn't shown yet. The GUI picks that up at a fixed frame rate with
+# takeUpdate() so a burst of output is one update instead of thousands.
+# If the GUI falls too far behind, the pending text is dropped and the GUI
+# redraws from the ring instead.
+#
+# Optionally everything is also written to a log file that's rotated
+# when it gets too big.
+#
+
+import os, sys, time
+from threading import Thread, Lock
+
+
+READ_SIZE = 65536          # bytes read from a pipe at once
+MAX_LINES = 2000           # lines kept in memory per component
+MAX_LINE_LEN = 4096        # longer lines (or binary junk) are split
+MAX_PENDING = 64000        # characters the GUI may fall behind before it has to redraw
+LOG_MAX_BYTES = 1000000    # log files are rotated at this size
+LOG_BACKUPS = 3            # how many old log files to keep
+
+
+
+class RotatingLog:
+    """ appends to path and moves it to path.1 (path.1 to path.2 ...)
+        when it grows over maxBytes
+    """
+    def __init__(self, path, maxBytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backups = backups
+        self.f = open(path, "a")
+        self.size = self.f.tell()
+
+
+    def write(self, data):
+        if self.size > 0 and self.size + len(data) > self.maxBytes:
+            self.__rotate()
+        self.f.write(data)
+        self.f.flush()
+        self.size += len(data)
+
+
+    def close(self):
+        self.f.close()
+
+
+    def __rotate(self):
+        self.f.close()
+        for i in range(self.backups-1, 0, -1):
+            old = "%s.%d" % (self.path, i)
+            if os.path.exists(old):
+                new = "%s.%d" % (self.path, i+1)
+                if os.path.exists(new):
+                    os.remove(new)
+                os.rename(old, new)
+        if self.backups > 0:
+            if os.path.exists(self.path+".1"):
+                os.remove(self.path+".1")
+            os.rename(self.path, self.path+".1")
+        self.f = open(self.path, "w")
+        self.size = 0
+
+
+
+class OutputBuffer:
+    """ recent output of one component, safe to append to from the
+        reading thread while the GUI takes updates
+    """
+    
+    def __init__(self, maxLines=MAX_LINES, maxPending=MAX_PENDING, logPath=None):
+        self.maxLines = maxLines
+        self.maxPending = maxPending
+        self.__lock = Lock()
+        self.__lines = []       # complete lines (with their \n), a ring of maxLines
+        self.__first = 0        # index of the oldest line in the ring
+        self.__partial = ""     # the last line if it didn't end yet
+        self.__pending = []     # text the GUI hasn't taken yet
+        self.__pendingLen = 0
+        self.__reset = False    # the GUI fell behind and must redraw everything
+        self.totalBytes = 0
+        self.droppedLines = 0   # lines that fell out of the ring
+        self.log = None
+        if logPath:
+            try:
+                self.log = RotatingLog(logPath)
+            except IOError:
+                print "Unable to open the output log", logPath
+
+
+    def append(self, data):
+        self.__lock.acquire()
+        try:
+            self.totalBytes += len(data)
+            if self.log:
+                try:
+                    self.log.write(data)
+                except (IOError, OSError):
+                    print "Unable to write the output log", self.log.path
+                    self.log = None
+
+            # split into lines
+            lines = (self.__partial + data).split("\n")
+            self.__partial = lines.pop()
+            for line in lines:
+                self.__addLine(line + "\n")
+            while len(self.__partial) > MAX_LINE_LEN:
+                self.__addLine(self.__partial[:MAX_LINE_LEN])
+                self.__partial = self.__partial[MAX_LINE_LEN:]
+
+            # what the GUI will show next
+            if not self.__reset:
+                self.__pending.append(data)
+                self.__pendingLen += len(data)
+                if self.__pendingLen > self.maxPending:
+                    self.__reset = True
+                    self.__pending = []
+                    self.__pendingLen = 0
+        finally:
+            self.__lock.release()
+
+
+    def takeUpdate(self):
+        """ returns (redraw, text): either the text to add to what the
+            GUI already shows or (if redraw is True) all the text to show
+        """
+        self.__lock.acquire()
+        try:
+            if self.__reset:
+                self.__reset = False
+                return (True, self.__getText())
+            text = "".join(self.__pending)
+            self.__pending = []
+            self.__pendingLen = 0
+            return (False, text)
+        finally:
+            self.__lock.release()
+
+
+    def getText(self):
+        self.__lock.acquire()
+        try:
+            return self.__getText()
+        finally:
+            self.__lock.release()
+
+
+    def getLines(self):
+        """ the complete lines in the ring, oldest first """
+        self.__lock.acquire()
+        try:
+            return self.__lines[self.__first:] + self.__lines[:self.__first]
+        finally:
+            self.__lock.release()
+
+
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
+
+
+    #-------------------------------------------------------
+
+    def __addLine(self, line):
+        if len(self.__lines) < self.maxLines:
+            self.__lines.append(line)
+        else:
+            self.__lines[self.__first] = line
+            self.__first = (self.__first + 1) % self.maxLines
+            self.droppedLines += 1
+
+
+    def __getText(self):
+        return "".join(self.__lines[self.__first:] + self.__lines[:self.__first]) + self.__partial
+
+
+
+def drain(fd, buf, keepReading=lambda: True):
+    """ reads everything from fd into the OutputBuffer until EOF
+        (the process exited) or keepReading() returns False
+    """
+    while keepReading():
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError:
+            break
+        if not data:
+            break
+        buf.append(data)
+
+
+
+def startDrain(fd, buf, keepReading=lambda: True):
+    t = Thread(target=drain, args=(fd, buf, keepReading))
+    t.setDaemon(True)
+    t.start()
+    return t
+
+
+
+# --------------------------------------------------------
+#
+#   A TRY OUT: a component that prints as fast as it can
+#
+# --------------------------------------------------------
+
+def main():
+    import subprocess as sp
+    lines = 200000
+    cmd = [sys.executable, "-c", "import sys\nfor i in xrange(%d): sys.stdout.write('line %%d of some output\\n' %% i)" % lines]
+    buf = OutputBuffer(logPath=len(sys.argv) > 1 and sys.argv[1] or None)
+    t0 = time.time()
+    p = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.STDOUT)
+    t = startDrain(p.stdout.fileno(), buf)
+
+    # a GUI taking updates 10 times a second
+    updates = redraws = 0
+    while t.isAlive():
+        time.sleep(0.1)
+        (redraw, text) = buf.takeUpdate()
+        updates += 1
+        redraws += redraw
+    p.wait()
+    print "%d bytes in %.2fs, %d GUI updates (%d redraws), %d lines kept, %d dropped" % \
+          (buf.totalBytes, time.time()-t0, updates, redraws, len(buf.getLines()), buf.droppedLines)
+    print "last line:", buf.getLines()[-1],
+    buf.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -36,44 +36,199 @@
 # Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
 #
 #
-############################################################################
 
-import Numeric, random
-import socket, sys, os
+#
+# Producers connect on PORT, send a header made of fixed size fields and
+# then stream fixed size text records (see monitorPerf.cpp):
+#
+#   lines:  "%12f %12f ..." x followed by one y per graph
+#   matrix: "%6d %6d %12f"  x, y and a value between 0 and 1
+#
+# TCP doesn't keep those records apart so every connection has a
+# RecordReader that hands out only whole records and keeps the rest for the
+# next read. The samples are kept in numpy ring buffers and the windows are
+# redrawn at most every REDRAW_INTERVAL ms (about the refresh rate of the
+# screen) no matter how fast the producers send.
+#
+# It can also plot the app performance from the perf collector (sageProxy.py
+# --perf or perfCollector.py) instead of asking SAGE for perf data itself:
+#    python performance_server.py -c sagehost[:port] [appId ...]
+# opens a window with the bandwidth and frame rates of every app given (the
+# site totals if none) from the collector's 1 second rollups.
+#
+
+import numpy
+import socket, errno, sys, os, optparse
+import wx
 from wx.lib.plot import *
 
 ARRAY_SIZE=100
+PORT = 50008              # Arbitrary non-privileged port
+FIELD_SIZE = 64           # size of the text fields in the header
+REDRAW_INTERVAL = 16      # ms, redraws (and reads) are done at most this often
+ACCEPT_INTERVAL = 100     # ms between checks for new producers
+RECV_SIZE = 65536
+
+COLLECTOR_PORT = 20008    # the perf collector's stream port (SAGE UI port + 7)
+COLLECTOR_RESOLUTION = 1  # seconds, we plot the rollups instead of every sample
+TOTALS_ID = -10           # the collector's appId for the site totals
+# the values of the collector lines we plot (of display bw, fps, loss, nodes, then the same for rendering)
+COLLECTOR_COLUMNS = ((0, "display bandwidth"), (1, "display fps"), (4, "render bandwidth"), (5, "render fps"))
+
+
+### reads exactly size bytes from a blocking socket
+def recvAll(conn, size):
+    data = ""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise socket.error("connection closed")
+        data += chunk
+    return data
+
+
+
+class RecordReader:
+    """ splits the stream from a non-blocking socket into fixed size records """
+    
+    def __init__(self, conn, recordSize):
+        self.conn = conn
+        self.recordSize = recordSize
+        self.closed = False
+        self.__partial = ""
+
+
+    def read(self):
+        """ returns all the whole records that arrived so far as one string """
+        chunks = [self.__partial]
+        while True:
+            try:
+                data = self.conn.recv(RECV_SIZE)
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    self.closed = True
+                break
+            if not data:
+                self.closed = True
+                break
+            chunks.append(data)
+        data = "".join(chunks)
+        whole = len(data) - len(data) % self.recordSize
+        self.__partial = data[whole:]
+        return data[:whole]
+
+
+    def readValues(self, numValues):
+        """ returns the new records as a (n, numValues) array of floats """
+        data = self.read().replace("\0", " ")
+        if not data:
+            return None
+        try:
+            return numpy.array(data.split(), numpy.float64).reshape(-1, numValues)
+        except ValueError:
+            # something in there is not a number... parse them one by one and skip the bad ones
+            rows = []
+            for i in range(0, len(data), self.recordSize):
+                try:
+                    row = [float(v) for v in data[i:i+self.recordSize].split()]
+                    if len(row) == numValues:
+                        rows.append(row)
+                except ValueError:
+                    pass
+            if rows:
+                return numpy.array(rows, numpy.float64)
+            return None
+
+
+
+class CollectorReader(RecordReader):
+    """ the "<time> <appId> <8 values>" lines of a perf collector stream
+        as records of the seconds since we connected and the plotted values
+    """
+
+    def __init__(self, conn, columns):
+        RecordReader.__init__(self, conn, 1)
+        self.columns = columns
+        self.start = None
+        self.__partial = ""
+
+
+    def read(self):
+        """ returns all the whole lines that arrived so far """
+        data = self.__partial + RecordReader.read(self)
+        whole = data.rfind("\n") + 1
+        self.__partial = data[whole:]
+        return data[:whole]
+
+
+    def readValues(self, numValues):
+        rows = []
+        for line in self.read().splitlines():
+            try:
+                tokens = [float(t) for t in line.split()]
+            except ValueError:
+                continue
+            if len(tokens) != 10:
+                continue
+            if self.start is None:
+                self.start = tokens[0]
+            rows.append([tokens[0] - self.start] + [tokens[2+i] for i in self.columns])
+        if rows:
+            return numpy.array(rows, numpy.float64)
+        return None
+
+
+
+class SampleRing:
+    """ the last capacity rows of samples, appended in batches """
+
+    def __init__(self, capacity, numColumns):
+        self.capacity = capacity
+        self.__data = numpy.zeros((capacity, numColumns), numpy.float64)
+        self.__next = 0     # where the next row goes
+        self.count = 0
+
+
+    def extend(self, rows):
+        n = len(rows)
+        if n >= self.capacity:
+            self.__data[:] = rows[-self.capacity:]
+            self.__next = 0
+        else:
+            end = self.__next + n
+            if end <= self.capacity:
+                self.__data[self.__next:end] = rows
+            else:
+                split = self.capacity - self.__next
+                self.__data[self.__next:] = rows[:split]
+                self.__data[:n-split] = rows[split:]
+            self.__next = end % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+
+    def ordered(self):
+        """ the rows oldest first """
+        if self.count < self.capacity:
+            return self.__data[:self.count]
+        return numpy.concatenate((self.__data[self.__next:], self.__data[:self.__next]))
+
+
 
 class LineFrame(wx.Dialog):
     def _createObjects(self):
         print "create ", self.numgraphs, "graphs"
-        self.current = {}
-        self.datasets = {}
-        for i in range(self.numgraphs):
-            self.current[i] = 0
-            self.datasets[i] = Numeric.arange(ARRAY_SIZE*2)/float(ARRAY_SIZE*2)
-            self.datasets[i].shape = (ARRAY_SIZE, 2)
-            self.datasets[i][:,1] = 0
+        self.samples = SampleRing(ARRAY_SIZE, self.numgraphs+1)   # x and then all the ys
         
-    def _addPoint(self,values):
-        x = float(values[0])
-        for j in range(self.numgraphs):
-            ar = [x, float(values[j+1])]
-            if self.current[j] < ARRAY_SIZE:
-                for i in range(self.current[j],ARRAY_SIZE):
-                    self.datasets[j][i] = ar
-                self.current[j] = self.current[j] + 1
-            else:
-                for i in range(1,ARRAY_SIZE):
-                    self.datasets[j][i-1] = self.datasets[j][i]
-                self.datasets[j][ARRAY_SIZE-1] = ar
-        self.client.Draw(self._drawObjects())
+    def _addPoints(self, rows):
+        self.samples.extend(rows)
+        self.dirty = True
         
     def _drawObjects(self):
         # ARRAY_SIZE points, plotted as red line
+        data = self.samples.ordered()
         lines = []
         for i in range(self.numgraphs):
-            lines.append( PolyLine(self.datasets[i], legend=self.ytitle[i], width=3,
+            lines.append( PolyLine(data[:, (0, i+1)], legend=self.ytitle[i], width=3,
                                    colour=self.colors[i%6]) )
         return PlotGraphics(lines, self.title, self.xtitle, "")
 
@@ -83,12 +238,12 @@ class LineFrame(wx.Dialog):
         self.frame = parent
 
         # Network connection
-        self.conn = None
+        self.reader = None
+        self.dirty = False
         
-        # self.timer = wx.Timer(self)
-        # self.timer.Start(10)
-        # self.Bind(wx.EVT_TIMER, self.OnTimer)
-        self.Bind(wx.EVT_IDLE, self.OnTimer)
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnTimer)
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
         
         self.client = PlotCanvas(self)
         # Create mouse event for showing cursor coords in status bar
@@ -110,7 +265,11 @@ class LineFrame(wx.Dialog):
         self.resetDefaults()
 
     def SetClient(self, conn):
-        self.conn = conn
+        self.SetReader(RecordReader(conn, 12*(self.numgraphs+1) + self.numgraphs))
+
+    def SetReader(self, reader):
+        self.reader = reader
+        self.timer.Start(REDRAW_INTERVAL)
 
     def SetNumGraphs(self, n):
         self.numgraphs = n
@@ -124,23 +283,21 @@ class LineFrame(wx.Dialog):
         self.numgraphs = ind+1
 
     def OnTimer(self, event):
-        if self.conn:
-            data = 1
-            it = 0
-            while data and (it<5):
-                try:
-                    msglen = 12*(self.numgraphs+1) + self.numgraphs
-                    data = self.conn.recv(msglen)
-                    if data:
-                        values = data.split()
-                        self._addPoint(values)
-                        it = it + 1
-                    else:
-                        return
-                except:
-                    return
-        self.client.Draw(self._drawObjects())
-        #event.RequestMore(True)
+        if self.reader:
+            rows = self.reader.readValues(self.numgraphs+1)
+            if rows is not None:
+                self._addPoints(rows)
+            if self.reader.closed:
+                self.timer.Stop()
+        if self.dirty and self.samples.count > 0:
+            self.dirty = False
+            self.client.Draw(self._drawObjects())
+
+    def OnClose(self, event):
+        self.timer.Stop()
+        if self.reader:
+            self.reader.conn.close()
+        self.Destroy()
         
     def OnMouseLeftDown(self,event):
         s= "Left Mouse Down at Point: (%.4f, %.4f)" % self.client.GetXY(event)
@@ -225,6 +382,9 @@ class MatrixCanvas(wx.Window):
 
         
     def Draw(self, graphics):
+        """ graphics is a (width, height) array of values between 0 and 1,
+            drawn as one grayscale image scaled up to the window
+        """
         # allows using floats for certain functions 
         dc = wx.BufferedDC(wx.ClientDC(self), self._Buffer)
             
@@ -232,27 +392,32 @@ class MatrixCanvas(wx.Window):
         dc.Clear()
 
         Size  = self.GetClientSize()
-        width, height, colors =  graphics
+        width, height = graphics.shape
         stepw = (Size[0] - 60) / width
         steph = (Size[1] - 60) / height
-        dc.SetPen(wx.Pen(wx.BLUE,1))
-        k = 0
-        for i in range(width):
-            for j in range(height):
-                dc.SetBrush(wx.Brush(colors[k]))
-		#if os.uname()[0] == 'Darwin':
-		#    dc.DrawRectangle( (30+i*stepw,30+j*steph), (stepw,steph))
-		#else:
-                dc.DrawRectangle( 30+i*stepw,30+j*steph, stepw,steph)
-                k = k + 1
+        if stepw > 0 and steph > 0:
+            # one gray byte per cell, repeated for r, g and b (rows of the image are the y)
+            gray = (numpy.clip(graphics, 0.0, 1.0) * 255.0).astype(numpy.uint8).T
+            rgb = numpy.repeat(gray[:,:,numpy.newaxis], 3, 2)
+            img = wx.EmptyImage(width, height)
+            img.SetData(numpy.ascontiguousarray(rgb).tostring())
+            img.Rescale(width*stepw, height*steph)   # nearest neighbour, so the cells stay sharp
+            dc.DrawBitmap(img.ConvertToBitmap(), 30, 30)
+
+            # the cell borders
+            right = 30 + width*stepw
+            bottom = 30 + height*steph
+            lines = [(30+i*stepw, 30, 30+i*stepw, bottom) for i in range(width+1)]
+            lines.extend([(30, 30+j*steph, right, 30+j*steph) for j in range(height+1)])
+            dc.DrawLineList(lines, wx.Pen(wx.BLUE,1))
         self.last_draw = graphics
 
         dc.EndDrawing()
         
     def Redraw(self, dc= None):
         """Redraw the existing plot."""
-        if self.last_draw:
-            self.Draw(last_draw)
+        if self.last_draw is not None:
+            self.Draw(self.last_draw)
 
     def Clear(self):
         """Erase the window."""
@@ -278,27 +443,14 @@ class MatrixCanvas(wx.Window):
 class MatrixFrame(wx.Dialog):
     def _createObjects(self):
         print "create matrix"
-        self.data = Numeric.arange(self.w*self.h)/3.0
-        self.data.shape = (self.w,self.h)
-        self.data[:] = 0.0
-
-    def _drawObjects(self):        
-        ar = []
-        for i in range(self.w):
-            for j in range(self.h):
-                val = self.data[i][j]
-                col = wx.Color( int(val*255.),
-                                int(val*255.),
-                                int(val*255.))
-                ar.append( col )
-        return (self.w, self.h, ar)
-
-    def _addPoint(self,values):
-        x   = int(values[0])
-        y   = int(values[1])
-        val = float(values[2])
-        self.data[x][y] = val
-        self.client.Draw(self._drawObjects())
+        self.data = numpy.zeros((self.w,self.h), numpy.float64)
+
+    def _addPoints(self, rows):
+        x = rows[:,0].astype(int)
+        y = rows[:,1].astype(int)
+        ok = (x >= 0) & (x < self.w) & (y >= 0) & (y < self.h)
+        self.data[x[ok], y[ok]] = rows[ok,2]
+        self.dirty = True
         
     def __init__(self, parent, id, title, xs, ys):
         wx.Dialog.__init__(self, parent, id, title,
@@ -306,12 +458,15 @@ class MatrixFrame(wx.Dialog):
         self.frame = parent
 
         # Network connection
-        self.conn = None
+        self.reader = None
+        self.dirty = False
 
         # Drawing object
         self.client = MatrixCanvas(self)        
         
-        self.Bind(wx.EVT_IDLE, self.OnTimer)
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnTimer)
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
         self.Show(True)
 
         self.w = xs
@@ -326,7 +481,8 @@ class MatrixFrame(wx.Dialog):
         self.ytitle = "Y Title"
 
     def SetClient(self, conn):
-        self.conn = conn
+        self.reader = RecordReader(conn, 6 + 1 + 6 + 1 + 12)  # x y value
+        self.timer.Start(REDRAW_INTERVAL)
     def SetTitle(self, t):
         self.title = t
     def SetXtitle(self, t):
@@ -335,91 +491,113 @@ class MatrixFrame(wx.Dialog):
         self.ytitle = t
 
     def OnTimer(self, event):
-        if self.conn:
-            data = 1
-            it = 0
-            while data and (it<5):
-                try:
-                    msglen = 6 + 1 + 6 + 1 + 12  # x y value
-                    data = self.conn.recv(msglen)
-                    if data:
-                        values = data.split()
-                        self._addPoint(values)
-                        it = it + 1
-                    else:
-                        return
-                except:
-                    return
-        self.client.Draw(self._drawObjects())
-        #event.RequestMore(True)
+        if self.reader:
+            rows = self.reader.readValues(3)
+            if rows is not None:
+                self._addPoints(rows)
+            if self.reader.closed:
+                self.timer.Stop()
+        if self.dirty:
+            self.dirty = False
+            self.client.Draw(self.data)
+
+    def OnClose(self, event):
+        self.timer.Stop()
+        if self.reader:
+            self.reader.conn.close()
+        self.Destroy()
+        
 
 class MyApp(wx.App):
 
-    def OnIdle(self, event):
-        try:
-            conn, addr = self.s.accept()
-            conn.setblocking(1)
-            print 'Connected by', addr
-            type = conn.recv(64)
-            type = type.strip()
-            print "\t type[", type, "]"
-            if type == "lines":
-                title = conn.recv(64)
-                title = title.strip()
-                print "\t title[", title, "]"
-                xtitle = conn.recv(64)
-                xtitle = xtitle.strip()
-                print "\t xtitle[", xtitle, "]"
-                numgraphs = int( conn.recv(6) )
-                print "\t numgraphs", numgraphs
-                ytitle = {}
-                for i in range(numgraphs):
-                    ytitle[i] = conn.recv(64)
-                    ytitle[i] = ytitle[i].strip()
-                    print "\t\t graph", i, " name[", ytitle[i], "]"
-                frame = LineFrame(self.myframe, -1, title)
-                frame.SetNumGraphs(numgraphs)
-                frame.SetXtitle(xtitle)
-                for i in range(numgraphs):
-                    frame.SetYtitle(i, ytitle[i])
-                frame.SetClient(conn)
-                conn.send("1")
-                conn.setblocking(0)
-            if type == "matrix":
-                title = conn.recv(64)
-                title = title.strip()
-                print "\t title[", title, "]"
-                xtitle = conn.recv(64)
-                xtitle = xtitle.strip()
-                print "\t xtitle[", xtitle, "]"
-                sizes = conn.recv(13)
-                sizes = sizes.strip()
-                xs,ys = sizes.split()
-                xs = int(xs)
-                ys = int(ys)
-                numgraphs = 2
-                print "\t numgraphs", numgraphs
-                ytitle = {}
-                for i in range(numgraphs):
-                    ytitle[i] = conn.recv(64)
-                    ytitle[i] = ytitle[i].strip()
-                    print "\t\t graph", i, " name[", ytitle[i], "]"
-                frame = MatrixFrame(self.myframe, -1, title, xs, ys)
-                #frame.SetXtitle(xtitle)
-                #for i in range(numgraphs):
-                #    frame.SetYtitle(i, ytitle[i])
-                frame.SetClient(conn)
-                conn.send("1")
-                conn.setblocking(0)
-        except:
-            pass
-        event.RequestMore(True)
+    def OnAcceptTimer(self, event):
+        while True:
+            try:
+                conn, addr = self.s.accept()
+            except socket.error:
+                return    # nobody else waiting
+            try:
+                self.AddProducer(conn, addr)
+            except:
+                print "Bad producer", addr, sys.exc_info()[1]
+                conn.close()
+
+    def AddProducer(self, conn, addr):
+        conn.setblocking(1)
+        conn.settimeout(5)     # the header should come right away
+        print 'Connected by', addr
+        type = recvAll(conn, FIELD_SIZE)
+        type = type.strip()
+        print "\t type[", type, "]"
+        if type == "lines":
+            title = recvAll(conn, FIELD_SIZE)
+            title = title.strip()
+            print "\t title[", title, "]"
+            xtitle = recvAll(conn, FIELD_SIZE)
+            xtitle = xtitle.strip()
+            print "\t xtitle[", xtitle, "]"
+            numgraphs = int( recvAll(conn, 6) )
+            print "\t numgraphs", numgraphs
+            ytitle = {}
+            for i in range(numgraphs):
+                ytitle[i] = recvAll(conn, FIELD_SIZE)
+                ytitle[i] = ytitle[i].strip()
+                print "\t\t graph", i, " name[", ytitle[i], "]"
+            frame = LineFrame(self.myframe, -1, title)
+            frame.SetNumGraphs(numgraphs)
+            frame.SetXtitle(xtitle)
+            for i in range(numgraphs):
+                frame.SetYtitle(i, ytitle[i])
+            conn.send("1")
+            conn.setblocking(0)
+            frame.SetClient(conn)
+        elif type == "matrix":
+            title = recvAll(conn, FIELD_SIZE)
+            title = title.strip()
+            print "\t title[", title, "]"
+            xtitle = recvAll(conn, FIELD_SIZE)
+            xtitle = xtitle.strip()
+            print "\t xtitle[", xtitle, "]"
+            sizes = recvAll(conn, 13)
+            sizes = sizes.strip()
+            xs,ys = sizes.split()
+            xs = int(xs)
+            ys = int(ys)
+            numgraphs = 2
+            print "\t numgraphs", numgraphs
+            ytitle = {}
+            for i in range(numgraphs):
+                ytitle[i] = recvAll(conn, FIELD_SIZE)
+                ytitle[i] = ytitle[i].strip()
+                print "\t\t graph", i, " name[", ytitle[i], "]"
+            frame = MatrixFrame(self.myframe, -1, title, xs, ys)
+            #frame.SetXtitle(xtitle)
+            #for i in range(numgraphs):
+            #    frame.SetYtitle(i, ytitle[i])
+            conn.send("1")
+            conn.setblocking(0)
+            frame.SetClient(conn)
+        else:
+            conn.close()
+
+    def WatchCollector(self, host, port, appId):
+        """ plots one app (or the site totals) from the perf collector """
+        conn = socket.create_connection((host, port), 5)
+        conn.sendall("%d %d\n" % (COLLECTOR_RESOLUTION, appId))
+        conn.setblocking(0)
+        if appId == TOTALS_ID:  title = "site totals on " + host
+        else:                   title = "app %d on %s" % (appId, host)
+        frame = LineFrame(self.myframe, -1, title)
+        frame.SetNumGraphs(len(COLLECTOR_COLUMNS))
+        frame.SetXtitle("seconds")
+        for i in range(len(COLLECTOR_COLUMNS)):
+            frame.SetYtitle(i, COLLECTOR_COLUMNS[i][1])
+        frame.SetReader(CollectorReader(conn, [c[0] for c in COLLECTOR_COLUMNS]))
 
     def OnInit(self):
         wx.InitAllImageHandlers()
         self.myframe= wx.Frame(None, -1, "MainFrame")
 
-        self.Bind(wx.EVT_IDLE, self.OnIdle)
         
         # Now Create the menu bar and items
         self.myframe.mainmenu = wx.MenuBar()
@@ -457,16 +635,38 @@ class MyApp(wx.App):
         self.myframe.Show(True)
 
         HOST = ''                 # Symbolic name meaning the local host
-        PORT = 50008              # Arbitrary non-privileged port
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.s.bind((HOST, PORT))
         self.s.listen(5)
         self.s.setblocking(0)
+
+        # new producers are picked up on a timer instead of spinning on idle events
+        self.acceptTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnAcceptTimer, self.acceptTimer)
+        self.acceptTimer.Start(ACCEPT_INTERVAL)
+
+        # the app performance from a perf collector
+        if collector:
+            (host, port) = (collector.split(":") + [COLLECTOR_PORT])[:2]
+            for appId in (collectorApps or [TOTALS_ID]):
+                try:
+                    self.WatchCollector(host, int(port), appId)
+                except socket.error:
+                    print "Can't reach the perf collector on", collector, sys.exc_info()[1]
+                    break
                     
         self.SetTopWindow(self.myframe)
         
         return True
 
+
+parser = optparse.OptionParser(usage="python performance_server.py [-c sagehost[:port] [appId ...]]")
+parser.add_option("-c", "--collector", dest="collector", default="",
+                  help="also plot the apps from the perf collector on this machine (the site totals if no appIds are given)")
+(options, args) = parser.parse_args()
+collector = options.collector
+collectorApps = [int(a) for a in args]
             
 app = MyApp(0)
 app.MainLoop()
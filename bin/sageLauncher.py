@@ -40,7 +40,7 @@
 ############################################################################
 
 
-import wx, cPickle, os, sys, os.path, stat, string, copy, time, cStringIO, zlib, pickle
+import wx, cPickle, os, sys, os.path, stat, string, copy, cStringIO, zlib, pickle
 import wx.lib.filebrowsebutton as fb
 import wx.lib.buttons as buttons
 import wx.lib.hyperlink as hl
@@ -54,6 +54,7 @@ from threading import Thread
 # shortcut
 opj = os.path.join
 from sagePath import getUserPath, SAGE_DIR, getPath, getDefaultPath
+import orchestrator, outputCapture
 
 
 # --------------------------------------------------------
@@ -77,6 +78,9 @@ components = {}   # key=componentType, value=Component()
 tileConfig = None
 
 MAX_TEXT_LEN = 64000     # max characters in the output text ctrl
+STARTUP_LOG = getUserPath("sageLauncherStartup.log")   # timelines of all the startups
+OUTPUT_FPS = 10          # how many times a second the output text ctrls are updated
+LOG_TO_DISK = "-l" in sys.argv   # also keep the output of each component in rotated log files
 PREFS_FILE = getUserPath("sageLauncherSettings.pickle")   # store the settings in a pickle file
 PY_EXEC = sys.executable    # platform dependent python executable
 
@@ -190,6 +194,86 @@ def getTileConfig():
     return getPath(config)
 
 
+def getUIPort():
+    """ returns the port fsManager listens on for UIs
+        as specified in the fsManager.conf """
+    port = 20001
+    f = open( getPath("fsManager.conf"), "r")
+    for line in f:
+        line = line.strip()
+        if line.startswith('uiPort'):
+            port = int(line.split()[1].strip())
+    f.close()
+    return port
+
+
+
+# --------------------------------------------------------
+#
+#                     STARTUP
+#
+# --------------------------------------------------------
+
+# what each component needs running before it can start
+dependencies = { SAGE         : [],
+                 APP_LAUNCHER : [],
+                 FILE_SERVER  : [],
+                 SAGE_PROXY   : [SAGE],
+                 SAGE_UI      : [SAGE, APP_LAUNCHER] }
+
+startupThread = None
+
+
+def getProbe(componentType):
+    """ how to tell that a component is ready (None means as soon as it's started) """
+    settings = components[componentType].settings
+    if componentType == SAGE:
+        return orchestrator.SageProbe("127.0.0.1", getUIPort())
+    elif componentType == APP_LAUNCHER:
+        return orchestrator.XMLRPCProbe("127.0.0.1", settings.port, "test")
+    elif componentType == FILE_SERVER:
+        return orchestrator.PortProbe("127.0.0.1", 8800)
+    elif componentType == SAGE_PROXY:
+        return orchestrator.XMLRPCProbe("127.0.0.1", settings.port+3)
+    return None
+
+
+def startComponents():
+    """ starts all the checked components in a thread so that the
+        UI doesn't block while waiting for them to become ready
+    """
+    global startupThread
+    if startupThread and startupThread.isAlive():
+        print "Startup already in progress"
+        return
+    startupThread = Thread(target=runStartup)
+    startupThread.setDaemon(True)
+    startupThread.start()
+
+
+def runStartup():
+    # a previous STOP may still be killing SAGE on the nodes
+    components[SAGE].process.waitForStop()
+
+    steps = []
+    for c in components.itervalues():
+        if c.settings.doRun:
+            # components that we aren't starting can't be waited for
+            deps = [d for d in dependencies[c.componentType] if components[d].settings.doRun]
+            steps.append( orchestrator.Step(c.componentType, c.process.start, deps,
+                                            getProbe(c.componentType)) )
+
+    def onEvent(e):
+        print "%7.2fs  %-22s %-9s %s" % e
+
+    try:
+        timeline = orchestrator.Orchestrator(steps, onEvent).run()
+        timeline.save(STARTUP_LOG)
+    except:
+        print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
+    wx.CallAfter(saveSettings)  # to save the changed PIDs
+
+
 
 
 # --------------------------------------------------------
@@ -306,10 +390,11 @@ class SageSettings(ComponentSettings):
             IPs = tileConfig.getAllIPs()  
             IPs.append("127.0.0.1")
 
+            # no -f, fanOut waits for each ssh and collects its exit status
             for node in IPs:
                 c = []
                 k = "/usr/bin/killall -9 %s" % killString
-                c.extend( ["/usr/bin/ssh", "-fx", node, k] ) 
+                c.extend( ["/usr/bin/ssh", "-x", "-o", "BatchMode=yes", "-o", "ConnectTimeout=5", node, k] ) 
                 cmds.append(c)
 
         return cmds
@@ -1095,6 +1180,7 @@ class FileServerFrame(ComponentFrame):
         self.types ={}
         self.viewers = {}
         self.filesDir = ""
+        self.cacheSize = None   # in MB, the FileServer's default is used if not set
         self.ReadConfigFile()
         
         self.MakeWidgets()
@@ -1203,6 +1289,10 @@ class FileServerFrame(ComponentFrame):
             if line.startswith("FILES_DIR"):
                 self.filesDir = line.split("=")[1].strip()
 
+            # read the size of the cache for files from other FileServers
+            elif line.startswith("CACHE_SIZE"):
+                self.cacheSize = line.split("=")[1].strip()
+
             # read types
             elif line.startswith("type:"):
                 line = line.split(":",1)[1]
@@ -1227,6 +1317,8 @@ class FileServerFrame(ComponentFrame):
             
             f = open(getUserPath("fileServer", "fileServer.conf"), "w")
             f.write("FILES_DIR = "+ self.filesDir+"\n")
+            if self.cacheSize:
+                f.write("CACHE_SIZE = "+ self.cacheSize+"\n")
 
             f.write("\n#"+"----"*12+"\n\n")  # separator
             
@@ -1679,12 +1771,23 @@ class ComponentsPanel(scrolled.ScrolledPanel):
         mainSizer.Add(compSizer, 0, wx.EXPAND | wx.ALIGN_LEFT | wx.ALL, 5)
         mainSizer.Add(self.outSizer, 1, wx.EXPAND | wx.LEFT | wx.BOTTOM, 15)
 
+        # show the new output of all the components at a fixed rate
+        self.outputTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnOutputTimer, self.outputTimer)
+        self.outputTimer.Start(1000 / OUTPUT_FPS)
+
         # select the default component
         self.SetSizerAndFit(mainSizer)
         self.SetAutoLayout(1)
         self.SetupScrolling()
 
 
+    def OnOutputTimer(self, evt):
+        for c in components.itervalues():
+            if c.process:
+                c.process.flushOutput()
+
+
 
 
 class RunPanel(wx.Panel):
@@ -1753,21 +1856,10 @@ class RunPanel(wx.Panel):
             
 
     def OnRun(self, evt):
-        """ start all the checked processes... but start sage before everything else
-            because some components need sage running already
+        """ start all the checked processes (each one as soon as
+            the components it needs are ready)
         """
-
-        # first start sage and then sleep for a few seconds
-        sage = components[SAGE]
-        if sage.settings.doRun:
-            sage.process.start()
-            time.sleep(2)
-
-        # now start the rest of the components
-        for c in components.itervalues():
-            if c.componentType != SAGE and c.settings.doRun:
-                c.process.start()
-        saveSettings()  # to save the changed PIDs
+        startComponents()
         
 
     def OnStop(self, evt):
@@ -1940,21 +2032,10 @@ class QuickFrame(wx.Frame):
 
 
     def OnRun(self, evt):
-        """ start all the checked processes... but start sage before everything else
-            because some components need sage running already
+        """ start all the checked processes (each one as soon as
+            the components it needs are ready)
         """
-
-        # first start sage and then sleep for a few seconds
-        sage = components[SAGE]
-        if sage.settings.doRun:
-            sage.process.start()
-            time.sleep(2)
-
-        # now start the rest of the components
-        for c in components.itervalues():
-            if c.componentType != SAGE and c.settings.doRun:
-                c.process.start()
-        saveSettings()  # to save the changed PIDs
+        startComponents()
         
 
     def OnStop(self, evt):
@@ -2074,15 +2155,24 @@ class Process:
         self.p = None    # Popen process object
         self.t = None    # thread reading the output from the process
         self._extraProcesses = []  # pids of extra processes started before SAGE
+        self._killThread = None    # runs the kill commands on all the nodes
+
+        # recent output (shown by flushOutput)
+        if LOG_TO_DISK:
+            logPath = getUserPath("sageLauncherLogs", componentType.replace(" ", "") + ".log")
+        else:
+            logPath = None
+        self.buffer = outputCapture.OutputBuffer(maxPending=MAX_TEXT_LEN, logPath=logPath)
 
 
     def start(self):
         """ if the process is already running do nothing...
             otherwise launch the new process and 
+            returns False only if it couldn't be started
         """
         if self.isAlive():
-            self.output.SetInsertionPointEnd()
-            self.output.WriteText("\n\n**** Already running ****\n\n")
+            self.buffer.append("\n\n**** Already running ****\n\n")
+            return True   # maybe only a pid from the saved settings, the readiness probe will tell
         else:
             cmd = self.settings.getStartCommand()
             cwdir = self.settings.getCwd()
@@ -2091,11 +2181,11 @@ class Process:
                 # execute any extra commands first
                 self.__startExtra()
                 
-                self.p = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.STDOUT, bufsize=1, cwd=cwdir)
-                self.t = Thread(target=self.__readOutput)
-                self.t.setDaemon(True)
+                self.p = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.STDOUT, bufsize=1, cwd=cwdir,
+                                  close_fds=orchestrator.CLOSE_FDS)   # or it holds the pipes of the others
                 self.doRead = True
-                self.t.start()
+                self.t = outputCapture.startDrain(self.p.stdout.fileno(), self.buffer,
+                                                  lambda: self.doRead)
                 self.running = True
                 self.settings.pid = self.p.pid  # save the pid for later
                 
@@ -2107,6 +2197,8 @@ class Process:
                 self.t = None
                 self.p = None
 
+        return self.running
+
 
     def __startExtra(self):
         """ if the component has any extra commands to execute
@@ -2115,7 +2207,7 @@ class Process:
             if self.settings.onStart != "":
                 for cmd in self.settings.onStart.splitlines():
                     if not cmd.strip().startswith("#"):
-                        proc = sp.Popen(cmd.split())
+                        proc = sp.Popen(cmd.split(), close_fds=orchestrator.CLOSE_FDS)
                         self._extraProcesses.append(proc.pid)  # save the pid for later killing
         
 
@@ -2124,8 +2216,9 @@ class Process:
         try:
             # kill SAGE unconditionally
             if self.componentType == SAGE:
-                for c in self.settings.getKillCmd():
-                    sp.Popen(c)
+                self._killThread = Thread(target=self.__killOnNodes, args=(self.settings.getKillCmd(),))
+                self._killThread.setDaemon(True)
+                self._killThread.start()
 
                 # kill extra stuff started before sage
                 for pid in self._extraProcesses:
@@ -2161,6 +2254,21 @@ class Process:
         self.t = None
 
 
+    def __killOnNodes(self, cmds):
+        """ runs the kill commands in parallel and reports the ones that failed """
+        for (cmd, returncode, output) in orchestrator.fanOut(cmds):
+            # killall returns 1 when there was nothing to kill
+            if returncode not in (0, 1):
+                print " ***** Kill failed (status %s): %s\n%s" % (returncode, " ".join(cmd), output.strip())
+
+
+    def waitForStop(self, timeout=orchestrator.COMMAND_TIMEOUT+5):
+        """ waits for the kill commands started by stop() to finish """
+        if self._killThread:
+            self._killThread.join(timeout)
+            self._killThread = None
+
+
     def __stopExtra(self):
         """ if the component has any extra commands to execute
             after stopping, this will execute them """
@@ -2203,28 +2311,25 @@ class Process:
         self.doRead = False
         
     
-    def __readOutput(self):
-        """ this runs in a thread and it checks for the output
-            from the executed process. Once the output comes in,
-            it tells the main wx thread to add the text that was
-            just read.
+    def flushOutput(self):
+        """ called by the GUI timer: adds all the output that came in
+            since the last time in one go. If the text we are about to
+            insert would overflow the control, first remove enough text
+            (plus some more so that it doesn't happen every time) from
+            the beginning. If the output came in faster than we can
+            show it, show the tail of the recent output instead.
         """
-        while self.doRead:
-            txt = os.read(self.p.stdout.fileno(), 2048)
-            wx.CallAfter(self.fillText, txt)
-            time.sleep(0.3)   # read at most twice / sec
-
-
-    def fillText(self, txt):
-        """ first check whether the text we are about to insert
-            will overflow the control or not. If it would, remove
-            some text from the beginning and then append the
-            new text. If not, just append the new text.
-        """
-        if len(txt) + self.output.GetLastPosition() > MAX_TEXT_LEN:
-            self.output.Remove(0, 2048)
+        redraw, txt = self.buffer.takeUpdate()
+        if redraw:
+            self.output.SetValue(txt[-MAX_TEXT_LEN:])
+        elif txt:
+            excess = len(txt) + self.output.GetLastPosition() - MAX_TEXT_LEN
+            if excess > 0:
+                self.output.Remove(0, excess + MAX_TEXT_LEN/8)
+            self.output.WriteText(txt)
+        else:
+            return
         self.output.SetInsertionPointEnd()
-        self.output.WriteText(txt)
 
 
 
@@ -72,7 +72,7 @@
 
 
 
-from threading import Thread
+from threading import Thread, Lock
 import socket, sys, string, os.path, xmlrpclib
 
 
@@ -89,6 +89,8 @@ class SAGEGate:
 		self.threadkilled = False
 		self.connected = False
 		self.WriteLog = logFunc  #redirect output
+		self.launcherLock = Lock()   # the xmlrpc connection to the appLauncher can't be shared by threads
+		self.sendLock = Lock()       # so that messages from different threads don't get mixed up
 	
 		# used for printing out informative messages (on sending and receiving)
 		self.hashOutgoingMessages = {}  #RJ 2005-01-24
@@ -193,16 +195,28 @@ class SAGEGate:
 
 	def sendmsg(self,msg):
 		totalcount = 0
+		self.sendLock.acquire()
 		try:
-			totalcount = self.sock.send(msg)
-		except socket.error:
-			#print 'socket error'
-			totalcount = -1
-		except Exception:
-			totalcount = -1
+			try:
+				self.sock.sendall(msg)
+				totalcount = len(msg)
+			except socket.error:
+				#print 'socket error'
+				totalcount = -1
+			except Exception:
+				totalcount = -1
+		finally:
+			self.sendLock.release()
 		return totalcount
 
 
+	# sends a list of messages back to back (in one write so nothing else gets in between)
+	def sendBatch(self, msgs):
+		if self.connected == False: return 0
+		if not msgs: return 0
+		return self.sendmsg("".join(msgs))
+
+
 	# get the applist from the applauncher first and call the appropriate function
 	def getAppList(self):
 		try:
@@ -239,7 +253,11 @@ class SAGEGate:
 		if self.connected == False: return 0
 		if not appName: return 0
 
-		return self.appLauncher.startDefaultApp(appName, self.sageHost, self.sagePort+1, shareable, configName, pos, size, optionalArgs)
+		self.launcherLock.acquire()
+		try:
+			return self.appLauncher.startDefaultApp(appName, self.sageHost, self.sagePort+1, shareable, configName, pos, size, optionalArgs)
+		finally:
+			self.launcherLock.release()
 
 		
 
@@ -285,6 +303,10 @@ class SAGEGate:
 		if self.connected == False: return 0
 		#if not appId: return 0
 
+		status = self.sendmsg(self.makeResizeMsg(appId, left, right, bottom, top))
+		return status
+
+	def makeResizeMsg(self,appId,left,right,bottom,top):
 		#make sure all the coordinates are ints
 		left = int(left)
 		right = int(right)
@@ -292,9 +314,7 @@ class SAGEGate:
 		top = int(top)
 
 		data = str(appId) + BLANK + str(left) + BLANK + str(right) + BLANK + str(bottom) + BLANK + str(top)
-		msg = self.makemsg('',1004,'',len(data),data)
-		status = self.sendmsg(msg)
-		return status
+		return self.makemsg('',1004,'',len(data),data)
 
 	###########################################################
 	# Performance Information
@@ -338,11 +358,13 @@ class SAGEGate:
 	def bringToFront(self, appId):
 		if self.connected == False: return 0
 
-		data = str(appId)
-		msg = self.makemsg('',1010,'',len(data),data)
-		status = self.sendmsg(msg)
+		status = self.sendmsg(self.makeBringToFrontMsg(appId))
 		return status
 
+	def makeBringToFrontMsg(self, appId):
+		data = str(appId)
+		return self.makemsg('',1010,'',len(data),data)
+
 
 	####################################	
 	# Change App Properties
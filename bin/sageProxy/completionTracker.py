@@ -0,0 +1,169 @@
+############################################################################
+#
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+# Author: Ratko Jagodic
+#        
+############################################################################
+
+
+
+#
+# Lets a request to SAGE wait for the change it causes instead of sleeping
+# for a fixed time. The caller registers what it expects BEFORE sending the
+# request (so a fast reply can't be missed), sends it and then waits:
+#
+#     pending = tracker.expectLaunch(appName)
+#     ... ask the appLauncher to start it ...
+#     if tracker.wait(pending, timeout): ...pending.appId is the new app...
+#
+# sageUIDataInfo calls appAdded/appRemoved from the SAGEGate thread after it
+# has updated its own state, so whoever wakes up sees the new status.
+#
+# SAGE doesn't tell us which launch request a new window belongs to so a
+# new app is given to the oldest pending launch with the same name. Apps
+# nobody is waiting for (started by someone else) are ignored and a launch
+# that never gets a matching app times out.
+#
+
+from threading import Condition
+from time import time
+
+
+class PendingLaunch:
+    def __init__(self, appName):
+        self.appName = appName.lower()
+        self.appId = None       # filled in when the app shows up
+        self.done = False
+
+
+class PendingClose:
+    def __init__(self, appId):
+        self.appId = appId
+        self.done = False
+        
+
+
+class CompletionTracker:
+
+    def __init__(self):
+        self.__cond = Condition()
+        self.__launches = []    # PendingLaunch, oldest first
+        self.__closes = []      # PendingClose
+
+
+    def expectLaunch(self, appName):
+        """ call before asking for the app to start """
+        p = PendingLaunch(appName)
+        self.__cond.acquire()
+        self.__launches.append(p)
+        self.__cond.release()
+        return p
+
+
+    def expectClose(self, appId):
+        """ call before asking SAGE to close the app """
+        p = PendingClose(appId)
+        self.__cond.acquire()
+        self.__closes.append(p)
+        self.__cond.release()
+        return p
+
+
+    def wait(self, pending, timeout):
+        """ waits until the expected change happens or timeout seconds pass.
+            Returns True if it happened, False if we timed out (the request
+            is forgotten either way)
+        """
+        self.__cond.acquire()
+        try:
+            end = time() + timeout
+            while not pending.done:
+                left = end - time()
+                if left <= 0:
+                    break
+                self.__cond.wait(left)
+            self.__forget(pending)
+            return pending.done
+        finally:
+            self.__cond.release()
+
+
+    def cancel(self, pending):
+        """ for when the request couldn't even be sent """
+        self.__cond.acquire()
+        self.__forget(pending)
+        self.__cond.release()
+
+
+    #-------------------------------------------------------
+    #   called by sageUIDataInfo
+    #-------------------------------------------------------
+
+    def appAdded(self, appId, appName):
+        self.__cond.acquire()
+        try:
+            match = None
+            for p in self.__launches:
+                if p.appName == appName.lower():
+                    match = p
+                    break
+            if match is None:
+                return   # someone else's app, ours will time out if it never shows up
+            match.appId = appId
+            match.done = True
+            self.__launches.remove(match)
+            self.__cond.notifyAll()
+        finally:
+            self.__cond.release()
+
+
+    def appRemoved(self, appId):
+        self.__cond.acquire()
+        try:
+            found = False
+            for p in self.__closes[:]:
+                if p.appId == appId:
+                    p.done = True
+                    self.__closes.remove(p)
+                    found = True
+            if found:
+                self.__cond.notifyAll()
+        finally:
+            self.__cond.release()
+
+
+    def __forget(self, pending):
+        if pending in self.__launches:
+            self.__launches.remove(pending)
+        if pending in self.__closes:
+            self.__closes.remove(pending)
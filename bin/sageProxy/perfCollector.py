@@ -0,0 +1,541 @@
+#!/usr/bin/python
+
+############################################################################
+#
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+# Author: Ratko Jagodic
+#        
+############################################################################
+
+
+#
+# Collects the performance data of all the apps running on SAGE in one
+# place. It asks SAGE for the perf stream (1005) of every app once, keeps
+# the samples in rollups of 1 second, 10 seconds and 1 minute and hands
+# them out to any number of clients:
+#
+#   - XML-RPC queries (getPerfApps, getPerfLatest, getPerfHistory,
+#     getPerfTotals) on port STREAM_PORT-1
+#   - live streams on STREAM_PORT: connect, send one line
+#     "<resolution> [appId appId ...]" (resolution 0 for every sample,
+#     1, 10 or 60 for the rollups, no appIds for all of them) and you get a
+#     line "<time> <appId> <8 values>" per sample/rollup from then on
+#
+# The 8 values are the same as in the 40002 message: display bandwidth,
+# frame rate, packet loss, receivers and then the same for rendering.
+# The site totals are sent as appId TOTALS_ID (bandwidths and receivers
+# summed over the apps, frame rates and loss averaged).
+#
+# It runs on its own (python perfCollector.py -h) or inside sageProxy
+# (sageProxy.py --perf) where it shares the proxy's connection to SAGE.
+# Either way the stream port is the SAGE UI port + 7 so the UIs connected
+# to that SAGE find it (ui/perfStream.py) and take the perf data from the
+# stream instead of each asking SAGE for a stream of every app it shows.
+# performance_server.py -c plots it too. SAGE then sends the perf data of
+# an app once, to the collector, however many UIs are watching.
+#
+
+from SimpleXMLRPCServer import *
+from threading import Thread, RLock
+import socket, sys, string, time, optparse, Queue, SocketServer
+from SAGEGate import *
+
+
+NUM_VALUES = 8
+TOTALS_ID = -10          # the same id the UI logs the site totals under
+SEND_RATE = 2            # what we ask SAGE for (per second)
+STREAM_PORT = 20008      # the xmlrpc port is one less
+MAX_STREAM_BACKLOG = 1000   # lines queued for a slow client before it's dropped
+MAX_ENDED_APPS = 20      # how many closed apps we keep the history for
+
+# (seconds per bucket, number of buckets): 10 minutes, 2 hours and a day
+RESOLUTIONS = ((1, 600), (10, 720), (60, 1440))
+
+
+def WriteLog(message):
+    print message
+
+
+
+class Bucket:
+    """ count, sum, min and max of all the samples in one time slot """
+    
+    def __init__(self, key, values):
+        self.key = key
+        self.count = 1
+        self.sums = list(values)
+        self.mins = list(values)
+        self.maxs = list(values)
+
+
+    def add(self, values):
+        self.count += 1
+        for i in xrange(NUM_VALUES):
+            v = values[i]
+            self.sums[i] += v
+            if v < self.mins[i]: self.mins[i] = v
+            if v > self.maxs[i]: self.maxs[i] = v
+
+
+    def averages(self):
+        return [s/self.count for s in self.sums]
+
+
+    def toList(self, resolution):
+        """ [start time, number of samples, 8 averages, 8 minimums, 8 maximums] """
+        return [float(self.key*resolution), self.count] + self.averages() + self.mins + self.maxs
+    
+
+
+class Rollup:
+    """ a ring of buckets resolution seconds wide, enough for capacity*resolution
+        seconds of history. Adding a sample is O(1) no matter how many
+        samples arrive in a bucket.
+    """
+
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.__ring = [None] * capacity
+        self.__current = None
+
+
+    def add(self, t, values):
+        """ returns the bucket that was just completed (if this sample started a new one) """
+        key = int(t // self.resolution)
+        cur = self.__current
+        if cur and cur.key == key:
+            cur.add(values)
+            return None
+        elif cur and key < cur.key:     # the clock went back, keep it in the current one
+            cur.add(values)
+            return None
+
+        self.__current = self.__ring[key % self.capacity] = Bucket(key, values)
+        return cur
+
+
+    def query(self, since=0):
+        """ the buckets that start at or after since, oldest first """
+        cur = self.__current
+        if not cur:
+            return []
+        first = max(cur.key - self.capacity + 1, int(since // self.resolution))
+        result = []
+        for key in xrange(first, cur.key+1):
+            b = self.__ring[key % self.capacity]
+            if b and b.key == key:
+                result.append(b.toList(self.resolution))
+        return result
+
+
+
+class AppPerf:
+    """ the latest sample and the rollups of one app """
+
+    def __init__(self, appId, name):
+        self.appId = appId
+        self.name = name
+        self.latest = None
+        self.lastTime = 0.0
+        self.ended = False
+        self.rollups = {}
+        for (resolution, capacity) in RESOLUTIONS:
+            self.rollups[resolution] = Rollup(resolution, capacity)
+
+
+    def add(self, t, values):
+        """ returns a list of (resolution, completed bucket) """
+        self.latest = values
+        self.lastTime = t
+        done = []
+        for resolution, rollup in self.rollups.iteritems():
+            b = rollup.add(t, values)
+            if b:
+                done.append((resolution, b))
+        return done
+
+
+
+class PerfCollector:
+
+    def __init__(self, sageGate, sendRate=SEND_RATE):
+        self.sageGate = sageGate
+        self.sendRate = sendRate
+        self.__lock = RLock()
+        self.__apps = {}          # keyed by appId, including TOTALS_ID
+        self.__ended = []         # closed appIds, oldest first
+        self.__streams = []       # StreamClient objects
+        self.__apps[TOTALS_ID] = AppPerf(TOTALS_ID, "SITE_TOTAL")
+        
+        # don't take the callbacks away from someone else using the same gate
+        self.__chainCallback(40001, self.__onAppInfo)
+        self.__chainCallback(40002, self.__onPerfInfo)
+        self.__chainCallback(40003, self.__onAppShutdown)
+
+
+    def __chainCallback(self, code, func):
+        prev = self.sageGate.hashCallbackFunction.get(code)
+        if prev:
+            def both(data):
+                func(data)
+                prev(data)
+            self.sageGate.registerCallbackFunction(code, both)
+        else:
+            self.sageGate.registerCallbackFunction(code, func)
+        
+
+    #-------------------------------------------------------
+    #   MESSAGES FROM SAGE  (called from the SAGEGate thread)
+    #-------------------------------------------------------
+
+    # 40001 appName appId left right bottom top ...
+    def __onAppInfo(self, data):
+        try:
+            tokens = string.split(data)
+            appId = int(tokens[1])
+            self.__lock.acquire()
+            try:
+                if appId in self.__apps and not self.__apps[appId].ended:
+                    return   # just a move/resize
+                self.__apps[appId] = AppPerf(appId, tokens[0])
+                if appId in self.__ended:
+                    self.__ended.remove(appId)
+            finally:
+                self.__lock.release()
+            self.sageGate.startPerformance(appId, self.sendRate)
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
+
+
+    # 40003 appId
+    def __onAppShutdown(self, data):
+        try:
+            appId = int(string.split(data)[0])
+            self.__lock.acquire()
+            try:
+                if appId in self.__apps:
+                    self.__apps[appId].ended = True
+                    self.__ended.append(appId)
+                    while len(self.__ended) > MAX_ENDED_APPS:
+                        del self.__apps[ self.__ended.pop(0) ]
+            finally:
+                self.__lock.release()
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
+
+
+    # 40002 appId \n display values \n render values
+    def __onPerfInfo(self, data):
+        try:
+            lines = string.split(data, '\n')
+            appId = int(lines[0])
+            disp = string.split(lines[1])
+            rend = string.split(lines[2])
+            values = [float(disp[1]), float(disp[2]), float(disp[3]), float(disp[4]),
+                      float(rend[1]), float(rend[2]), float(rend[3]), float(rend[4])]
+        except:
+            WriteLog( "Bad perf message: " + str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
+            return
+        self.addSample(appId, values)
+
+
+    def addSample(self, appId, values, t=None):
+        """ adds one 40002 sample (8 values) and updates the site totals """
+        if t is None:
+            t = time.time()
+        self.__lock.acquire()
+        try:
+            app = self.__apps.get(appId)
+            if not app:   # perf data for an app we didn't see start
+                app = self.__apps[appId] = AppPerf(appId, "")
+            done = app.add(t, values)
+            self.__publish(t, appId, values, done)
+
+            totals = self.__computeTotals()
+            done = self.__apps[TOTALS_ID].add(t, totals)
+            self.__publish(t, TOTALS_ID, totals, done)
+        finally:
+            self.__lock.release()
+
+
+    def __computeTotals(self):
+        totals = [0.0] * NUM_VALUES
+        n = 0
+        for app in self.__apps.itervalues():
+            if app.appId == TOTALS_ID or app.ended or not app.latest:
+                continue
+            n += 1
+            for i in xrange(NUM_VALUES):
+                totals[i] += app.latest[i]
+        if n:
+            for i in (1, 2, 5, 6):   # frame rates and packet loss are averaged
+                totals[i] /= n
+        return totals
+    
+
+    #-------------------------------------------------------
+    #   LIVE STREAMS
+    #-------------------------------------------------------
+
+    def addStream(self, client):
+        self.__lock.acquire()
+        self.__streams.append(client)
+        self.__lock.release()
+
+
+    def removeStream(self, client):
+        self.__lock.acquire()
+        if client in self.__streams:
+            self.__streams.remove(client)
+        self.__lock.release()
+
+
+    def __publish(self, t, appId, values, done):
+        if not self.__streams:
+            return
+        raw = None
+        for client in self.__streams[:]:
+            if not client.wants(appId):
+                continue
+            if client.resolution == 0:
+                if raw is None:
+                    raw = formatLine(t, appId, values)
+                client.send(raw)
+            else:
+                for (resolution, b) in done:
+                    if resolution == client.resolution:
+                        client.send(formatLine(b.key*resolution, appId, b.averages()))
+        
+
+    #-------------------------------------------------------
+    #   QUERIES  (XML-RPC friendly: string keys, lists)
+    #-------------------------------------------------------
+
+    def getPerfApps(self):
+        """ Returns: a hash keyed by appId (string) of [string appName, float lastSampleTime, bool ended]
+        """
+        self.__lock.acquire()
+        try:
+            apps = {}
+            for appId, app in self.__apps.iteritems():
+                apps[str(appId)] = [app.name, app.lastTime, app.ended]
+            return apps
+        finally:
+            self.__lock.release()
+
+
+    def getPerfLatest(self, appId=-1):
+        """ Returns: the latest 8 values of the app or of all the apps
+                     (a hash keyed by appId (string)) if called without appId.
+            Returns: -1 if there's no data for that app
+        """
+        self.__lock.acquire()
+        try:
+            if appId == -1:
+                latest = {}
+                for aid, app in self.__apps.iteritems():
+                    if app.latest:
+                        latest[str(aid)] = app.latest
+                return latest
+            elif appId in self.__apps and self.__apps[appId].latest:
+                return self.__apps[appId].latest
+            return -1
+        finally:
+            self.__lock.release()
+
+
+    def getPerfHistory(self, appId, resolution=1, since=0):
+        """ Returns: a list of rollups of the app that start at or after since (seconds since the epoch),
+                     oldest first, each one being [float startTime, int numSamples,
+                     8 averages, 8 minimums, 8 maximums]. Resolution is 1, 10 or 60 seconds.
+            Returns: -1 if there's no such app or resolution
+        """
+        self.__lock.acquire()
+        try:
+            app = self.__apps.get(appId)
+            if not app or resolution not in app.rollups:
+                return -1
+            return app.rollups[resolution].query(since)
+        finally:
+            self.__lock.release()
+
+
+    def getPerfTotals(self, resolution=1, since=0):
+        """ Returns: same as getPerfHistory but for the totals of the whole site """
+        return self.getPerfHistory(TOTALS_ID, resolution, since)
+
+
+
+def formatLine(t, appId, values):
+    return "%.3f %d %s\n" % (t, appId, " ".join(["%.3f" % v for v in values]))
+
+
+
+#-------------------------------------------------------
+#   STREAM SERVER
+#-------------------------------------------------------
+
+class StreamClient:
+    """ a connected stream client, lines are sent by its own thread so that
+        a slow client never holds up the others (or SAGE)
+    """
+    
+    def __init__(self, sock, resolution, appIds):
+        self.sock = sock
+        self.resolution = resolution
+        self.appIds = appIds      # empty for all
+        self.queue = Queue.Queue(MAX_STREAM_BACKLOG)
+        self.alive = True
+
+    def wants(self, appId):
+        return self.alive and (not self.appIds or appId in self.appIds)
+
+    def send(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except Queue.Full:
+            self.alive = False    # it's not keeping up, let it go
+
+
+    def run(self):
+        try:
+            while self.alive:
+                line = self.queue.get()
+                if line is None:
+                    break
+                self.sock.sendall(line)
+        except socket.error:
+            pass
+        self.alive = False
+        self.sock.close()
+
+
+
+class StreamHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        collector = self.server.collector
+        try:
+            self.request.settimeout(10)
+            f = self.request.makefile("r")
+            tokens = string.split(f.readline())
+            f.close()
+            self.request.settimeout(None)
+            resolution = 0
+            if tokens:
+                resolution = int(tokens[0])
+            if resolution != 0 and resolution not in dict(RESOLUTIONS):
+                return
+            appIds = [int(t) for t in tokens[1:]]
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
+            return
+
+        client = StreamClient(self.request, resolution, appIds)
+        collector.addStream(client)
+        try:
+            client.run()
+        finally:
+            collector.removeStream(client)
+
+
+
+class StreamServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, collector, port=STREAM_PORT):
+        SocketServer.TCPServer.__init__(self, ("", port), StreamHandler)
+        self.collector = collector
+
+
+    def start(self):
+        t = Thread(target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+
+
+# a mix-in class for adding the threading support to the XMLRPC server
+class ThreadedXMLRPCServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    allow_reuse_address = True
+
+
+def registerQueries(server, collector):
+    for name in ("getPerfApps", "getPerfLatest", "getPerfHistory", "getPerfTotals"):
+        server.register_function(getattr(collector, name))
+
+
+
+
+### sets up the parser for the command line options
+def get_commandline_options():
+    parser = optparse.OptionParser()
+
+    h = "which machine is sage running on (default is localhost)"
+    parser.add_option("-s", "--server", dest="server", help=h, default="localhost")
+
+    h = "the port number where sage is accepting ui connections (default is 20001)"
+    parser.add_option("-p", "--port", help=h, type="int", dest="port", default=20001)
+
+    h = "the port for the live streams, xmlrpc queries are on the one below it (default is %d)" % STREAM_PORT
+    parser.add_option("-l", "--listen", help=h, type="int", dest="streamPort", default=STREAM_PORT)
+
+    h = "how many times per second sage should send the perf data of each app (default is %d)" % SEND_RATE
+    parser.add_option("-r", "--rate", help=h, type="int", dest="rate", default=SEND_RATE)
+
+    return parser.parse_args()
+
+
+
+def main():
+    (options, args) = get_commandline_options()
+    
+    sageGate = SAGEGate(WriteLog)
+    collector = PerfCollector(sageGate, options.rate)
+    if sageGate.connectToSage(options.server, options.port) != 1:
+        sys.exit(1)
+    sageGate.registerSage()     # sage then tells us about all the running apps (40001)
+
+    StreamServer(collector, options.streamPort).start()
+    
+    server = ThreadedXMLRPCServer(("", options.streamPort-1), SimpleXMLRPCRequestHandler, False)
+    registerQueries(server, collector)
+    server.register_introspection_functions()
+    server.serve_forever()
+
+
+
+if __name__ == '__main__':
+    main()
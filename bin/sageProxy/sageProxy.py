@@ -39,15 +39,18 @@
 
 
 from SimpleXMLRPCServer import *
-from time import sleep
 import socket, sys, string, os.path, SocketServer, base64, time, optparse
 from sageUIDataInfo import *
 from SAGEGate import *
+from perfCollector import PerfCollector, StreamServer
+from completionTracker import CompletionTracker
 import traceback as tb
 from threading import RLock
 
 XMLRPC_PORT = 20001 #9192
 REDIRECT = True
+COMPLETION_TIMEOUT = 10   # seconds to wait for sage to report an app started/closed
+TIMED_OUT = -2            # returned when it didn't
 
 
 # to output all the error messages to a file
@@ -77,8 +80,11 @@ class ThreadedXMLRPCServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
 
 
 class Proxy:
-    def __init__(self, host=socket.gethostname(), port=20001, passwd=""):
+    def __init__(self, host=socket.gethostname(), port=20001, passwd="", perf=False, timeout=COMPLETION_TIMEOUT):
         self.sageData = sageUIDataInfo()   # a datastructure that stores the display and app state
+        self.tracker = CompletionTracker()   # so that executeApp/closeApp know when sage is done
+        self.sageData.setCompletionTracker(self.tracker)
+        self.timeout = timeout
         
         self.sageGate = SAGEGate(WriteLog)         # communication channel with sage
         self.sageGate.registerCallbackFunction( 40000, self.sageData.setSageStatus )
@@ -87,6 +93,11 @@ class Proxy:
         self.sageGate.registerCallbackFunction( 40004, self.sageData.setSageDisplayInformation )
         self.sageGate.registerCallbackFunction( 40005, self.sageData.setSageZValue )
 
+        # one perf stream per app from sage, shared by everyone asking us
+        self.perfCollector = None
+        if perf:
+            self.perfCollector = PerfCollector(self.sageGate)
+
         # now connect to sage and register with it
         if self.sageGate.connectToSage(host, port) == 0:
             sys.exit(0)
@@ -212,21 +223,7 @@ class Proxy:
             Returns: -1 if failed for whatever reason.
         """
         try:
-            
-            # prevent 0 or negative size
-            if (right-left < 1) or (top-bottom < 1):
-                app = self.sageData.getSAGEApp(appId)
-                ar = app.getWidth() / float(app.getHeight())
-                if ar > 1:
-                    newH = 300 # min app size
-                    newW = newH*ar
-                else:
-                    newW = 300 # min app size
-                    newH = newW/ar
-                
-                right = left+newW
-                top = bottom+newH
-
+            (left, right, bottom, top) = self.__fixSize(appId, left, right, bottom, top)
             if self.sageGate.resizeWindow(appId, left, right, bottom, top) == -1:
                 return -1
             return 1
@@ -235,7 +232,65 @@ class Proxy:
             return -1
 
 
-    def executeApp(self, appName, configName="default", pos=False, size=False, shareable=False, optionalArgs=""):
+    # prevent 0 or negative size
+    def __fixSize(self, appId, left, right, bottom, top):
+        if (right-left < 1) or (top-bottom < 1):
+            app = self.sageData.getSAGEApp(appId)
+            ar = app.getWidth() / float(app.getHeight())
+            if ar > 1:
+                newH = 300 # min app size
+                newW = newH*ar
+            else:
+                newW = 300 # min app size
+                newH = newW/ar
+
+            right = left+newW
+            top = bottom+newH
+        return (left, right, bottom, top)
+
+
+    def setLayout(self, layout):
+        """ Moves, resizes and raises many windows at once. Layout is a list of hashes, one per window:
+                 {"appId", "left", "right", "bottom", "top"}  - new position and size (like resizeWindow)
+                 {"appId", "x", "y"}                          - new position, same size (like moveWindow)
+            Any of them can also have "front": True to bring the window to front (in the order of the list
+            so the last one ends up on top). Just {"appId", "front": True} only brings it to front.
+            All the items are checked first and then sent to SAGE in one go.
+            Returns: a list with a result for every item: 1 if it was sent, -1 if it was invalid
+                     (no such app or bad parameters)
+            Returns: -1 if failed for whatever reason (nothing was sent)
+        """
+        try:
+            results = []
+            msgs = []
+            for item in layout:
+                try:
+                    appId = int(item["appId"])
+                    app = self.sageData.getSAGEApp(appId)
+                    if "left" in item:
+                        (left, right, bottom, top) = self.__fixSize(appId, float(item["left"]), float(item["right"]),
+                                                                    float(item["bottom"]), float(item["top"]))
+                        msgs.append( self.sageGate.makeResizeMsg(appId, left, right, bottom, top) )
+                    elif "x" in item:
+                        x, y = float(item["x"]), float(item["y"])
+                        msgs.append( self.sageGate.makeResizeMsg(appId, x, x+app.getWidth(), y, y+app.getHeight()) )
+                    elif not item.get("front"):
+                        raise ValueError("nothing to do for app %d" % appId)
+                    if item.get("front"):
+                        msgs.append( self.sageGate.makeBringToFrontMsg(appId) )
+                    results.append(1)
+                except (KeyError, ValueError, TypeError, AttributeError):
+                    results.append(-1)
+
+            if msgs and self.sageGate.sendBatch(msgs) == -1:
+                return -1
+            return results
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
+            return -1
+
+
+    def executeApp(self, appName, configName="default", pos=False, size=False, shareable=False, optionalArgs="", timeout=-1):
         """ Starts a new application with appName (string) and configNum (int). You can also optionally specify
             initial position and size of the application window that you pass in as a tuple of integers.
             If the application itself requires some command line arguments during startup, those can be
@@ -243,38 +298,56 @@ class Proxy:
             Shareable parameter is used when you want to run the application through sageBridge which
             means that it can be shared among other displays. If False it will run the app locally.
             Returns: the new status of all the apps in the same format as getAppStatus
-                    (sleeps 2 seconds before returning it to ensure that the datastructure was updated
-                     by the messages from SAGE about the new app)
+                    (as soon as SAGE tells us about the new app)
+            Returns: -2 if SAGE didn't report the new app within timeout seconds
+                    (10 by default or whatever sageProxy was started with)
             Returns: -1 if failed for whatever reason
         """
+        pending = self.tracker.expectLaunch(appName)
         try:
             if self.sageGate.executeApp(appName, configName, pos, size, shareable, optionalArgs) == -1:
+                self.tracker.cancel(pending)
                 return -1
-            sleep(2)        #wait for the message to arrive from sage and then return the status
+            if not self.tracker.wait(pending, self.__getTimeout(timeout)):
+                return TIMED_OUT
             return self.sageData.getAllAppInfo()
         except:
+            self.tracker.cancel(pending)
             WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
             return -1
 
 
-    def closeApp(self, appId):
+    def closeApp(self, appId, timeout=-1):
         """ Closes the app corresponding to the specified appId.
             Returns: the new status of all the apps in the same format as getAppStatus
-                    (sleeps 2 seconds before returning it to ensure that the datastructure was updated
-                     by the messages from SAGE about the closed app)
+                    (as soon as SAGE tells us the app is closed)
+            Returns: -2 if SAGE didn't report the app closed within timeout seconds
+                    (10 by default or whatever sageProxy was started with)
             Returns: -1 if failed for whatever reason
         """
+        pending = None
         try:
             if not self.sageData.appExists(appId):
                 return -1
-            
+
+            pending = self.tracker.expectClose(appId)
             if self.sageGate.shutdownApp(appId) == -1:
+                self.tracker.cancel(pending)
                 return -1
-            sleep(2)        #wait for the message to arrive from sage and then return the status
+            if not self.tracker.wait(pending, self.__getTimeout(timeout)):
+                return TIMED_OUT
             return self.sageData.getAllAppInfo()
         except:
+            if pending:
+                self.tracker.cancel(pending)
             WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
             return -1
+
+
+    def __getTimeout(self, timeout):
+        if timeout is None or timeout < 0:
+            return self.timeout
+        return timeout
         
 
     def shareDesktop(self, sz, displayNum, ip, passwd, shareable=False):
@@ -299,6 +372,55 @@ class Proxy:
             return -1
 
         
+    def getPerfApps(self):
+        """ Returns: a hash keyed by appId (string) of [string appName, float lastSampleTime, bool ended]
+                     for all the apps we have performance data for
+            Returns: -1 if failed for whatever reason (or sageProxy wasn't started with --perf)
+        """
+        try:
+            return self.perfCollector.getPerfApps()
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
+            return -1
+
+
+    def getPerfLatest(self, appId=-1):
+        """ Returns: the latest performance data of the app (list of 8 floats: display bandwidth,
+                     frame rate, packet loss, receivers and the same for rendering) or of all
+                     the apps (a hash keyed by appId (string)) if called without appId
+            Returns: -1 if failed for whatever reason (or sageProxy wasn't started with --perf)
+        """
+        try:
+            return self.perfCollector.getPerfLatest(appId)
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
+            return -1
+
+
+    def getPerfHistory(self, appId, resolution=1, since=0):
+        """ Returns: the performance history of the app averaged over resolution (1, 10 or 60) seconds,
+                     starting at time since (seconds since the epoch). A list of
+                     [float startTime, int numSamples, 8 averages, 8 minimums, 8 maximums], oldest first
+            Returns: -1 if failed for whatever reason (or sageProxy wasn't started with --perf)
+        """
+        try:
+            return self.perfCollector.getPerfHistory(appId, resolution, since)
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
+            return -1
+
+
+    def getPerfTotals(self, resolution=1, since=0):
+        """ Returns: same as getPerfHistory but for the totals of all the apps together
+            Returns: -1 if failed for whatever reason (or sageProxy wasn't started with --perf)
+        """
+        try:
+            return self.perfCollector.getPerfTotals(resolution, since)
+        except:
+            WriteLog( str(sys.exc_info()[0])+" "+str(sys.exc_info()[1]) )
+            return -1
+
+        
     def authenticate(self, passwd):
 	if (self.sessionPassword == passwd):
 	   return 1
@@ -324,6 +446,12 @@ def get_commandline_options():
     h = "specify the password for SAGE Web UI access (default is empty)"
     parser.add_option("-x", "--pass", dest="passwd", help=h, default="")
 
+    h = "how many seconds executeApp and closeApp wait for sage to report the change (default is %d)" % COMPLETION_TIMEOUT
+    parser.add_option("-t", "--timeout", help=h, type="float", dest="timeout", default=COMPLETION_TIMEOUT)
+
+    h = "collect the performance data of all the apps (queries through xmlrpc, live streams on port+7)"
+    parser.add_option("-f", "--perf", action="store_true", help=h, dest="perf", default=False)
+
     return parser.parse_args()
 
 
@@ -337,7 +465,9 @@ def main(argv):
     host = options.server
     passwd = options.passwd
     
-    p = Proxy(host, port, passwd)
+    p = Proxy(host, port, passwd, options.perf, options.timeout)
+    if p.perfCollector:
+        StreamServer(p.perfCollector, port+7).start()
 
     # always use the fsManager ui port + 3 for the xmlrpc port
     global XMLRPC_PORT
@@ -352,5 +482,4 @@ def main(argv):
 
 
 if __name__ == '__main__':
-    import sys, os
     main(['', os.path.basename(sys.argv[0])] + sys.argv[1:])
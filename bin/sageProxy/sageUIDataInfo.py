@@ -58,6 +58,12 @@ class sageUIDataInfo:
         self.hashAppStatusInfo = {}  # apps currently running
         self.displayInfo = sageDisplayInfo()
         self.newAppID = -1
+        self.tracker = None          # told about apps starting and closing (CompletionTracker)
+
+
+    #### for the requests waiting on apps to start or close
+    def setCompletionTracker(self, tracker):
+        self.tracker = tracker
         
     #### Set the sage status
     def setSageStatus(self, appHash) :  
@@ -144,6 +150,8 @@ class sageUIDataInfo:
             self.hashAppStatusInfo[ iAppID ] = SAGEApp( listTokens[0], int(listTokens[1]),
                    int(listTokens[2]), int(listTokens[3]), int(listTokens[4]), int(listTokens[5]),
                    int(listTokens[6]), int(listTokens[7]))
+            if self.tracker:
+                self.tracker.appAdded(iAppID, listTokens[0])
 
 
             
@@ -168,6 +176,9 @@ class sageUIDataInfo:
         if appId in self.hashAppStatusInfo :
             del self.hashAppStatusInfo[appId]
 
+        if self.tracker:
+            self.tracker.appRemoved(appId)
+
 
 ##     ### decrease the z value of all the apps that were below the deleted one
 ##     def updateZsAfterRemove(self, appId):
@@ -224,7 +235,7 @@ class sageUIDataInfo:
 
     def getAllAppInfo(self):
         appStatus = {}  #key = appId, value = list of app params
-        for appId, sageApp in self.hashAppStatusInfo.iteritems():
+        for appId, sageApp in self.hashAppStatusInfo.items():   # a copy, sage messages change it from another thread
             appStatus[str(appId)] = sageApp.getAll()
         return appStatus
     
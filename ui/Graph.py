@@ -50,15 +50,19 @@ from wx.lib import plot
 
 import string
 import random
-import sys
 import time
 import os
+import numpy   # wx.lib.plot needs it anyway
 from globals import *
 from Mywx import *
 
 # This creates a new Event class and a EVT binder function
 (UpdateDataEvent, EVT_UPDATE_GRAPH) = wx.lib.newevent.NewEvent()
 
+# the graphs and sparklines are redrawn this often (in ms) if new data came in,
+# no matter how many apps are sending perf messages
+REDRAW_INTERVAL = 1000
+
 
 
 
@@ -72,7 +76,7 @@ from Mywx import *
 # 
 
 class PerformanceGraph:  
-    def __init__( self, appName, stDataTitle, iArraySize, iPerfUpdateInterval ):  
+    def __init__( self, appName, stDataTitle, iArraySize, iPerfUpdateInterval=2 ):  
 
         # CLASS CONSTANTS
         # self.__fMin, self.__fMax, self.__fAvg, self.__fCurrent
@@ -95,78 +99,59 @@ class PerformanceGraph:
         self.__iPerformanceUpdateInterval = iPerfUpdateInterval
 
 
-        # create panel
-        #self.__wxpGraphPanel = wx.Panel( self.__wxContainer, id=wx.ID_ANY,
-        #                                 pos=(-1,-1), size=(-1,-1) )
-
-        # setup data structure
-        self.__naData = [ [0]*2 for i in range(self.__iArraySize) ]
-
+        # setup data structure: column 0 is time, column 1 the values.
+        # It's allocated once and only the values are overwritten later.
+        self.__naData = numpy.zeros( (self.__iArraySize, 2) )
 
         # (AKS 2004-10-26) Because data is in reverse order (most recent value
         # is index 0), it is necessary to reverse the x values in the array
-        iTimeValue = -(self.__iArraySize-1) * self.__iPerformanceUpdateInterval
-        for index in range( 0, self.__iArraySize ):
-            # print self.__iArraySize - index - 1
-            #RJ self.__naData[ self.__iArraySize - index - 1, 0 ] = iTimeValue
-            self.__naData[ self.__iArraySize - index - 1][ 0 ] = iTimeValue
-            
-            iTimeValue = iTimeValue + self.__iPerformanceUpdateInterval
-            
-            #self.__naData[ index - self.__iArraySize, 0 ] = index
-
+        self.__naData[ :, 0 ] = -numpy.arange( self.__iArraySize ) * self.__iPerformanceUpdateInterval
 
-        # create graph
-        self.__lines = plot.PolyLine(self.__naData, colour='red', width=3)
+        # the values can also be read straight from a PerfHistory (see updateFromHistory)
+        self.__history = None
 
-        self.__graph = plot.PlotGraphics( [self.__lines],"", "Time (s)",
-                                            self.__stDataTitle)
+        # the PolyLine and PlotGraphics are only made when someone draws
+        # the graph and only if the data changed since the last time
+        self.__bStale = True
+        self.__lines = None
+        self.__graph = None
 
 #------------------------------------------------------------------------------        
     
     def update( self, naNewData ):
-        # Because naData is sent as a reference, it is necessary to copy the
-        # data from naNewData to naData to preserve these references
-
-        # (AKS 2005-05-09)
-        self.__fCurrent = float( naNewData[ 0 ] )
-        
-        fSum = 0.0
+        # the values are copied into naData (most recent first)
+        self.__history = None
+        naValues = self.__naData[ :, 1 ]
+        naValues[:] = numpy.asarray( naNewData[ :self.__iArraySize ], dtype=float )
 
-        # (AKS 2005-02-08) Max and min for a range
-        self.__fAvg = 0.0
-        self.__fMax = 0.0
-        self.__fMin = float( sys.maxint )
-      
-        for index in range( 0, self.__iArraySize ):
-            # (AKS 2005-05-09)
-            item = float( naNewData[ index ] )
-
-            #RJ self.__naData[ index, 1 ] = item
-            self.__naData[ index ][ 1 ] = item
-            fSum = fSum + item
+        self.__fCurrent = float( naValues[ 0 ] )
+        self.__fMin = float( naValues.min() )
+        self.__fMax = max( float( naValues.max() ), 0.0 )
+        self.__fAvg = float( naValues.mean() )
+        self.__bStale = True
 
-            # Set maximum value
-            if ( item > self.__fMax ):
-                self.__fMax = item
-
-            # Set minimum value
-            elif ( item < self.__fMin ):
-                self.__fMin = item
-
-        # Calculate average
-        #self.__fAvg = fSum / self.__iArraySize
-
-        # (AKS 2005-05-09)
-        self.__fAvg = float( fSum / self.__iArraySize )
-        
-
-        # (AKS 2005-03-08) Update graph
-        self.__lines = plot.PolyLine(self.__naData, colour='red', width=3)
+#------------------------------------------------------------------------------        
 
-        self.__graph = plot.PlotGraphics( [self.__lines],"", "Time (s)",
-                                          self.__stDataTitle)
+    # same as update but the statistics come from the running aggregates
+    # of the PerfHistory and the values are only copied if the graph is drawn
+    def updateFromHistory( self, history ):
+        self.__history = history
+        self.__fCurrent = history.latest()
+        self.__fMin = history.minimum()
+        self.__fMax = max( history.maximum(), 0.0 )
+        self.__fAvg = history.average()
+        self.__bStale = True
       
+#------------------------------------------------------------------------------
+
+    def __refresh( self ):
+        if self.__bStale:
+            if self.__history is not None:
+                self.__naData[ :, 1 ] = self.__history.recent( self.__iArraySize )
+            self.__lines = plot.PolyLine(self.__naData, colour='red', width=3)
+            self.__graph = plot.PlotGraphics( [self.__lines],"", "Time (s)",
+                                              self.__stDataTitle)
+            self.__bStale = False
 
 #------------------------------------------------------------------------------
 
@@ -179,6 +164,7 @@ class PerformanceGraph:
 #------------------------------------------------------------------------------        
     
     def getGraph( self ):
+        self.__refresh()
         return self.__graph
     
 #------------------------------------------------------------------------------
@@ -194,6 +180,7 @@ class PerformanceGraph:
 #------------------------------------------------------------------------------
 
     def getPolyLine( self ):
+        self.__refresh()
         return self.__lines
 
 
@@ -231,69 +218,23 @@ class MultiPerformanceGraph:
         self.__stDataTitle = stDataTitle
         self.__stLabel = ""
 
-        self.__listLines = []
-        self.__hashPerformanceGraphs = {}
+        self.__hashPerformanceGraphs = dict( hashPerformanceGraphs )
 
-        for windowId in hashPerformanceGraphs:
-            graph = hashPerformanceGraphs[ windowId ]
-            self.__hashPerformanceGraphs[ windowId ] = graph
-            self.__listLines.append( graph.getPolyLine() )
-
-        # create graph
-        self.__graph = plot.PlotGraphics( self.__listLines, "", "Time (s)",
-                                            self.__stDataTitle)
+        # the graph is made from the lines of all the apps when it's drawn
+        self.__graph = None
 
 #------------------------------------------------------------------------------        
     
     def update( self ):
         if ( len( self.__hashPerformanceGraphs ) > 0 ):
-            # Because naData is sent as a reference, it is necessary to copy the
-            # data from naNewData to naData to preserve these references
-
-            # Get current data
-            #print ">>> UPDATE WITH: ", naNewData
-            #print "new data size = ", len( naNewData )
-            #print "plottable data size = ", self.__naData.shape
-            self.__fCurrent = naNewData[ 0 ]
-
-            fSum = 0.0
-
-            # (AKS 2005-02-08) Max and min for a range
-            self.__fAvg = 0.0
-            self.__fMax = 0.0
-            self.__fMin = float( sys.maxint )
-
-            for graph in self.__hashPerformanceGraphs.values():
-                fMin, fMax, fAvg, fCurrent = graph.getStatistics()
-                
-                #print index
-                fSum = fSum + fCurrent
-
-                # Set maximum value
-                if ( fMax > self.__fMax ):
-                    self.__fMax = fMax
-
-                    # Set minimum value
-                elif ( fMin < self.__fMin ):
-                    self.__fMin = fMin
-                    
-            # end loop
-
+            # one row of (min, max, avg, current) per app
+            naStats = numpy.array( [ graph.getStatistics() for graph in
+                                     self.__hashPerformanceGraphs.values() ] )
 
-            # Calculate average
-            self.__fAvg = fSum / self.__iArraySize
-
-
-            # (AKS 2005-03-08) Update graph
-            del self.__lines[ 0:len( self.__lines ) ]
-        
-            for windowId in self.__hashPerformanceGraphs:
-                graph = self.__hashPerformanceGraphs[ windowId ]
-                self.__listLines.append( graph.getPolyLine() )
-
-                self.__graph = plot.PlotGraphics( self.__listLines,"", "Time",
-                                                  self.__stDataTitle)
-        # end
+            self.__fMin = float( naStats[ :, self.I_MINIMUM ].min() )
+            self.__fMax = float( naStats[ :, self.I_MAXIMUM ].max() )
+            self.__fAvg = float( naStats[ :, self.I_AVERAGE ].mean() )
+            self.__fCurrent = float( naStats[ :, self.I_CURRENT ].sum() )
 
         else:
             self.__fAvg = 0.0
@@ -302,17 +243,20 @@ class MultiPerformanceGraph:
             self.__fCurrent = 0.0
 
         # end if
+        self.__graph = None   # the lines are collected again when it's drawn
 
 #------------------------------------------------------------------------------
 
     # (AKS 2005-04-29) Need this function because apps come and go.
     def addPerformanceGraph( self, windowId, pgGraph ):
         self.__hashPerformanceGraphs[ windowId ] = pgGraph
+        self.__graph = None
 
 #------------------------------------------------------------------------------
 
     def removePerformanceGraph( self, windowId ):
         del self.__hashPerformanceGraphs[ windowId ]
+        self.__graph = None
 
 #------------------------------------------------------------------------------
 
@@ -325,12 +269,16 @@ class MultiPerformanceGraph:
 #------------------------------------------------------------------------------        
     
     def getGraph( self ):
+        if self.__graph == None:
+            listLines = [ graph.getPolyLine() for graph in self.__hashPerformanceGraphs.values() ]
+            self.__graph = plot.PlotGraphics( listLines, "", "Time (s)",
+                                              self.__stDataTitle)
         return self.__graph
     
 #------------------------------------------------------------------------------
 
     def getStatistics( self ):
-        return ( self.__fCurrent, self.__fMin, self.__fMax, self.__fAvg )
+        return ( self.__fMin, self.__fMax, self.__fAvg, self.__fCurrent )
 
 #------------------------------------------------------------------------------
 
@@ -823,6 +771,16 @@ class SingleGraph( wx.Frame ):
 
 
     
+###########################################################################
+
+class RedrawTimer( wx.Timer ):
+    def SetCallback( self, cb ):
+        self.callback = cb
+    def Notify( self ):
+        self.callback()
+
+
+
 ###########################################################################
 
 # it encapsulates all the performance data monitoring for all the apps
@@ -853,6 +811,12 @@ class GraphManager:
 
         self.__hashCallback = {}
 
+        # redraw the graphs periodically instead of on every perf message
+        self.__bRedrawNeeded = False
+        self.__redrawTimer = RedrawTimer()
+        self.__redrawTimer.SetCallback( self.__onRedrawTimer )
+        self.__redrawTimer.Start( REDRAW_INTERVAL )
+
         
         self.__list_stGraphTitles = [ "Rendering Bandwidth (Mbps)",
             "Rendering Frame Rate (Frames/Sec)", "Rendering Nodes", "Rendering Streams",
@@ -878,6 +842,8 @@ class GraphManager:
 #------------------------------------------------------------------------------    
 
     # Responds to 40002...remember, all data comes at once
+    # The graphs only take the new statistics here, the drawing is done
+    # by the redraw timer so the cost doesn't grow with the number of apps
     def update( self, windowId ):
         # Send the update message
         if windowId in self.__hashAppGraph:
@@ -885,59 +851,45 @@ class GraphManager:
             # Get graphs from Sparklines
             sgAppSparklines = self.__hashAppGraph[ windowId ]
             list_pgGraphs = sgAppSparklines.getGraphList()
+            render = self.__gmSageAppState.getRenderHistory
+            display = self.__gmSageAppState.getDisplayHistory
 
-            #print "Get render bandwidth..."
-            list_pgGraphs[ sgAppSparklines.I_RENDER_BW ].update(
-                self.__gmSageAppState.getRenderItem( 'bandWidth', windowId, 30 ) )
-
-            list_pgGraphs[ sgAppSparklines.I_RENDER_FPS ].update(
-                self.__gmSageAppState.getRenderItem( 'frameRate', windowId, 30 ) )
+            list_pgGraphs[ sgAppSparklines.I_RENDER_BW ].updateFromHistory( render( 'bandWidth', windowId ) )
+            list_pgGraphs[ sgAppSparklines.I_RENDER_FPS ].updateFromHistory( render( 'frameRate', windowId ) )
+            list_pgGraphs[ sgAppSparklines.I_RENDER_NODES ].updateFromHistory( render( 'nodes', windowId ) )
+            list_pgGraphs[ sgAppSparklines.I_RENDER_STREAMS ].updateFromHistory( render( 'cpu', windowId ) )
 
-            list_pgGraphs[ sgAppSparklines.I_RENDER_NODES ].update(
-                self.__gmSageAppState.getRenderItem( 'nodes', windowId, 30 ) )
+            list_pgGraphs[ sgAppSparklines.I_DISPLAY_BW ].updateFromHistory( display( 'bandWidth', windowId ) )
+            list_pgGraphs[ sgAppSparklines.I_DISPLAY_FPS ].updateFromHistory( display( 'frameRate', windowId ) )
+            list_pgGraphs[ sgAppSparklines.I_DISPLAY_NODES ].updateFromHistory( display( 'nodes', windowId ) )
+            list_pgGraphs[ sgAppSparklines.I_DISPLAY_STREAMS ].updateFromHistory( display( 'cpu', windowId ) )
 
-            list_pgGraphs[ sgAppSparklines.I_RENDER_STREAMS ].update(
-                self.__gmSageAppState.getRenderItem( 'cpu', windowId, 30 ) )
-            
-
-            #print "Get display bandwidth..."        
-            list_pgGraphs[ sgAppSparklines.I_DISPLAY_BW ].update(
-                self.__gmSageAppState.getDisplayItem( 'bandWidth', windowId, 30 ) )
+            self.__hashAppGraphUpdateFlag[ windowId ] = True
 
-            list_pgGraphs[ sgAppSparklines.I_DISPLAY_FPS ].update(
-                self.__gmSageAppState.getDisplayItem( 'frameRate', windowId, 30 ) )
+        # the totals graphs (in the update list as well) change with every message
+        self.__bRedrawNeeded = True
 
-            list_pgGraphs[ sgAppSparklines.I_DISPLAY_NODES ].update(
-                self.__gmSageAppState.getDisplayItem( 'nodes', windowId, 30 ) )
+#------------------------------------------------------------------------------
 
-            list_pgGraphs[ sgAppSparklines.I_DISPLAY_STREAMS ].update(
-                self.__gmSageAppState.getDisplayItem( 'cpu', windowId, 30 ) )
-            
+    # called by the timer, redraws everything if there was new data since the last time
+    def __onRedrawTimer( self ):
+        if not self.__bRedrawNeeded:
+            return
+        self.__bRedrawNeeded = False
 
-            self.__hashAppGraphUpdateFlag[ windowId ] = True
-            
-            
-        
+        # (AKS 2005-05-04) Get the totals Sparkline to calculate totals
+        # from the PerformanceGraphs of the apps first
+        if ( self.__bTotalsLauncherExists == True ):
+            self.__sgTotalsLauncher.updateMultiPerformanceGraphs( self.__iPerformanceMetricCount )
 
         # send an update to all the windows
-        for win in self.__updateList:    
+        for win in self.__updateList[:]:
             try:
                 win.GetSize()
             except Exception:
-                #print "exception occured... deleting the window"
-                del win
+                self.RemoveFromUpdateList(win)   # the window is gone
             else:
                 win.Redraw()  # call redraw on SparklineGraph
-        
-
-        # (AKS 2005-05-04) ALWAYS EXECUTE...Call update function for totals Sparkline;
-        # instances of PerformanceGraphs in MultiPerformanceGRaphs in Sparkline
-        # have already updated since they share the same reference address
-        # (hopefully).  Now, just call a special update that will get the
-        # totals Sparkline to calculate totals based on these updates.
-        
-        if ( self.__bTotalsLauncherExists == True ):
-            self.__sgTotalsLauncher.updateMultiPerformanceGraphs( self.__iPerformanceMetricCount )
 
              
 #------------------------------------------------------------------------------
@@ -1045,6 +997,8 @@ class GraphManager:
 #------------------------------------------------------------------------------
         
     def shutdown( self ):
+        self.__redrawTimer.Stop()
+
         # For each graph, shut down
         keys = self.__hashAppGraph.keys()
         for key in keys:
@@ -44,18 +44,14 @@ from math import ceil
 import string
 import wx
 from Mywx import MyBitmapButton
-from threading import Timer
+from threading import Timer, Lock
 from globals import *
+from sessionFile import SessionWriter, SessionFile, isBinarySession, ACTION, FLAG_PAUSE, ACTION_WORDS
 
 # some global vars
-hashRecordingWords = {}  #RJ 2005-04-07
-hashRecordingWords[1001] = "exec"
-hashRecordingWords[1002] = "kill"
-hashRecordingWords[1003] = "move"
-hashRecordingWords[1004] = "resize"
-hashRecordingWords[1007] = "bg"
-hashRecordingWords[1008] = "depth"
-hashRecordingWords[1100] = "shutdown"
+hashRecordingWords = ACTION_WORDS  # the codes we record and their words in the text sessions
+ID_WAIT = 0.1       # how often we check if SAGE told us the id of an app we started (seconds)
+ID_TIMEOUT = 10.0   # how long an action waits for that before it's dropped
 
 
 
@@ -65,15 +61,17 @@ hashRecordingWords[1100] = "shutdown"
 #
 #  DESCRIPTION: A class for recording user actions to a file in a directory.
 #               To use just create an instance of this class and call
-#               RecordAction(code, data) to write a line to a file. "Code" is
-#               the message code sent to SAGE and it gets mapped to a text string
-#               according to a hash defined here. "Data" is whatever you want to
+#               RecordAction(code, data) to record an action. "Code" is
+#               the message code sent to SAGE and only the codes in
+#               hashRecordingWords are recorded. "Data" is whatever you want to
 #               record in a file and it's code dependent. The last (optional)
 #               parameter to RecordAction is a boolean signifying if you want
 #               to insert a pause after an action. By default pauses are inserted
-#               in the file with the value of the elapsed time since the last
-#               recorded message. When done recording, just call Close() and
-#               destroy the object.
+#               with the value of the elapsed time since the last recorded
+#               message. Sessions are recorded in the binary format of
+#               sessionFile (timestamped and indexed) unless binary=False
+#               which writes the old text lines. When done recording, just
+#               call Close() and destroy the object.
 #
 #  DATE:        April, 2005
 #
@@ -81,12 +79,16 @@ hashRecordingWords[1100] = "shutdown"
 
 class SessionRecorder:
 
-    def __init__(self, filename):
+    def __init__(self, filename, binary=True):
         #recDir = ConvertPath("./sessions/")  # a dir to write session files to
         print "Session recording started. Session will be saved in ", filename
-        self.file = open(filename, "w")
+        if binary:
+            self.writer = SessionWriter(filename)
+        else:
+            self.file = open(filename, "w")
         
         self.prevTime = 0
+        self.sessionTime = 0.0   # where we are on the playback timeline
         
 
 
@@ -97,23 +99,44 @@ class SessionRecorder:
             if self.prevTime == 0:
                     pauseTime = 2
             else:
-                    pauseTime = int( ceil( time.time() - self.prevTime ) )
+                    pauseTime = time.time() - self.prevTime
             self.prevTime = time.time()
 
             # finally, do the writing
-            if insertPause:
-                self.file.write("pause " + str(pauseTime) + "\n")
-            self.file.write( hashRecordingWords[int(code)] +" "+ data+"\n" )
+            if hasattr(self, "writer"):
+                flags = 0
+                if insertPause:
+                    self.sessionTime += pauseTime
+                    flags = FLAG_PAUSE
+                self.writer.write(self.sessionTime, int(code), data, flags)
+            else:
+                if insertPause:
+                    self.file.write("pause " + str(int(ceil(pauseTime))) + "\n")
+                self.file.write( hashRecordingWords[int(code)] +" "+ data+"\n" )
 
 
     def Close(self):
         print "Session recording stopped"
-        self.file.close()
+        if hasattr(self, "writer"):
+            self.writer.close()
+        else:
+            self.file.close()
         
 
         
 
 
+# an app started by the playback of a session
+class PlayedApp:
+
+    def __init__(self, appName, recordedId=None):
+        self.appName = appName
+        self.recordedId = recordedId   # its id in the recording (None until an action uses it)
+        self.displayId = None          # its id on the display (None until SAGE tells us)
+        self.closed = False            # a Seek closed it before SAGE told us its id
+
+
+
 ############################################################################
 #
 #  CLASS: SessionReader
@@ -121,13 +144,25 @@ class SessionRecorder:
 #  DESCRIPTION: A class for reading user actions from a specified file.
 #               To use, create an instance of this class and pass in a
 #               filename to read from. Once created, keep calling ReadAction()
-#               in order to read new lines from a file. It returns data in this
+#               in order to read new actions from a file. It returns data in this
 #               format: (code, data). It is your job to use this data then.
 #               This class also has options to pause, stop, speed up and slow
 #               down the playback of the session file. It does all that by
 #               playing with the length of the pause (speed), repeatedly
 #               returning pause (pausing) or returning a fake EOF (stopping
-#               prematurely).
+#               prematurely). Binary sessions can also be started at any
+#               time with Seek(t) which returns the state of the display
+#               at that time (the old text sessions can only be read
+#               from the start, convert them with sessionFile.py).
+#               After a Seek the next actions close the apps the playback
+#               started so far and bring the display to that state.
+#               The apps get other ids than they had in the recording so
+#               whoever sends the actions to SAGE has to pass on the 40001
+#               of every new app to AppStarted(). The ids in the actions
+#               are changed to the ones SAGE gave to the apps we started
+#               (an action waits a bit for that) and actions for apps we
+#               didn't start are dropped so other users' windows on the
+#               display are never touched.
 #
 #
 #  DATE:        April, 2005
@@ -137,10 +172,21 @@ class SessionRecorder:
 class SessionReader:
 
     def __init__(self, sessionFile):           
-        if os.path.isfile(sessionFile):
-            self.file = open(sessionFile, "r")
-        else:
+        if not os.path.isfile(sessionFile):
             print "ERROR: Sessions file \"", sessionFile, "\" doesn't exist."
+        elif isBinarySession(sessionFile):
+            self.session = SessionFile(sessionFile)
+            self.records = self.session.records()
+            self.pending = None     # the action we returned the pause for
+            self.playTime = 0.0     # time of the last action returned
+            self.apps = []          # PlayedApp for the apps we started and didn't close yet, in exec order
+            self.kills = []         # ids on the display of our apps to close before anything else
+            self.queued = []        # actions (with the recorded ids) to return before the records
+            self.waiting = None     # (code, data, since) of an action waiting for the id of its app
+            self.seekIds = []       # recorded ids of the execs queued by a Seek (None if unknown)
+            self.lock = Lock()      # Seek and AppStarted are called from other threads than ReadAction
+        else:
+            self.file = open(sessionFile, "r")
 
         # control variables
         self.speed = 1.0
@@ -151,9 +197,69 @@ class SessionReader:
     def SetPause(self, doPause):
         self.paused = doPause
 
+
+    def CanSeek(self):
+        return hasattr(self, "session")
+
+
+    def GetDuration(self):
+        if self.CanSeek():
+            return self.session.getDuration()
+        return None
+
+
+    # continues the playback from time t (in seconds from the start of
+    # the session) and returns the SessionState at that time
+    # (its getActions() bring an empty display to that state)
+    def Seek(self, t):
+        if not self.CanSeek():
+            return None
+        self.lock.acquire()
+        try:
+            (state, offset) = self.session.seek(t)
+            self.records = self.session.records(offset)
+            self.pending = None
+            self.playTime = t
+
+            # close everything we showed so far and start the apps of the state again
+            self.waiting = None
+            for app in self.apps:
+                if app.displayId is not None:
+                    self.kills.append(app.displayId)
+                else:
+                    app.closed = True   # closed as soon as SAGE tells us its id
+            self.apps = [app for app in self.apps if app.closed]
+            self.queued = [(code, data) for (code, data) in state.getActions() if code != 1100]
+            self.seekIds = state.getAppIds()
+            return state
+        finally:
+            self.lock.release()
+
+
+    # whoever plays the session calls this for every 40001 of an app
+    # that wasn't on the display before, that's how we learn the ids
+    # SAGE gave to the apps we started
+    def AppStarted(self, appName, appId):
+        if not self.CanSeek():
+            return
+        self.lock.acquire()
+        try:
+            for app in self.apps:
+                if app.displayId == appId:
+                    return
+            for app in self.apps:
+                if app.displayId is None and app.appName == appName:
+                    app.displayId = appId
+                    if app.closed:
+                        self.kills.append(appId)
+                        self.apps.remove(app)
+                    return
+        finally:
+            self.lock.release()
+
         
 
-    # reads the file one line at a time
+    # reads the file one action at a time
     # it returns a tuple in this format: (code, data)
     # code is: -1 (paused), 0 (EOF) or **** (message code)
     # data depends on the message
@@ -168,6 +274,13 @@ class SessionReader:
         # not reading any new lines from the file
         if self.paused:
             return (-1, "0.5") 
+
+        if hasattr(self, "session"):
+            self.lock.acquire()
+            try:
+                return self.__ReadRecord()
+            finally:
+                self.lock.release()
         
         if not hasattr(self, "file"):
             return
@@ -196,6 +309,124 @@ class SessionReader:
         return (code, data)
 
 
+    # the binary version of ReadAction, the pauses are the time
+    # between two actions
+    def __ReadRecord(self):
+        if self.kills:
+            return (1002, self.kills.pop(0))
+
+        if self.waiting:
+            (code, data, since) = self.waiting
+            self.waiting = None
+            return self.__Play(code, data, since)
+
+        if self.queued:
+            (code, data) = self.queued.pop(0)
+            if code == 1001:
+                return self.__Play(code, data, recordedId=self.seekIds.pop(0))
+            return self.__Play(code, data)
+
+        if self.pending:
+            (code, t, data) = self.pending
+            self.pending = None
+            self.playTime = t
+            return self.__Play(code, data)
+
+        for (offset, recordType, flags, code, t, data) in self.records:
+            if recordType != ACTION:
+                continue   # keyframes are only for seeking
+            if not code:   # the whole line of an action we don't know
+                code = -2  # any non-existent code
+                data = (data.split(" ", 1) + [""])[1]
+                
+            if flags & FLAG_PAUSE or t > self.playTime:
+                self.pending = (code, t, data)
+                return (-1, str(max(0, t - self.playTime) * self.speed))
+            self.playTime = t
+            return self.__Play(code, data)
+
+        # the session may go on for a while after the last action
+        if self.session.getDuration() > self.playTime:
+            pause = self.session.getDuration() - self.playTime
+            self.playTime = self.session.getDuration()
+            return (-1, str(pause * self.speed))
+        self.session.close()
+        return (0, "EOF")
+
+
+    # a recorded action as it has to be sent to the display now
+    # (since is when the action started waiting for the id of its app)
+    def __Play(self, code, data, since=None, recordedId=None):
+        if code == 1001:
+            self.apps.append(PlayedApp((data.split() + [""])[0], recordedId))
+            return (code, data)
+        if code not in (1002, 1003, 1004, 1008):
+            return (code, data)
+
+        try:
+            translated = self.__translate(code, data)
+        except (ValueError, IndexError):
+            translated = None
+        if translated is False:   # SAGE hasn't told us the id yet
+            if since is None:
+                since = time.time()
+            if time.time() - since < ID_TIMEOUT:
+                self.waiting = (code, data, since)
+                return (-1, str(ID_WAIT))
+            translated = None
+        if translated is None:
+            return (-2, data)    # not one of our apps, don't touch it
+
+        if code == 1002:
+            self.apps = [app for app in self.apps if app.displayId != translated.strip()]
+        return (code, translated)
+
+
+    # the recorded app ids in the data to the ones on the display,
+    # None if the action is only for apps we didn't start and False if
+    # SAGE didn't tell us the id of one of our apps yet
+    def __translate(self, code, data):
+        tokens = data.split(" ")
+        if code == 1008:   # numChanges appId z appId z... (only the changes of our apps)
+            changes = []
+            for i in range(1, len(tokens)-1, 2):
+                appId = self.__displayId(tokens[i].strip())
+                if appId is False:
+                    return False
+                if appId is not None:
+                    changes.extend([appId, tokens[i+1]])
+            if not changes:
+                return None
+            return " ".join([str(len(changes)/2)] + changes)
+
+        appId = self.__displayId(tokens[0].strip())
+        if not appId:
+            return appId
+        tokens[0] = appId
+        return " ".join(tokens)
+
+
+    # the same rule as in SessionState: the first recorded id we see
+    # that we don't know yet belongs to the oldest exec without one
+    def __displayId(self, recordedId):
+        app = None
+        for a in self.apps:
+            if a.recordedId == recordedId and not a.closed:
+                app = a
+                break
+        else:
+            for a in self.apps:
+                if a.recordedId is None and not a.closed:
+                    a.recordedId = recordedId
+                    app = a
+                    break
+        if app is None:
+            return None
+        if app.displayId is None:
+            return False
+        return app.displayId
+
+
 
     def GoSlower(self):
         self.speed = self.speed * 2
@@ -230,6 +461,8 @@ class SessionReader:
     def Close(self):
         if hasattr(self, "file"):
            self.file.close() 
+        if hasattr(self, "session"):
+           self.session.close() 
         
             
 
@@ -278,6 +511,21 @@ class PlaybackDialog(wx.Dialog):
         self.fasterBtn.Bind( wx.EVT_LEFT_UP, self.OnFaster)
         self.slowerBtn.Bind( wx.EVT_LEFT_UP, self.OnSlower)
         self.Bind( wx.EVT_CLOSE, self.OnClose)
+
+        # binary sessions can be started from anywhere with the slider
+        self.dragging = False
+        self.timer = None
+        if sessionReader.CanSeek():
+            self.SetSize((250, 150))
+            duration = max(1, int(ceil(sessionReader.GetDuration())))
+            self.slider = wx.Slider(self, -1, 0, 0, duration, (15, 90), (220, -1))
+            self.slider.Bind(wx.EVT_SCROLL_THUMBTRACK, self.OnDrag)
+            self.slider.Bind(wx.EVT_SCROLL_THUMBRELEASE, self.OnSeek)
+            self.slider.Bind(wx.EVT_SCROLL_PAGEUP, self.OnSeek)
+            self.slider.Bind(wx.EVT_SCROLL_PAGEDOWN, self.OnSeek)
+            self.timer = wx.Timer(self)
+            self.Bind(wx.EVT_TIMER, self.OnTimer, self.timer)
+            self.timer.Start(500)
         
         self.Show()
 
@@ -310,7 +558,25 @@ class PlaybackDialog(wx.Dialog):
     # sageGate calls this function when EOF has been reached
     def Close(self):
         #self.ReleaseMouse()
+        if self.timer:
+            self.timer.Stop()
         self.Destroy()
+
+
+    def OnDrag(self, evt):
+        self.dragging = True
+
+
+    # continue the playback from where the slider was left
+    def OnSeek(self, evt):
+        self.dragging = False
+        self.sessionReader.Seek(self.slider.GetValue())
+
+
+    # move the slider along with the playback
+    def OnTimer(self, evt):
+        if not self.dragging:
+            self.slider.SetValue(int(self.sessionReader.playTime))
         
 
     # this calls SessionReader and sets the speed of playback (basically it
@@ -62,6 +62,10 @@ import wx.lib.buttons as btns
 DEBUG = False
 if DEBUG: import pdb
 
+APP_SHAPES = (MyRectangleShape, MyControlPoint)   # drawn over the backdrop, everything else is the backdrop
+BACKDROP_CACHE_SIZE = 4    # how many canvas sizes we keep the rendered backdrop for
+DIRTY_MARGIN = 10          # added around a shape when repainting it (for the control points and pen)
+
 
 
 
@@ -237,7 +241,11 @@ class Backdrop:
 #               All the drawing is done in the OnPaint() and Redraw() methods
 #               so that way when you call canvas.Refresh() or canvas.Redraw()
 #               it will use these overloaded methods. Another reason for
-#               overloading these methods is to force them to use double buffering
+#               overloading these methods is to force them to use double buffering.
+#               The tiles, decorative images and the title never change for
+#               a given size so they are rendered once into a backdrop bitmap
+#               and only the app shapes are drawn on top of it. Messages
+#               from SAGE that change a window only repaint its area.
 #
 #  DATE:        October, 2004
 #
@@ -305,6 +313,9 @@ class DisplayCanvas(ogl.ShapeCanvas):
         self.Bind(wx.EVT_MOTION, self.OnMouseEnter)
         self.Bind(wx.EVT_CLOSE, self.OnClose)
         self.cursorSet = False
+        self.swapBuffer = wx.EmptyBitmap(1, 1)   # the real one is made once we know the size
+        self.__backdrops = {}      # key=(width, height), value=rendered backdrop bitmap
+        self.__imagesSize = None   # canvas size the decorative images are scaled for
   
 
 
@@ -334,26 +345,80 @@ class DisplayCanvas(ogl.ShapeCanvas):
 
 
     # overridden so that we can specify the order in which the drawing occurs (because of the decorative images)
-    def Redraw( self, dc=None):
+    # if rect is given only that part of the canvas is repainted
+    def Redraw( self, dc=None, rect=None):
         if DEBUG: print "Redraw --> DisplayCanvas"; sys.stdout.flush()
         if not self.displayInfoArrived:
             return
-        # create the right kind of DC for double buffering
-        if dc == None: 
+        backdrop = self.GetBackdrop()
+
+        if dc == None:
+            # draw into the swap buffer and copy just the changed part to the screen
+            mdc = wx.MemoryDC()
+            mdc.SelectObject(self.swapBuffer)
+            self.__DrawLayers(mdc, backdrop, rect)
+            if rect is None:
+                rect = wx.Rect(0, 0, self.swapBuffer.GetWidth(), self.swapBuffer.GetHeight())
             cdc = wx.ClientDC(self)
             self.PrepareDC(cdc)
-            dc = wx.BufferedDC(cdc, self.swapBuffer)
-            dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
-            dc.Clear()
+            cdc.Blit(rect.x, rect.y, rect.width, rect.height, mdc, rect.x, rect.y)
+            mdc.SelectObject(wx.NullBitmap)
+        else:
+            self.__DrawLayers(dc, backdrop, rect)
+
+
+    # repaints only the part of the canvas inside rect (a wx.Rect)
+    def RedrawRect(self, rect):
+        if rect is not None:
+            self.Redraw(rect=rect)
+
+
+    def __DrawLayers(self, dc, backdrop, rect):
+        if rect is not None:
+            dc.SetClippingRect(rect)
 
-        if self.GetDiagram().GetShapeList():
-            self.SetCursor(wx.HOURGLASS_CURSOR)
+        # the tiles, decorative images and the title
+        dc.DrawBitmap(backdrop, 0, 0, False)
+
+        # the app shapes on top of everything, in z order (only the ones that were touched)
+        for object in self.GetDiagram().GetShapeList():
+            if isinstance(object, APP_SHAPES):
+                if rect is None or rect.Intersects(self.GetShapeRect(object)):
+                    object.Draw(dc)
+
+        if rect is not None:
+            dc.DestroyClippingRegion()
+
+
+    # returns the backdrop for the current size (rendering it if we don't have it yet)
+    def GetBackdrop(self):
+        size = (self.GetCanvasWidth(), self.GetCanvasHeight())
+        if size not in self.__backdrops:
+            if len(self.__backdrops) >= BACKDROP_CACHE_SIZE:
+                self.__backdrops.clear()
+            self.__backdrops[size] = self.__RenderBackdrop(size)
+        return self.__backdrops[size]
+
+
+    # call when something in the backdrop changes (other than the size)
+    def InvalidateBackdrop(self):
+        self.__backdrops.clear()
+
+
+    def __RenderBackdrop(self, (width, height)):
+        if self.__imagesSize != (width, height):
+            self.RecalculateImages()
+        
+        backdrop = wx.EmptyBitmap(width, height)
+        dc = wx.MemoryDC()
+        dc.SelectObject(backdrop)
+        dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+        dc.Clear()
 
         # first draw the underlying shapes (LCD panels)
         for object in self.GetDiagram().GetShapeList():
-            if ((object.__class__.__name__ != MyRectangleShape.__name__ ) and
-               (object.__class__.__name__ != MyControlPoint.__name__ )):
-                   object.Draw(dc)
+            if not isinstance(object, APP_SHAPES):
+                object.Draw(dc)
 
         # then draw the decorative images
         for name, image in self.images.iteritems():
@@ -364,13 +429,15 @@ class DisplayCanvas(ogl.ShapeCanvas):
         textSize = dc.GetTextExtent(self.title)
         dc.DrawText(self.title, self.GetCanvasWidth()/2 - textSize[0]/2, (self.GetBorderWidth() - textSize[1])/2) 
 
-        # finally draw the app shapes on top of everything
-        for object in self.GetDiagram().GetShapeList():
-            if ((object.__class__.__name__ == MyRectangleShape.__name__ ) or
-               (object.__class__.__name__ == MyControlPoint.__name__ )):
-                   object.Draw(dc)
-   
-        self.SetCursor(wx.STANDARD_CURSOR)
+        dc.SelectObject(wx.NullBitmap)
+        return backdrop
+
+
+    # the area of the canvas a shape covers (including its control points)
+    def GetShapeRect(self, shape):
+        w, h = shape.GetBoundingBoxMax()
+        return wx.Rect(int(shape.GetX() - w/2.0) - DIRTY_MARGIN, int(shape.GetY() - h/2.0) - DIRTY_MARGIN,
+                       int(w) + 2*DIRTY_MARGIN + 1, int(h) + 2*DIRTY_MARGIN + 1)
 
 
     #----------------------------------------------------------------------
@@ -391,11 +458,12 @@ class DisplayCanvas(ogl.ShapeCanvas):
         heightFactor = self.tiledDisplayWidth / float (self.GetDisplayWidth() )
         self.SetDisplayHeight( self.GetCanvasHeight() - 1.5*self.GetBorderWidth()) #round (self.tiledDisplayHeight / heightFactor ) )
 
-        # update the size of the swap buffer
-        self.swapBuffer = wx.EmptyBitmap(self.GetCanvasWidth(), self.GetCanvasHeight())
+        # update the size of the swap buffer (if the size really changed)
+        if (self.swapBuffer.GetWidth(), self.swapBuffer.GetHeight()) != (self.GetCanvasWidth(), self.GetCanvasHeight()):
+            self.swapBuffer = wx.EmptyBitmap(self.GetCanvasWidth(), self.GetCanvasHeight())
         
         # reposition and resize all of the following
-        self.RecalculateImages() #decorative images
+        # (the decorative images are rescaled when the backdrop for this size is rendered)
         self.RecalculateTiles()  
         self.RecalculateShapes() 
         
@@ -431,6 +499,7 @@ class DisplayCanvas(ogl.ShapeCanvas):
             image.Rescale( sizes[i][0], sizes[i][1] )
             image.SetX( positions[i][0] )
             image.SetY( positions[i][1] )
+        self.__imagesSize = (self.GetCanvasWidth(), self.GetCanvasHeight())
             
 
     def RecalculateTiles(self):
@@ -517,7 +586,7 @@ class DisplayCanvas(ogl.ShapeCanvas):
     def GetShapeList(self):  # returns a copy of the shape list
         tempList = []
         for s in self.diagram.GetShapeList(): 
-            if ( s.__class__.__name__ == MyRectangleShape.__name__ ):
+            if isinstance(s, MyRectangleShape):
                 tempList.append(s)
         return tempList
 
@@ -833,10 +902,12 @@ class DisplayCanvas(ogl.ShapeCanvas):
         # Here we just check if a shape for this "sageApp" exists and
         # if it does, well, then we dont wanna create a new one but modify the old one
         windowId = sageApp.getId()
+        oldZ = self.__GetZs()
         if not self.shapes.has_key(windowId):  # CREATING A NEW SHAPE
             newShape = self.MyAddShape(sageApp)
             self.parent.GetAppInfoPanel().AddInstanceButton(sageApp)
             self.OrderByZ()  # the shapes may arrive out of order
+            dirty = self.__GetZChangeRect(oldZ, self.GetShapeRect(newShape))
             
             # (AKS 2005-04-05) Only start performance monitoring when a new application
             # is generated.
@@ -845,6 +916,7 @@ class DisplayCanvas(ogl.ShapeCanvas):
             
         else:                          # MODIFYING A SHAPE
             shape = self.shapes[windowId]
+            oldRect = self.GetShapeRect(shape)
             newWidth = self.ToUIWidth( sageApp.getLeft(), sageApp.getRight(), sageApp.getDisplayId() )
             newHeight = self.ToUIHeight( sageApp.getBottom(), sageApp.getTop(), sageApp.getDisplayId() )
             shape.SetSize(newWidth, newHeight)          
@@ -853,9 +925,9 @@ class DisplayCanvas(ogl.ShapeCanvas):
             shape.SetTitle( sageApp.getTitle() )
             shape.SetOrientation( sageApp.getOrientation() )
             shape.ResetControlPoints() 
-            
+            dirty = oldRect.Union(self.GetShapeRect(shape))   # where it was and where it is now
 
-        self.Redraw()
+        self.RedrawRect(dirty)
             
                 
     #----------------------------------------------------------------------
@@ -885,9 +957,12 @@ class DisplayCanvas(ogl.ShapeCanvas):
     # 40003
     def OnSAGEAppShutdownMsg(self, sageApp):
         # turn the button off and close the app
+        dirty = None
+        if sageApp.getId() in self.shapes:
+            dirty = self.GetShapeRect(self.shapes[sageApp.getId()])
         self.MyRemoveShape(sageApp.getId())
         self.parent.GetAppInfoPanel().RemoveInstanceButton(sageApp)
-        self.Redraw()
+        self.RedrawRect(dirty)
 
 
         ## # (AKS 2005-04-05) Stop performance monitoring that began "by default"
@@ -942,6 +1017,7 @@ class DisplayCanvas(ogl.ShapeCanvas):
 
         self.backdrop = Backdrop(self.displayInfo, self)
         self.backdrop.SetupDisplays(l,r,t,b)
+        self.InvalidateBackdrop()
 
 
         # resize the parent to be of the right size for its contents
@@ -996,8 +1072,28 @@ class DisplayCanvas(ogl.ShapeCanvas):
 
     # 40005
     def OnSAGEZChangeMsg(self):
+        oldZ = self.__GetZs()
         self.OrderByZ() # redraw the shapes based on the new order
-        self.Redraw()
+        self.RedrawRect( self.__GetZChangeRect(oldZ) )
+
+
+    # z values of all the shapes keyed by windowId
+    def __GetZs(self):
+        zs = {}
+        for s in self.GetShapeList():
+            zs[s.GetId()] = s.GetZ()
+        return zs
+
+
+    # the area covered by the shapes whose z changed since oldZ (plus rect)
+    def __GetZChangeRect(self, oldZ, rect=None):
+        for s in self.GetShapeList():
+            if s.GetId() in oldZ and oldZ[s.GetId()] != s.GetZ():
+                if rect is None:
+                    rect = self.GetShapeRect(s)
+                else:
+                    rect = rect.Union(self.GetShapeRect(s))
+        return rect
 
         
     #----------------------------------------------------------------------
@@ -42,6 +42,8 @@
 
 from threading import *
 import string, socket, os, os.path, sys, time, SimpleXMLRPCServer, xmlrpclib
+import traceback as tb
+from timerWheel import TimerWheel
 
 
 # some global constants
@@ -57,6 +59,10 @@ SAGE_SERVER_PORT = 15557   # port for the server to listen for SAGE connections
 MAX_USER_CONNECTIONS = 100  # maximum number of simultaneous User connections
 MAX_SAGE_CONNECTIONS = 50  # maximum number of simultaneous SAGE connections
 
+LAUNCHER_TIMEOUT = 10      # appLaunchers that don't report for this long are unregistered (in seconds)
+LAUNCHER_TICK = 1.0        # how often the launchers are checked for expiry (in seconds)
+MAX_LAUNCHER_EVENTS = 1000 # how many launcher events are kept for GetLauncherEvents
+
 PRINT_TO_SCREEN = False  # for debugging
                         #(prints our messages onto the screen as well as the log file)
 
@@ -694,8 +700,6 @@ class SingleLauncher:
         self.ip = ip
         self.launcherId = launcherId
         self.name = name
-        self.oldT = time.time()
-        self.maxReportTime = 10  #allow maximum 8 seconds between reports
 
     def getId(self):
         return self.launcherId
@@ -714,15 +718,6 @@ class SingleLauncher:
 
     def getName(self):
         return self.name
-    
-    def isAlive(self):
-        if (time.time() - self.oldT) < self.maxReportTime:
-            return True
-        else:
-            return False
-
-    def report(self):
-        self.oldT = time.time()
 
 
 
@@ -775,6 +770,15 @@ class Server:
 
     def StartXMLRPCServer(self):
         self.registeredLaunchers = {}  #key=launcherID, value=SingleLauncher object
+        self.registeredLaunchersLock = RLock()  # also locks the wheel and the events
+        self.launcherWheel = TimerWheel(LAUNCHER_TICK)  # when each launcher expires
+        self.launcherEvents = []   # most recent [seq, time, event, launcherId, name]
+        self.launcherEventSeq = 0
+
+        # expire the launchers on our own clock, not only when requests come in
+        expiry = Thread(target=self.ExpireLaunchers)
+        expiry.setDaemon(True)
+        expiry.start()
         
         # start the XML-RPC server
         self.xmlrpc = XMLRPCServer(("", 8009))
@@ -793,12 +797,12 @@ class Server:
         self.xmlrpc.register_function(self.ReportLauncher)
         self.xmlrpc.register_function(self.GetRegisteredLaunchers)
         self.xmlrpc.register_function(self.UnregisterLauncher)
+        self.xmlrpc.register_function(self.GetLauncherEvents)
 
         WriteToFile ("Starting the XML-RPC Server...\n")
         while self.serverRunning:
             try:
                 self.xmlrpc.handle_request()  #accept and process xmlrpc requests
-                self.__checkLaunchers()   #check to see whether every launcher is still alive
             except socket.timeout:
                 continue
             except:
@@ -808,32 +812,51 @@ class Server:
 
 
 
-        ### loops through all the app launchers and checks whether they are still alive
-        ### the minimum frequency of checks is defined by the timeout set int XMLRPCServer constructor
-    def __checkLaunchers(self):
-        for l in self.registeredLaunchers.values():
-            if not l.isAlive():
-                WriteToFile("Launcher "+l.getName()+"("+l.getId()+") unregistered")
-                self.UnregisterLauncher(l.getId())
+        ### runs in a thread and unregisters the app launchers that stopped reporting
+        ### every launcher sits in the timer wheel under its deadline so only the
+        ### expired ones are looked at, however many launchers there are
+    def ExpireLaunchers(self):
+        while self.serverRunning:
+            time.sleep(LAUNCHER_TICK)
+            self.registeredLaunchersLock.acquire()
+            try:
+                for launcherId, deadline in self.launcherWheel.advance():
+                    l = self.registeredLaunchers[launcherId]
+                    del self.registeredLaunchers[launcherId]
+                    WriteToFile("Launcher "+l.getName()+"("+l.getId()+") expired")
+                    self.__addLauncherEvent("expired", l)
+            finally:
+                self.registeredLaunchersLock.release()
                 
             
         ### called by each appLauncher in order to register with the server
     def ReportLauncher(self, launcherName, launcherIP, launcherPort, appList):
         launcherId = launcherIP+":"+str(launcherPort)
-        if launcherId in self.registeredLaunchers:
-            self.registeredLaunchers[launcherId].report()  # launcher already exists so just update its last report time
-            self.registeredLaunchers[launcherId].setAppList(appList)
-        else:
-            l = SingleLauncher(launcherId, launcherName, launcherIP, launcherPort, appList)
-            WriteToFile("Launcher "+l.getName()+"("+l.getId()+") registered")
-            self.registeredLaunchers[launcherId] = l
+        self.registeredLaunchersLock.acquire()
+        try:
+            if launcherId in self.registeredLaunchers:
+                self.registeredLaunchers[launcherId].setAppList(appList)
+            else:
+                l = SingleLauncher(launcherId, launcherName, launcherIP, launcherPort, appList)
+                WriteToFile("Launcher "+l.getName()+"("+l.getId()+") registered")
+                self.registeredLaunchers[launcherId] = l
+                self.__addLauncherEvent("registered", l)
+            self.launcherWheel.schedule(launcherId, LAUNCHER_TIMEOUT)  # (re)starts its timeout
+        finally:
+            self.registeredLaunchersLock.release()
         return launcherId
 
 
         ### removes the appLauncher from a list of registered ones
     def UnregisterLauncher(self, launcherId):
-        if launcherId in self.registeredLaunchers:
-            del self.registeredLaunchers[ launcherId ] 
+        self.registeredLaunchersLock.acquire()
+        try:
+            if launcherId in self.registeredLaunchers:
+                self.__addLauncherEvent("unregistered", self.registeredLaunchers[launcherId])
+                del self.registeredLaunchers[ launcherId ] 
+                self.launcherWheel.cancel(launcherId)
+        finally:
+            self.registeredLaunchersLock.release()
         return 1
     
 
@@ -841,9 +864,32 @@ class Server:
         ### key= "name:launcherId" , value=appList  (that's another hash of appNames and their configs)
     def GetRegisteredLaunchers(self):
         tempHash = {}
-        for l in self.registeredLaunchers.itervalues():
-            tempHash[ l.getName()+":"+l.getId() ] = l.getAppList()
+        self.registeredLaunchersLock.acquire()
+        try:
+            for l in self.registeredLaunchers.itervalues():
+                tempHash[ l.getName()+":"+l.getId() ] = l.getAppList()
+        finally:
+            self.registeredLaunchersLock.release()
         return tempHash
+
+
+        ### for monitoring: returns the launcher events after sinceSeq as a list of
+        ### [seq, time, event, launcherId, name] where event is registered, unregistered or expired
+        ### pass the seq of the last event you got to get only the new ones next time
+    def GetLauncherEvents(self, sinceSeq=0):
+        self.registeredLaunchersLock.acquire()
+        try:
+            events = [e for e in self.launcherEvents if e[0] > sinceSeq]
+        finally:
+            self.registeredLaunchersLock.release()
+        return events
+
+
+    def __addLauncherEvent(self, event, l):
+        self.launcherEventSeq += 1
+        self.launcherEvents.append([self.launcherEventSeq, time.time(), event, l.getId(), l.getName()])
+        if len(self.launcherEvents) > MAX_LAUNCHER_EVENTS:
+            del self.launcherEvents[0]
     
 
 
@@ -1270,7 +1316,7 @@ class XMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCServer):
     allow_reuse_address = True
     def __init__(self, addr):
         SimpleXMLRPCServer.SimpleXMLRPCServer.__init__(self, addr, logRequests=False)
-        self.socket.settimeout(2)  # so that handle_request times out and we can check all appLaunchers
+        self.socket.settimeout(2)  # so that handle_request times out and we can check serverRunning
 
         
 
@@ -0,0 +1,116 @@
+############################################################################
+#
+# SAGE UI Users Server - timer wheel for the appLauncher heartbeats
+#
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+# Author: Ratko Jagodic
+#        
+
+
+#
+# A hashed timer wheel: the time is cut into ticks and every deadline goes
+# into the slot of the tick it falls in (modulo the number of slots).
+# A slot is looked at once its tick is over so a key expires at most one
+# tick after its deadline.
+# Scheduling, renewing and cancelling just move a key between two dicts so
+# they don't depend on how many keys there are. advance() only looks at
+# the slots of the ticks that passed so a key is looked at once when its
+# deadline comes (or once per turn of the wheel if the deadline is more
+# than a whole turn away), not on every check.
+#
+# The wheel itself is not thread safe, the caller locks.
+#
+
+import time
+
+
+class TimerWheel:
+    def __init__(self, tick=1.0, slots=64, now=None):
+        self.tick = tick
+        self.slots = [{} for i in range(slots)]
+        self.deadlines = {}     # key=whatever was scheduled, value=(deadline, slot)
+        if now is None: now = time.time()
+        self.lastTick = self.__tickOf(now) - 1   # the last tick that's over and was looked at
+
+
+    def schedule(self, key, timeout, now=None):
+        """ (re)schedules key to expire timeout seconds from now """
+        if now is None: now = time.time()
+        self.cancel(key)
+        deadline = now + timeout
+        
+        # never put it in a slot that was already looked at this turn
+        slot = max(self.__tickOf(deadline), self.lastTick+1) % len(self.slots)
+        self.slots[slot][key] = True
+        self.deadlines[key] = (deadline, slot)
+
+
+    def cancel(self, key):
+        if key in self.deadlines:
+            del self.slots[ self.deadlines[key][1] ][key]
+            del self.deadlines[key]
+
+
+    def getDeadline(self, key):
+        return self.deadlines[key][0]
+
+
+    def advance(self, now=None):
+        """ goes through the ticks that are over and returns a list of
+            (key, deadline) that expired, oldest deadline first
+        """
+        if now is None: now = time.time()
+        doneTick = self.__tickOf(now) - 1
+        numTicks = min(doneTick - self.lastTick, len(self.slots))  # after a long pause once around is enough
+        
+        expired = []
+        for t in range(doneTick - numTicks + 1, doneTick + 1):
+            slot = self.slots[t % len(self.slots)]
+            for key in slot.keys():
+                deadline = self.deadlines[key][0]
+                if deadline <= now:
+                    expired.append((deadline, key))
+                    del slot[key]
+                    del self.deadlines[key]
+        self.lastTick = max(self.lastTick, doneTick)
+        
+        expired.sort()
+        return [(key, when) for (when, key) in expired]
+
+
+    def __len__(self):
+        return len(self.deadlines)
+
+
+    def __tickOf(self, t):
+        return int(t / self.tick)
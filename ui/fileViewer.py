@@ -37,7 +37,7 @@
 ############################################################################
 
 
-import xmlrpclib, base64, sys, cStringIO, socket, pickle, copy, os.path, os
+import xmlrpclib, base64, sys, cStringIO, socket, pickle, copy, os.path, os, hashlib
 from httplib import HTTPException
 import wx.lib.scrolledpanel
 from wx import ProgressDialog
@@ -53,7 +53,11 @@ import urllib
 XMLRPC_PORT = "8800"
 FILE_GRABBER_PORT = "8801"
 FILE_SERVER_BIN_PORT = 8802
+FILE_SERVER_TRANSFER_PORT = 8803
+UPLOAD_CHUNK_SIZE = 1048576   # files are sent in chunks of this size
 PREVIEW_SIZE = (150,150)
+PREVIEW_PENDING = "pending"   # returned by the server while the thumbnail is being made
+PREVIEW_POLL_INTERVAL = 500   # how often to ask for a pending preview (in ms)
 DEFAULT_TIMEOUT = None  # no timeout because server side processing might take a while
 
 # used so that we don't create two connections to the same server... no reason
@@ -209,6 +213,7 @@ class FileServer:
 
 
     def __SendFile(self, fullPath):
+        doDlg = False
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             s.connect((self.host, FILE_SERVER_BIN_PORT))
@@ -230,12 +235,15 @@ class FileServer:
                                         wx.PD_ELAPSED_TIME | wx.PD_REMAINING_TIME | wx.PD_AUTO_HIDE)
                 doDlg = True
                 
-            # send the file data
+            # send the file data (the server reads exactly fileSize bytes)
             f=open(fullPath, "rb")
             t = 0
-            for line in f:
-                s.sendall(line)
-                t += len(line)
+            while t < fileSize:
+                chunk = f.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                s.sendall(chunk)
+                t += len(chunk)
 
                 # update the dialog if needed
                 if doDlg and not dlg.Update(ceil((float(t)/fileSize)*100), "Uploading... (%.2f/%.2f MB)"%
@@ -247,9 +255,9 @@ class FileServer:
 
             if doDlg:  dlg.Destroy()
                 
-            s.sendall("\n")  # because the other side is reading lines
             f.close()
-            s.recv(1)
+            if s.recv(1) != "1":
+                raise socket.error("upload was not confirmed by the server")
         except:
             print "Error sending file to File Server: ", sys.exc_info()[0], sys.exc_info()[1]
             if doDlg:  dlg.Destroy()
@@ -261,7 +269,95 @@ class FileServer:
         #return self.server.UploadFile( convertedFilename, data, PREVIEW_SIZE )
 
 
+        # retrieves the preview through the streaming transfer channel
+        # returns (data, isBinary) just like the old GetPreview call did
+        # or PREVIEW_PENDING if the server is still making the thumbnail
+    def GetPreview(self, fullRemotePath, previewSize):
+        try:
+            res = self.server.OpenPreview(fullRemotePath)
+        except xmlrpclib.Fault:   # older FileServer without the transfer channel
+            preview = self.server.GetPreview(fullRemotePath, previewSize)
+            if preview:
+                preview = (base64.decodestring(preview[0]), preview[1])
+            return preview
+
+        if not res or res == PREVIEW_PENDING:
+            return res
+        (handle, size, checksum) = res
+        data = self.__ReadTransfer(handle, long(size))
+        if hashlib.md5(data).hexdigest() != checksum:
+            return False
+        return (data, True)
+
+
+    def __ReadTransfer(self, handle, size):
+        s = socket.create_connection((self.host, FILE_SERVER_TRANSFER_PORT))
+        try:
+            s.sendall("GET %s 0\n" % handle)
+            chunks = []
+            left = size
+            while left > 0:
+                data = s.recv(min(left, 65536))
+                if not data:
+                    break
+                chunks.append(data)
+                left -= len(data)
+            return "".join(chunks)
+        finally:
+            s.close()
+
+
     
+### files shown from the cache of the FileServer on the SAGE machine stay
+### pinned there while the app showing them runs so they don't get evicted
+class CachePins:
+    def __init__(self, sageData, sageHost):
+        self.sageHost = sageHost
+        self.__pins = {}    # key=appId (from the appLauncher), value=list of pinned paths
+        self.__lock = Lock()
+        sageData.addAppCloseListener(self.OnAppClosed)
+
+
+    def Pin(self, fullPath, appId):
+        if appId == -1 or not appId:
+            return   # the app never started
+        try:
+            if not self.__server().PinCachedFile(fullPath):
+                return   # not a cached file (it's in the library itself)
+        except:
+            print " Unable to pin the cached file: ", sys.exc_info()[0], sys.exc_info()[1]
+            return
+        self.__lock.acquire()
+        try:
+            self.__pins.setdefault(appId, []).append(fullPath)
+        finally:
+            self.__lock.release()
+
+
+    def OnAppClosed(self, sageApp):
+        self.__lock.acquire()
+        try:
+            paths = self.__pins.pop(sageApp.getAppId(), [])
+        finally:
+            self.__lock.release()
+        if paths:   # called from the thread receiving the SAGE messages so don't block it
+            Thread(target=self.__Unpin, args=(paths,)).start()
+
+
+    def __Unpin(self, paths):
+        try:
+            server = self.__server()
+            for fullPath in paths:
+                server.UnpinCachedFile(fullPath)
+        except:
+            print " Unable to unpin the cached files: ", sys.exc_info()[0], sys.exc_info()[1]
+
+
+    def __server(self):
+        return xmlrpclib.ServerProxy("http://"+str(self.sageHost)+":"+XMLRPC_PORT, transport=MyTransport())
+
+
+
 ### the base class for accepting the dropped files
 class FileDropTarget(wx.PyDropTarget):
     def __init__(self, host=None, port=None):
@@ -354,6 +450,7 @@ class CanvasDropTarget(FileDropTarget):
         self.sageHost = self.sageGate.sageHost  #for the filegrabber
         self.lastX = 0
         self.lastY = 0
+        self.canvas.cachePins = CachePins(self.canvas.sageData, self.sageHost)
         
         FileDropTarget.__init__(self) # dont provide library location right away since we will let the user choose that each time
 
@@ -436,6 +533,8 @@ class CanvasDropTarget(FileDropTarget):
         else:  #for other types
             res = self.sageGate.executeApp(appName, optionalArgs=fullRemotePath+" "+params)
 
+        if doPrep:
+            self.canvas.cachePins.Pin(fullPath, res)
         if res == -1:
             Message("Application not started. Either application failed, the application launcher is not running or the application  <<"+appName+">>  is not configured in application launcher.", "Application Launch Failed")
         
@@ -1046,21 +1145,25 @@ class FileLibrary(wx.Frame):
             # get the preview from the server (and get other info like the size of the image)
             self.currentImage.SetBitmap(self.retrieving_preview)
             try:
-                preview = self.server.GetPreview(itemData.GetFullPath(), self.previewSize)
+                preview = self.serverObj.GetPreview(itemData.GetFullPath(), self.previewSize)
             except:
                 self.currentImage.SetBitmap(self.no_preview)
                 return
             if not preview:  #preview retrieval failed for some reason
                 self.currentImage.SetBitmap(self.no_preview)
+            elif preview == PREVIEW_PENDING:  # ask again in a bit if this item is still selected
+                if self.tree.GetSelection() == itemId:
+                    self._timer = PreviewTimer(GetPreview, itemId)
+                    self._timer.Start(PREVIEW_POLL_INTERVAL, True)
             else:
                 (previewData, isBinary) = preview
                 if isBinary:
-                    stream=wx.InputStream(cStringIO.StringIO(base64.decodestring(previewData))) #make a stream out of the image
+                    stream=wx.InputStream(cStringIO.StringIO(previewData)) #make a stream out of the image
                     im = wx.ImageFromStream(stream)
                     im.Rescale(PREVIEW_SIZE[0], PREVIEW_SIZE[1])
                 else:
                     im = wx.EmptyImage(PREVIEW_SIZE[0], PREVIEW_SIZE[1])
-                    im.SetData(base64.decodestring(previewData))
+                    im.SetData(previewData)
 
                 if im.Ok():
                     self.currentImage.SetBitmap(im.ConvertToBitmap())
@@ -1125,6 +1228,7 @@ class FileLibrary(wx.Frame):
         else:  #for other types
             res = self.sageGate.executeApp(appName, optionalArgs=fullPath+" "+params, useBridge=bridge)
 
+        self.canvas.cachePins.Pin(fullPath, res)
         if res == -1:
             Message("Application not started. Either application failed, the application launcher is not running or the application  <<"+appName+">>  is not configured in application launcher.", "Application Launch Failed")
             
@@ -0,0 +1,373 @@
+############################################################################
+#
+# SAGE UI - A Graphical User Interface for SAGE
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+# Author: Ratko Jagodic
+#
+############################################################################
+
+
+
+#
+# Polls the sage server for the registered appLaunchers and all those
+# launchers for their running apps in a background thread so that a dead
+# or slow launcher never freezes the admin window.
+#
+# All the launchers are asked at the same time (a thread each) and every
+# call has a deadline so one round never takes much longer than
+# CALL_DEADLINE no matter how many launchers are hung. What every launcher
+# said last is kept in a LauncherStatus together with when it said it, and
+# after each round the listener gets a PollResult with only what changed.
+#
+# The listener (and the onDone of call()) is called through deliver which
+# should be wx.CallAfter for the wx windows.
+#
+# The same file is in ui/ and in bin/appLauncher/ (the UI and the appLauncher
+# are installed and run separately) so any change has to go into both copies.
+# Running it directly polls a bunch of local stub launchers, some of them hung.
+#
+
+import xmlrpclib, httplib, socket, sys
+from threading import Thread, Event, Lock
+from time import time, sleep
+
+
+POLL_INTERVAL = 5.0     # seconds between rounds
+CALL_DEADLINE = 2.0     # seconds we wait for any one launcher (or the sage server)
+
+
+
+class TimeoutTransport(xmlrpclib.Transport):
+    """ so that every call has its own timeout instead of the global socket one """
+
+    def __init__(self, timeout):
+        xmlrpclib.Transport.__init__(self)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = xmlrpclib.Transport.make_connection(self, host)
+        conn.timeout = self.timeout
+        return conn
+
+
+def makeServerProxy(ip, port, timeout=CALL_DEADLINE):
+    return xmlrpclib.ServerProxy("http://" + str(ip) + ":" + str(port), transport=TimeoutTransport(timeout))
+
+
+def describeError():
+    e = sys.exc_info()[1]
+    if isinstance(e, socket.timeout):
+        return "no answer"
+    elif isinstance(e, (socket.error, httplib.HTTPException)):
+        return "no connection"
+    return str(sys.exc_info()[0]) + " " + str(e)
+
+
+
+class LauncherStatus:
+    """ what we last heard from one appLauncher """
+    
+    def __init__(self, launcherId, name, appList):
+        self.launcherId = launcherId     # ip:port
+        self.name = name
+        (self.ip, self.port) = launcherId.split(":", 1)
+        self.appList = appList
+        self.apps = {}            # key=appId (string), value=(appName, command, machine)
+        self.lastUpdate = None    # when we last got the apps
+        self.error = None         # why the last poll failed (None if it didn't)
+        self.busy = False         # a poll is still waiting for an answer
+
+    def getId(self):
+        return self.launcherId
+
+    def getName(self):
+        return self.name
+
+    def getIP(self):
+        return self.ip
+
+    def getPort(self):
+        return self.port
+
+    def getAppList(self):
+        return self.appList
+
+    def getApps(self):
+        return self.apps
+
+    def getAge(self):
+        """ seconds since we last heard from it (None if never) """
+        if self.lastUpdate is None:
+            return None
+        return time() - self.lastUpdate
+
+    def isResponding(self):
+        return self.lastUpdate is not None and self.error is None
+    
+
+
+class PollResult:
+    """ what changed in one round """
+    
+    def __init__(self):
+        self.added = []       # LauncherStatus of the new launchers
+        self.removed = []     # launcherIds that are no longer registered
+        self.changed = []     # LauncherStatus whose apps changed
+        self.failed = []      # LauncherStatus that just stopped answering
+        self.recovered = []   # LauncherStatus that answered again
+        self.serverError = None
+
+    def isEmpty(self):
+        return not (self.added or self.removed or self.changed or self.failed or
+                    self.recovered or self.serverError)
+    
+
+
+class LauncherPoller(Thread):
+
+    def __init__(self, serverIP, serverPort, onUpdate, deliver=None,
+                 interval=POLL_INTERVAL, deadline=CALL_DEADLINE):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.serverIP = serverIP
+        self.serverPort = serverPort
+        self.onUpdate = onUpdate
+        self.deliver = deliver or (lambda func, *args: func(*args))
+        self.interval = interval
+        self.deadline = deadline
+        self.launchers = {}       # key=launcherId, value=LauncherStatus
+        self.__serverError = None
+        self.__wakeUp = Event()
+        self.__doRun = True
+        self.__roundLock = Lock()
+
+
+    def getLaunchers(self):
+        return self.launchers.values()
+
+    def getLauncher(self, launcherId):
+        return self.launchers.get(launcherId)
+
+
+    def refresh(self):
+        """ poll right away (without waiting for the interval) """
+        self.__wakeUp.set()
+
+
+    def stop(self):
+        self.__doRun = False
+        self.__wakeUp.set()
+
+
+    def run(self):
+        while self.__doRun:
+            self.pollOnce()
+            self.__wakeUp.wait(self.interval)
+            self.__wakeUp.clear()
+
+
+    def call(self, launcherId, method, args=(), onDone=None):
+        """ calls the method of the launcher in another thread and then
+            onDone(result, error) through deliver (error is None if it worked)
+        """
+        def doCall():
+            result, error = None, None
+            try:
+                status = self.launchers[launcherId]
+                result = getattr(makeServerProxy(status.ip, status.port, self.deadline), method)(*args)
+            except:
+                error = describeError()
+            if onDone:
+                self.deliver(onDone, result, error)
+            self.refresh()   # the call probably changed something
+        t = Thread(target=doCall)
+        t.setDaemon(True)
+        t.start()
+
+
+    #-------------------------------------------------------
+
+    def pollOnce(self):
+        """ one round: the launcher list and then all the launchers at once """
+        self.__roundLock.acquire()
+        try:
+            result = PollResult()
+            self.__updateLauncherList(result)
+
+            # ask them all at the same time
+            answers = {}
+            threads = []
+            for status in self.launchers.values():
+                if status.busy:   # still hung from the last round
+                    continue
+                status.busy = True
+                t = Thread(target=self.__queryLauncher, args=(status, answers))
+                t.setDaemon(True)
+                t.start()
+                threads.append(t)
+                
+            end = time() + self.deadline
+            for t in threads:
+                t.join(max(0, end - time()))
+
+            # whoever didn't answer by now keeps the old status
+            now = time()
+            for launcherId, status in self.launchers.iteritems():
+                apps, error = answers.get(launcherId, (None, "no answer"))
+                if error is None:
+                    if not status.isResponding() and status.lastUpdate is not None:
+                        result.recovered.append(status)
+                    if apps != status.apps:
+                        status.apps = apps
+                        result.changed.append(status)
+                    status.lastUpdate = now
+                    status.error = None
+                else:
+                    if status.error is None:
+                        result.failed.append(status)
+                    status.error = error
+
+            if not result.isEmpty():
+                self.deliver(self.onUpdate, result)
+            return result
+        finally:
+            self.__roundLock.release()
+
+
+    def __updateLauncherList(self, result):
+        try:
+            # a hash comes back (key=name:ip:port, value=appList - that's another hash of appNames and configs)
+            registered = makeServerProxy(self.serverIP, self.serverPort, self.deadline).GetRegisteredLaunchers()
+        except:
+            error = describeError()
+            if error != self.__serverError:
+                result.serverError = error
+            self.__serverError = error
+            return    # keep polling the launchers we know about
+        self.__serverError = None
+
+        current = {}
+        for launcherString, appList in registered.iteritems():
+            (name, launcherId) = launcherString.split(":", 1)
+            current[launcherId] = (name, appList)
+
+        for launcherId in self.launchers.keys():
+            if launcherId not in current:
+                del self.launchers[launcherId]
+                result.removed.append(launcherId)
+
+        for launcherId, (name, appList) in current.iteritems():
+            if launcherId in self.launchers:
+                self.launchers[launcherId].appList = appList
+            else:
+                status = LauncherStatus(launcherId, name, appList)
+                self.launchers[launcherId] = status
+                result.added.append(status)
+
+
+    def __queryLauncher(self, status, answers):
+        try:
+            try:
+                apps = makeServerProxy(status.ip, status.port, self.deadline).appStatus()
+                answers[status.launcherId] = (apps, None)
+            except:
+                answers[status.launcherId] = (None, describeError())
+        finally:
+            status.busy = False
+
+
+#-------------------------------------------------------
+#   stubs for checking the poller without real launchers
+#-------------------------------------------------------
+
+def _stubServer(functions):
+    """ a single threaded XML-RPC server on a free local port, returns the port """
+    from SimpleXMLRPCServer import SimpleXMLRPCServer
+    server = SimpleXMLRPCServer(("127.0.0.1", 0), logRequests=False)
+    for name, func in functions.iteritems():
+        server.register_function(func, name)
+    t = Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    return server.server_address[1]
+
+
+def _stubLauncher(num, hung):
+    """ a hung launcher never answers (and blocks everyone queued behind) """
+    def appStatus():
+        if hung:
+            sleep(3600)
+        return {str(num): ("app%d" % num, "command", "machine%d" % num)}
+    return _stubServer({"appStatus": appStatus})
+
+
+def main(argv):
+    numLaunchers = 200
+    numHung = 20
+    if len(argv) > 1: numLaunchers = int(argv[1])
+    if len(argv) > 2: numHung = int(argv[2])
+    deadline = 1.0
+
+    registered = {}
+    for i in range(numLaunchers):
+        port = _stubLauncher(i, i < numHung)
+        registered["launcher%d:127.0.0.1:%d" % (i, port)] = {}
+    serverPort = _stubServer({"GetRegisteredLaunchers": lambda: registered})
+
+    results = []
+    poller = LauncherPoller("127.0.0.1", serverPort, results.append, deadline=deadline)
+    ok = True
+    for round in range(3):
+        t = time()
+        result = poller.pollOnce()
+        took = time() - t
+        responding = len([s for s in poller.getLaunchers() if s.isResponding()])
+        print "round %d: %.2fs, %d launchers, %d responding, %d added, %d changed, %d failed" % \
+              (round, took, len(poller.getLaunchers()), responding,
+               len(result.added), len(result.changed), len(result.failed))
+        if took > 2*deadline + 0.5 or responding != numLaunchers - numHung:
+            ok = False
+
+    noAnswer = len([s for s in poller.getLaunchers() if s.error == "no answer"])
+    print "%d launchers didn't answer in time" % noAnswer
+    ok = ok and noAnswer == numHung
+    print ok and "PASSED" or "FAILED"
+    return ok
+
+
+
+if __name__ == '__main__':
+    import os
+    ok = main(sys.argv)
+    sys.stdout.flush()
+    os._exit(not ok)   # the hung stubs would never let the threads finish
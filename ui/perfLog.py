@@ -0,0 +1,322 @@
+############################################################################
+#
+# SAGE UI - A Graphical User Interface for SAGE
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+# Author: Ratko Jagodic
+#        
+############################################################################
+
+
+#
+# Binary performance log. The perf messages are handed to a background
+# thread that writes them out in blocks about once a second instead of
+# formatting and flushing a line per message on the UI thread.
+#
+# A log file starts with a 16 byte header (MAGIC, version, 0) followed by
+# blocks. Every block starts with its type (1 byte), 3 bytes of padding
+# and a 4 byte count/length (all little endian):
+#
+#   PERF_BLOCK:  count records stored column by column: count timestamps
+#                (float64, seconds since the epoch), count window ids (int32)
+#                and then count values (float32) for each of the COLUMNS.
+#   NAMES_BLOCK: length bytes of "windowId<TAB>name<NEWLINE>" lines that
+#                tell which app (or site totals) a window id was.
+#
+# When a file gets bigger than maxBytes the writer moves on to the next
+# part (-001, -002...) and repeats the names there so every part can be
+# read on its own. A block cut short by a crash is ignored by the reader.
+#
+# Run this file to export logs: python perfLog.py [-o out.npz] logs...
+# (CSV goes to stdout, the .npz needs numpy)
+#
+
+import sys, os, struct, array, threading, Queue
+from time import time
+from optparse import OptionParser
+
+
+MAGIC = "SAGEPERF"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sII")
+BLOCK_HEADER = struct.Struct("<B3xI")
+PERF_BLOCK = 1
+NAMES_BLOCK = 2
+EXTENSION = ".sperf"
+
+# the values logged for every perf message (in this order)
+COLUMNS = ("dispBW", "dispFPS", "dispLoss", "dispReceivers",
+           "rendBW", "rendFPS", "rendLoss", "rendReceivers")
+
+FLUSH_INTERVAL = 1.0              # seconds between writes
+MAX_LOG_SIZE = 64 * 1024 * 1024   # bytes per file before moving on to the next part
+
+_STOP = "stop"   # put in the queue to stop the writer
+
+
+
+def _toLittleEndian(a):
+    if sys.byteorder == "big":
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+
+def _fromLittleEndian(typecode, data):
+    a = array.array(typecode)
+    a.fromstring(data)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+
+
+class PerfLogWriter(threading.Thread):
+    """ appends the records to basePath-NNN.sperf from its own thread.
+        log() and setName() only put the data in a queue.
+    """
+
+    def __init__(self, basePath, maxBytes=MAX_LOG_SIZE):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.basePath = basePath
+        self.maxBytes = maxBytes
+        self.__queue = Queue.Queue()
+        self.__names = {}     # windowId --> name (repeated in every part)
+        self.__part = -1
+        self.__file = None
+        self.__failed = False
+        self.start()
+
+
+    def log(self, windowId, values, timestamp=None):
+        """ values are the COLUMNS (missing ones are logged as 0) """
+        if timestamp is None:
+            timestamp = time()
+        self.__queue.put((timestamp, windowId, values))
+
+
+    def setName(self, windowId, name):
+        self.__queue.put((None, windowId, name))
+
+
+    def close(self):
+        """ writes whatever is still queued and closes the file """
+        self.__queue.put(_STOP)
+        self.join(FLUSH_INTERVAL + 5)
+
+
+    def getPath(self):
+        return "%s-%03d%s" % (self.basePath, max(self.__part, 0), EXTENSION)
+
+
+    #-------------------------------------------------------
+
+    def run(self):
+        stop = False
+        while not stop:
+            items = [self.__queue.get()]
+            deadline = time() + FLUSH_INTERVAL
+            while items[-1] is not _STOP:
+                left = deadline - time()
+                if left <= 0:
+                    break
+                try:
+                    items.append(self.__queue.get(True, left))
+                except Queue.Empty:
+                    break
+            if items[-1] is _STOP:
+                stop = True
+                items.pop()
+
+            try:
+                self.__write(items)
+            except:
+                if not self.__failed:   # e.g. no permission to write, say it only once
+                    print "Performance logging to", self.getPath(), "failed:", sys.exc_info()[1]
+                self.__failed = True
+
+        if self.__file:
+            self.__file.close()
+
+
+    def __write(self, items):
+        newNames = {}
+        times = array.array("d")
+        windowIds = array.array("i")
+        columns = [array.array("f") for c in COLUMNS]
+
+        for (timestamp, windowId, values) in items:
+            if timestamp is None:
+                newNames[windowId] = values
+                continue
+            times.append(timestamp)
+            windowIds.append(windowId)
+            for i in range(len(COLUMNS)):
+                if i < len(values):
+                    columns[i].append(float(values[i]))
+                else:
+                    columns[i].append(0.0)
+        self.__names.update(newNames)
+
+        if not self.__file or self.__file.tell() > self.maxBytes:
+            self.__nextPart()
+        elif newNames:
+            self.__writeNames(newNames)
+
+        if len(times):
+            data = [BLOCK_HEADER.pack(PERF_BLOCK, len(times)), _toLittleEndian(times),
+                    _toLittleEndian(windowIds)]
+            data.extend([_toLittleEndian(c) for c in columns])
+            self.__file.write("".join(data))
+        self.__file.flush()
+
+
+    def __nextPart(self):
+        if self.__file:
+            self.__file.close()
+        self.__part += 1
+        self.__file = open(self.getPath(), "wb")
+        self.__file.write(FILE_HEADER.pack(MAGIC, VERSION, 0))
+        if self.__names:
+            self.__writeNames(self.__names)
+
+
+    def __writeNames(self, names):
+        text = "".join(["%d\t%s\n" % (windowId, name) for windowId, name in names.iteritems()])
+        self.__file.write(BLOCK_HEADER.pack(NAMES_BLOCK, len(text)) + text)
+
+
+
+def readPerfLog(path):
+    """ reads a log file and returns (names, columns). names maps the window
+        ids to app names, columns maps "time", "windowId" and the COLUMNS
+        to array.arrays of the values
+    """
+    columns = {"time": array.array("d"), "windowId": array.array("i")}
+    for c in COLUMNS:
+        columns[c] = array.array("f")
+    names = {}
+
+    f = open(path, "rb")
+    try:
+        header = f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[0] != MAGIC:
+            raise ValueError("%s is not a SAGE performance log" % path)
+
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                break
+            (blockType, count) = BLOCK_HEADER.unpack(header)
+
+            if blockType == NAMES_BLOCK:
+                text = f.read(count)
+                if len(text) < count:
+                    break
+                for line in text.splitlines():
+                    (windowId, name) = line.split("\t", 1)
+                    names[int(windowId)] = name
+
+            elif blockType == PERF_BLOCK:
+                data = f.read(count * (8 + 4 + 4*len(COLUMNS)))
+                if len(data) < count * (8 + 4 + 4*len(COLUMNS)):
+                    break   # cut short
+                columns["time"].extend(_fromLittleEndian("d", data[:8*count]))
+                pos = 8*count
+                columns["windowId"].extend(_fromLittleEndian("i", data[pos:pos+4*count]))
+                pos += 4*count
+                for c in COLUMNS:
+                    columns[c].extend(_fromLittleEndian("f", data[pos:pos+4*count]))
+                    pos += 4*count
+            else:
+                break   # garbage, probably a damaged file
+    finally:
+        f.close()
+
+    return (names, columns)
+
+
+def readPerfLogs(paths):
+    """ reads and joins several logs (e.g. all the parts of one session) """
+    allNames = {}
+    allColumns = None
+    for path in paths:
+        (names, columns) = readPerfLog(path)
+        allNames.update(names)
+        if allColumns is None:
+            allColumns = columns
+        else:
+            for key, values in columns.iteritems():
+                allColumns[key].extend(values)
+    return (allNames, allColumns)
+
+
+def toNumpy(columns):
+    """ the same columns as numpy arrays """
+    import numpy
+    result = {}
+    for key, values in columns.iteritems():
+        result[key] = numpy.frombuffer(values, dtype=values.typecode).copy()
+    return result
+
+
+def writeCSV(names, columns, out):
+    out.write(",".join(("time", "windowId", "name") + COLUMNS) + "\n")
+    for i in range(len(columns["time"])):
+        windowId = columns["windowId"][i]
+        row = ["%.3f" % columns["time"][i], str(windowId), names.get(windowId, "")]
+        row.extend(["%g" % columns[c][i] for c in COLUMNS])
+        out.write(",".join(row) + "\n")
+
+
+
+def main():
+    parser = OptionParser(usage="python perfLog.py [-o file.npz] logFile...")
+    parser.add_option("-o", dest="npzFile", default=None,
+                      help="save the columns as numpy arrays instead of printing CSV")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.print_help()
+        sys.exit(0)
+
+    (names, columns) = readPerfLogs(args)
+    if options.npzFile:
+        import numpy
+        arrays = toNumpy(columns)
+        numpy.savez(options.npzFile, **arrays)
+    else:
+        writeCSV(names, columns, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+############################################################################
+#
+# SAGE UI - A Graphical User Interface for SAGE
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+# Author: Ratko Jagodic
+#        
+############################################################################
+
+
+#
+# Gets the performance data from the perf collector (sageProxy.py --perf or
+# perfCollector.py on the SAGE machine) instead of asking SAGE for a perf
+# stream of its own. The collector asks SAGE for the perf data of every app
+# once and streams it to all the UIs so SAGE doesn't have to send the same
+# data to each one of them. The collector listens on the SAGE UI port + 7.
+#
+# Every sample is handed over as a 40002 message so the UI handles it the
+# same way as if it came from SAGE. The site totals (appId TOTALS_ID) are
+# skipped, the UI adds up the apps itself.
+#
+
+import socket, string
+from threading import Thread
+
+
+COLLECTOR_PORT_OFFSET = 7   # the collector's stream port is the SAGE UI port + 7
+CONNECT_TIMEOUT = 2         # seconds, we fall back to asking SAGE if there's no collector
+TOTALS_ID = -10
+
+
+
+class PerfStream(Thread):
+    """ reads the raw samples of all the apps from a collector stream """
+
+    def __init__(self, onMessage, onClose=None):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.onMessage = onMessage   # called with (40002, data) for every sample
+        self.onClose = onClose       # called when the collector goes away
+        self.sock = None
+        self.closing = False
+
+
+    def connect(self, host, sagePort):
+        """ returns True if there's a collector on that machine """
+        try:
+            self.sock = socket.create_connection((host, sagePort + COLLECTOR_PORT_OFFSET), CONNECT_TIMEOUT)
+            self.sock.settimeout(None)
+            self.sock.sendall("0\n")   # every sample of every app
+        except socket.error:
+            self.sock = None
+            return False
+        self.start()
+        return True
+
+
+    def close(self):
+        self.closing = True
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+    def run(self):
+        f = self.sock.makefile("r")
+        try:
+            try:
+                for line in f:
+                    data = toPerfMessage(line)
+                    if data:
+                        self.onMessage(40002, data)
+            except socket.error:
+                pass
+        finally:
+            f.close()
+            self.sock.close()
+            if self.onClose and not self.closing:
+                self.onClose()
+
+
+
+def toPerfMessage(line):
+    """ "<time> <appId> <8 values>" from the collector --> the data of a 40002 message
+        (None for the site totals and anything we can't read)
+    """
+    tokens = string.split(line)
+    if len(tokens) != 10:
+        return None
+    try:
+        appId = int(tokens[1])
+        v = [float(t) for t in tokens[2:]]
+    except ValueError:
+        return None
+    if appId == TOTALS_ID:
+        return None
+    return "%d\nDisplay %f %f %f %d\nRender %f %f %f %d" % \
+           (appId, v[0], v[1], v[2], int(round(v[3])), v[4], v[5], v[6], int(round(v[7])))
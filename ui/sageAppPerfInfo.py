@@ -36,7 +36,94 @@
 #        
 ############################################################################
 
-import sys, string
+import sys, string, array
+from collections import deque
+
+HISTORY_SIZE = 30   # number of values kept for every metric
+
+
+### A fixed size ring buffer holding the history of one metric.
+### Appending is O(1) and the sum, minimum and maximum of the values
+### currently in the buffer are kept up to date as the values come in
+### (min and max with monotonic queues) so nobody has to walk the history.
+### Like before, the history starts out filled with zeros.
+class PerfHistory:
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.__values = array.array('d', [0.0]*size)
+        self.__next = 0     # where the next value goes (the oldest one is there)
+        self.__seq = 0      # number of values appended so far
+        self.__sum = 0.0
+        self.__maxQueue = deque()   # (seq, value) candidates for the maximum, decreasing
+        self.__minQueue = deque()   # (seq, value) candidates for the minimum, increasing
+        for i in range(size):
+            self.__pushExtremes(0.0)
+
+
+    #### Add a new value, the oldest one falls out
+    def append(self, value):
+        value = float(value)
+        old = self.__values[self.__next]
+        self.__values[self.__next] = value
+        self.__next = (self.__next + 1) % self.size
+        self.__sum += value - old
+        if self.__next == 0:
+            self.__sum = sum(self.__values)   # don't let rounding errors pile up
+        self.__pushExtremes(value)
+
+
+    #### @return The most recent value
+    def latest(self):
+        return self.__values[self.__next - 1]
+
+
+    #### @arg count Number of values required (max = size)
+    #### @return The last count values, most recent first
+    def recent(self, count=None):
+        values = self.__values[:self.__next][::-1] + self.__values[self.__next:][::-1]
+        if count is not None and count < self.size:
+            return values[:count]
+        return values
+
+
+    #### @return The whole history, oldest first (for plotting)
+    def ordered(self):
+        return self.__values[self.__next:] + self.__values[:self.__next]
+
+
+    def sum(self):
+        return self.__sum
+
+    def average(self):
+        return self.__sum / self.size
+
+    def minimum(self):
+        return self.__minQueue[0][1]
+
+    def maximum(self):
+        return self.__maxQueue[0][1]
+
+
+    def __pushExtremes(self, value):
+        seq = self.__seq
+        self.__seq += 1
+
+        while self.__maxQueue and self.__maxQueue[-1][1] <= value:
+            self.__maxQueue.pop()
+        self.__maxQueue.append((seq, value))
+        while self.__minQueue and self.__minQueue[-1][1] >= value:
+            self.__minQueue.pop()
+        self.__minQueue.append((seq, value))
+
+        # forget the ones that fell out of the window
+        oldest = seq - self.size
+        while self.__maxQueue[0][0] <= oldest:
+            self.__maxQueue.popleft()
+        while self.__minQueue[0][0] <= oldest:
+            self.__minQueue.popleft()
+
+
 
 ### Class to hold all the performace information
 ### Instance of this class has to be created for every app instance ID on SAGE
@@ -47,22 +134,19 @@ class sageAppPerfInfo:
         self.renderArray = {}
         self.dataArray = {}
         
-        self.displayArray['bandWidth'] = self.__zerosHash(30)
-        self.displayArray['frameRate'] = self.__zerosHash(30)
-        self.displayArray['nodes'] = self.__zerosHash(30)
-        self.displayArray['cpu'] = self.__zerosHash(30)
-        self.displayArrayIndex = 0
-
-        self.renderArray['bandWidth'] = self.__zerosHash(30)
-        self.renderArray['frameRate'] = self.__zerosHash(30)
-        self.renderArray['nodes'] = self.__zerosHash(30)
-        self.renderArray['cpu'] = self.__zerosHash(30)
-        self.renderArrayIndex = 0
-
-        self.dataArray['bandWidth'] = self.__zerosHash(30)
-        self.dataArray['nodes'] = self.__zerosHash(30)
-        self.dataArray['cpu'] = self.__zerosHash(30)
-        self.dataArrayIndex = 0
+        self.displayArray['bandWidth'] = PerfHistory()
+        self.displayArray['frameRate'] = PerfHistory()
+        self.displayArray['nodes'] = PerfHistory()
+        self.displayArray['cpu'] = PerfHistory()
+
+        self.renderArray['bandWidth'] = PerfHistory()
+        self.renderArray['frameRate'] = PerfHistory()
+        self.renderArray['nodes'] = PerfHistory()
+        self.renderArray['cpu'] = PerfHistory()
+
+        self.dataArray['bandWidth'] = PerfHistory()
+        self.dataArray['nodes'] = PerfHistory()
+        self.dataArray['cpu'] = PerfHistory()
 
     #### Set the display performance Info
     #### @arg bandwidth Bandwidth
@@ -70,15 +154,10 @@ class sageAppPerfInfo:
     #### @arg nodes Number of nodes
     #### @arg cpuUsage CPU utilisation
     def setDisplayPerfInfo(self, bandWidth, frameRate, nodes, cpuUsage):
-        if (self.displayArrayIndex >= 30):
-            self.displayArrayIndex = 0
-
-        self.displayArray['bandWidth'][self.displayArrayIndex % 30] = bandWidth
-        self.displayArray['frameRate'][self.displayArrayIndex % 30] = frameRate
-        self.displayArray['nodes'][self.displayArrayIndex % 30] = nodes
-        self.displayArray['cpu'][self.displayArrayIndex % 30] = cpuUsage
-
-        self.displayArrayIndex = self.displayArrayIndex + 1
+        self.displayArray['bandWidth'].append(bandWidth)
+        self.displayArray['frameRate'].append(frameRate)
+        self.displayArray['nodes'].append(nodes)
+        self.displayArray['cpu'].append(cpuUsage)
 
 
 
@@ -88,65 +167,37 @@ class sageAppPerfInfo:
     #### @arg nodes Number of nodes
     #### @arg cpuUsage CPU utilisation
     def setRenderPerfInfo(self, bandWidth, frameRate, nodes, cpuUsage):
-        if (self.renderArrayIndex >= 30):
-            self.renderArrayIndex = 0
-
-        self.renderArray['bandWidth'][self.renderArrayIndex] = bandWidth
-        self.renderArray['frameRate'][self.renderArrayIndex] = frameRate
-        self.renderArray['nodes'][self.renderArrayIndex] = nodes
-        self.renderArray['cpu'][self.renderArrayIndex] = cpuUsage
-
-        self.renderArrayIndex = self.renderArrayIndex + 1
+        self.renderArray['bandWidth'].append(bandWidth)
+        self.renderArray['frameRate'].append(frameRate)
+        self.renderArray['nodes'].append(nodes)
+        self.renderArray['cpu'].append(cpuUsage)
 
 
 
     #### Get display information based on the specified item
     #### @arg interval No of values required (max = 30)
-    #### @return Returns an array
+    #### @return Returns an array (most recent value first)
     def getDisplayInformation(self, stItemName, interval):
-
-        if (interval > 30 or interval < 0):
+        if (interval > HISTORY_SIZE or interval < 0):
             print ('Out of bound range specified')
             return 0
-        newArray = self.__zerosHash(interval)    #zeros(type='Float32', shape=interval)
-        newArrayIndex = self.displayArrayIndex - 1
-
-        for x in range(0, interval):
-            if newArrayIndex < 0:
-                newArrayIndex = 29
-
-            newArray[x] = self.displayArray[ stItemName ][newArrayIndex]
-            newArrayIndex = newArrayIndex - 1
-
-        return newArray
+        return self.displayArray[ stItemName ].recent(interval)
 
 
 
     #### Get rendering information based on the specified item
     #### @arg interval No of values required (max = 30)
-    #### @return Returns an array
+    #### @return Returns an array (most recent value first)
     def getRenderInformation(self, stItemName, interval):
-
-        if (interval > 30 or interval < 0):
+        if (interval > HISTORY_SIZE or interval < 0):
             print ('Out of bound range specified')
             return 0
-        newArray = self.__zerosHash(interval)   #zeros(type='Float32', shape=interval)
-        newArrayIndex = self.renderArrayIndex - 1
-
-        for x in range(0, interval):
-
-            if newArrayIndex < 0:
-                newArrayIndex = 29
+        return self.renderArray[ stItemName ].recent(interval)
 
-            newArray[x] = self.renderArray[ stItemName ][newArrayIndex]
-            newArrayIndex = newArrayIndex - 1
-  
-        return newArray
 
+    #### @return The PerfHistory of the item (for graphs and statistics)
+    def getDisplayHistory(self, stItemName):
+        return self.displayArray[ stItemName ]
 
-    # creates a hash of size "size" and initializes all the values to 0
-    def __zerosHash(self, size):
-        h = {}
-        for i in range(0, size):
-            h[i] = 0
-        return h
+    def getRenderHistory(self, stItemName):
+        return self.renderArray[ stItemName ]
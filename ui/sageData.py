@@ -39,18 +39,212 @@
 
 
 # python stuff
-import sys, string, pickle, time, os.path, os, xmlrpclib, shutil
+import sys, string, pickle, time, os.path, os, xmlrpclib, shutil, Queue
 import traceback as tb
+from threading import Thread, Condition
 
 # my imports
 from sageApp import SageApp, SageAppInitial
 from sageAppPerfInfo import sageAppPerfInfo
+import perfLog
 from sageDisplayInfo import SageDisplayInfo
 import Graph
 from globals import *
 from sagePath import getUserPath
 
 
+MAX_PARALLEL_LAUNCHES = 8   # apps launched at the same time when restoring a state
+RESTORE_TIMEOUT = 30        # seconds we wait for the restored windows to show up
+CLOSE_TIMEOUT = 10          # seconds we wait for SAGE to close the apps
+CATALOGUE_FILE = "catalogue.idx"
+
+
+
+def readStateFile(filePath):
+    """ returns (description, appList) saved in the file """
+    f = open(filePath, "rb")
+    try:
+        return pickle.Unpickler(f).load()
+    finally:
+        f.close()
+
+
+
+## Keeps the description of every saved state in one small file so that
+## listing the states doesn't have to unpickle all of them. An entry is
+## only trusted while the state file has the same mtime and size
+## (so states saved by other UIs or copied in by hand are picked up too)
+class StateCatalogue:
+
+    def __init__(self, stateDir):
+        self.stateDir = stateDir
+        self.path = opj(stateDir, CATALOGUE_FILE)
+        self.__entries = None   # key=stateName, value=(mtime, size, description, numApps)
+
+
+    def getStates(self):
+        """ returns a hash of key=stateName, value=description """
+        self.__load()
+        entries = {}
+        changed = False
+        for fileName in os.listdir(self.stateDir):
+            (stateName, ext) = os.path.splitext(fileName)
+            filePath = opj(self.stateDir, fileName)
+            if ext != ".state" or not os.path.isfile(filePath):
+                continue
+            
+            st = os.stat(filePath)
+            entry = self.__entries.get(stateName)
+            if entry is None or entry[0] != st.st_mtime or entry[1] != st.st_size:
+                try:
+                    (description, appList) = readStateFile(filePath)
+                except:
+                    print "\nUnable to read saved state file: "+filePath
+                    continue
+                entry = (st.st_mtime, st.st_size, description, len(appList))
+                changed = True
+            entries[stateName] = entry
+
+        if changed or len(entries) != len(self.__entries):
+            self.__entries = entries
+            self.__save()
+
+        stateHash = {}
+        for stateName, entry in entries.iteritems():
+            stateHash[stateName] = entry[2]
+        return stateHash
+
+
+    def update(self, stateName, description, appList):
+        self.__load()
+        st = os.stat(opj(self.stateDir, stateName+".state"))
+        self.__entries[stateName] = (st.st_mtime, st.st_size, description, len(appList))
+        self.__save()
+
+
+    def remove(self, stateName):
+        self.__load()
+        if stateName in self.__entries:
+            del self.__entries[stateName]
+            self.__save()
+
+
+    def __load(self):
+        if self.__entries is not None:
+            return
+        try:
+            f = open(self.path, "rb")
+            try:
+                self.__entries = pickle.load(f)
+            finally:
+                f.close()
+        except:
+            self.__entries = {}   # not there yet (or broken), it will be rebuilt
+        if not isinstance(self.__entries, dict):
+            self.__entries = {}
+
+
+    def __save(self):
+        try:
+            f = open(self.path, "wb")
+            pickle.dump(self.__entries, f, 2)
+            f.close()
+        except IOError:
+            print "\nUnable to write the saved state catalogue: "+self.path
+
+
+
+
+## Relaunches the apps of a saved state a few at a time (in its own thread)
+## and once their windows show up, puts them all where they were saved
+## with one batch of resize messages
+class StateRestore(Thread):
+
+    def __init__(self, sageData, sageGate, appList, closeFirst=False):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.sageData = sageData
+        self.sageGate = sageGate
+        self.appList = appList
+        self.closeFirst = closeFirst
+        self.__cond = Condition()
+        self.__expected = {}     # key=(launcherId, appId), value=(pos, size)
+        self.__appeared = {}     # key=(launcherId, appId), value=windowId
+
+
+    def run(self):
+        try:
+            if self.closeFirst:
+                self.sageData.closeAllApps(CLOSE_TIMEOUT)
+                
+            # launch the apps in parallel (but not all at once)
+            queue = Queue.Queue()
+            for appInfo in self.appList:
+                queue.put(appInfo)
+            workers = []
+            for i in range(min(MAX_PARALLEL_LAUNCHES, len(self.appList))):
+                t = Thread(target=self.__launch, args=(queue,))
+                t.setDaemon(True)
+                t.start()
+                workers.append(t)
+            for t in workers:
+                t.join()
+
+            # wait for the windows and then move them all at once
+            self.__cond.acquire()
+            try:
+                end = time.time() + RESTORE_TIMEOUT
+                while not self.__allAppeared() and time.time() < end:
+                    self.__cond.wait(end - time.time())
+                msgs = []
+                for key, (pos, size) in self.__expected.iteritems():
+                    if key in self.__appeared and pos and size:
+                        (left, bottom) = pos
+                        data = "%d %d %d %d %d" % (self.__appeared[key], left, left+size[0], bottom, bottom+size[1])
+                        msgs.append((data, 1004))
+                missing = len(self.__expected) - len(msgs)
+            finally:
+                self.__cond.release()
+            self.sageGate.sendBatch(msgs)
+            print "Restored", len(msgs), "of", len(self.appList), "apps", \
+                  (missing and "(%d didn't show up in time)" % missing) or ""
+        finally:
+            self.sageData.restoreDone(self)
+
+
+    def appeared(self, launcherId, appId, windowId):
+        """ SageData tells us about every new window """
+        self.__cond.acquire()
+        self.__appeared[(launcherId, appId)] = windowId
+        self.__cond.notifyAll()
+        self.__cond.release()
+
+
+    def __allAppeared(self):
+        for key in self.__expected:
+            if key not in self.__appeared:
+                return False
+        return True
+
+
+    def __launch(self, queue):
+        while True:
+            try:
+                appInfo = queue.get_nowait()
+            except Queue.Empty:
+                return
+            launcherId, appName, configName, pos, size, optionalArgs = appInfo
+            if not self.sageGate.isConnected():
+                continue
+            res = self.sageGate.executeRemoteApp(launcherId, appName, configName, pos, size, optionalArgs)
+            if res != -1:
+                self.__cond.acquire()
+                self.__expected[(launcherId, int(res))] = (pos, size)
+                self.__cond.release()
+
+
+
+
 ## Main class to store all the messages returned by SAGE
 class SageData:
 
@@ -62,13 +256,18 @@ class SageData:
         self.hashApps = {}           # all the apps available for running??
         self.hashAppStatusInfo = {}  # apps currently running
         self.hashAppPerfInfo = {}
-        self.hashFileInfo = {}
+        self.__perfLog = None        # PerfLogWriter for all the apps (and the site totals)
+        self.__loggedNames = set()   # windowIds whose app name is already in the log
         self.displayInfo = SageDisplayInfo()
         self.sageGate = sageGate
         self.autosave = autosave
         self.timeStarted = time.strftime("%Y%m%d-%H%M%S", time.localtime())
         self.displayName = displayName.strip()
         self.__firstAutosave = True
+        self.__catalogue = StateCatalogue(SAVED_STATES_DIR)
+        self.__restores = []          # StateRestores in progress
+        self.__appsCond = Condition() # notified when an app is closed
+        self.__closeListeners = []    # also called with the SageApp when it closes (besides the 40003 callback)
         
         self._sageColor = (0,0,0)
         self.__bPerformanceLogging = True
@@ -97,6 +296,13 @@ class SageData:
         self.__hashAppPerfTotals[ self.I_DISPLAY_TOTAL_BANDWIDTH ] = 0.0
         self.__hashAppPerfTotals[ self.I_DISPLAY_AVG_FRAME_RATE ] = 0.0
         self.__hashAppPerfTotals[ self.I_DISPLAY_TOTAL_NODES ] = 0
+
+        # running sums of the latest values of all the apps (the frame rates
+        # are summed here and averaged into __hashAppPerfTotals). They are
+        # adjusted by the change of one app on every perf message instead
+        # of adding up all the apps again
+        self.__perfSums = {}
+        self.__resetPerfSums()
         
         # for knowing when to zero out the totals since
         # sage doesnt send perf data when it's 0
@@ -258,6 +464,8 @@ class SageData:
             self.hashAppStatusInfo[ windowId ] = SageApp( listTokens[0], int(listTokens[1]),
                    int(listTokens[2]), int(listTokens[3]), int(listTokens[4]), int(listTokens[5]),
                    int(listTokens[6]), zValue, orientation, displayId, appId, launcherId) 
+            for restore in self.__restores[:]:
+                restore.appeared(launcherId, appId, windowId)
 
 
         # (AKS 2004-10-23) Provide the app-id to the callback
@@ -286,23 +494,24 @@ class SageData:
         # do this first and then remove the app from the hash!!
         if ( 40003 in self.hashCallback ):
             self.hashCallback[ 40003 ]( self.hashAppStatusInfo[windowId]  )
+        if windowId in self.hashAppStatusInfo:
+            for listener in self.__closeListeners:
+                listener( self.hashAppStatusInfo[windowId] )
             
         if windowId in self.hashAppStatusInfo :
             del self.hashAppStatusInfo[windowId]
         if windowId in self.hashAppPerfInfo :
+            self.__addToPerfSums( self.hashAppPerfInfo[windowId], -1 )
             del self.hashAppPerfInfo[windowId]
+            if not self.hashAppPerfInfo:
+                self.__resetPerfSums()   # so that rounding errors don't linger
 
-        if windowId in self.hashFileInfo :
-            fileObject = self.hashFileInfo.get(windowId)
-            fileObject.close()
-            del self.hashFileInfo[windowId]
+        # for closeAllApps
+        self.__appsCond.acquire()
+        self.__appsCond.notifyAll()
+        self.__appsCond.release()
             
 
-    #----------------------------------------------------------------------
-
-    def getLogFileHash(self):
-        return self.hashFileInfo
-
 
     #----------------------------------------------------------------------
 
@@ -323,6 +532,7 @@ class SageData:
         
         if (appPerfInfo):
             lineTokens = string.split(data, '\n')
+            self.__addToPerfSums( appPerfInfo, -1 )   # the new values replace these
 
             displayItemTokens = string.split(lineTokens[0])
             appPerfInfo.setDisplayPerfInfo(float(displayItemTokens[1]), float(displayItemTokens[2]),\
@@ -338,96 +548,28 @@ class SageData:
             renderItemTokens.append(0)
             appPerfInfo.setRenderPerfInfo(float(renderItemTokens[1]), float(renderItemTokens[2]),\
                                            float(renderItemTokens[3]), int(renderItemTokens[4]))
+            self.__addToPerfSums( appPerfInfo, 1 )
 
 
-        # Now open a file and log the data on it
-            try:   #in case the file and directory permissions are not right
+        # log the data (it's written to the file by a separate thread)
+            if ( self.__bPerformanceLogging == True ):
+                if not windowId in self.__loggedNames and windowId in self.hashAppStatusInfo:
+                    self.__loggedNames.add( windowId )
+                    self.__getPerfLog().setName( windowId, self.hashAppStatusInfo[ windowId ].getName() )
 
-                if not windowId in self.hashFileInfo:
-                    sageApp = self.hashAppStatusInfo[ windowId ]
-                    stAppName = sageApp.getName()
-                    stDateTime = time.strftime("%Y%m%d-%H%M%S", time.localtime())
-                    stFilename = stAppName + '-' + str(windowId) + '-' + stDateTime
-                    
-                    stPath = opj(DATA_DIR, stFilename + ".txt")
-                    stFilename = os.path.normpath( stPath )
-                    fileObject = open(stFilename, "w")
-
-                    fileObject.write( stAppName + ":" + str(windowId) + " >> " + time.asctime() + "\n" )
-                    fileObject.write( '-' * 120 + "\n\n" )
-                    tempString = (' Disp BW    Disp FR    Packet Loss    Num Receivers        Rend BW    Rend FR    Packet Loss    Num Receivers\n')
-                    fileObject.write(tempString)
-                    fileObject.write( '-' * len(tempString) + "\n" )
-                    self.hashFileInfo[windowId] = fileObject
-                    fileObject.flush()
-                # end of initialization
-
-                if ( self.__bPerformanceLogging == True ):
-
-                    fileObject = self.hashFileInfo.get(windowId)
-                    tempString = "%8.3f    %7.3f    %3.2f    %8d       " % (float(displayItemTokens[1]), float(displayItemTokens[2]),
-                                                                            float(displayItemTokens[3]), int(displayItemTokens[4]))
-
-                    fileObject.write(tempString)
-
-                    tempString = "%8.3f    %7.3f    %3.2f    %8d\n" % (float(renderItemTokens[1]), float(renderItemTokens[2]),
-                                                                       float(renderItemTokens[3]), int(renderItemTokens[4]))
-                    fileObject.write(tempString)
-                    fileObject.flush()
-            # >>> end file writing...else, nothing
-            except:
-                pass  #do nothing if something fails (such as permissions)
+                self.__getPerfLog().log( windowId, (float(displayItemTokens[1]), float(displayItemTokens[2]),
+                                                    float(displayItemTokens[3]), int(displayItemTokens[4]),
+                                                    float(renderItemTokens[1]), float(renderItemTokens[2]),
+                                                    float(renderItemTokens[3]), int(renderItemTokens[4])) )
 
                 
-            # calculate totals
-        self.__hashAppPerfTotals[ self.I_RENDER_TOTAL_BANDWIDTH ] = 0.0
-        self.__hashAppPerfTotals[ self.I_RENDER_AVG_FRAME_RATE ] = 0.0
-        self.__hashAppPerfTotals[ self.I_RENDER_TOTAL_NODES ] = 0
-        self.__hashAppPerfTotals[ self.I_DISPLAY_TOTAL_BANDWIDTH ] = 0.0
-        self.__hashAppPerfTotals[ self.I_DISPLAY_AVG_FRAME_RATE ] = 0.0
-        self.__hashAppPerfTotals[ self.I_DISPLAY_TOTAL_NODES ] = 0
-        
-        fSumRenderFrameRate = 0.0
-        fSumDisplayFrameRate = 0.0
-        
-        #print "zeroing..."
-
-        # (AKS 2005-04-05) This comment is de
-        # For each application, I am taking each of its metrics and adding them to the
-        # totals which are stored in the hash.  The hash is just a dictionary of totals
-        # for metrics for *ALL* application instances.
-        
-        for iKey in self.hashAppPerfInfo:
-            #print "hash perf: ", self.hashAppPerfInfo
-            sapiAppStats = self.hashAppPerfInfo[ iKey ]
-            
-            self.__hashAppPerfTotals[ self.I_RENDER_TOTAL_BANDWIDTH ] = self.__hashAppPerfTotals[
-                self.I_RENDER_TOTAL_BANDWIDTH ] + sapiAppStats.getRenderInformation(
-                'bandWidth', 1 )[0]
-            
-            fSumRenderFrameRate = fSumRenderFrameRate + sapiAppStats.getRenderInformation(
-                'frameRate', 1 )[0]
-            
-            self.__hashAppPerfTotals[ self.I_RENDER_TOTAL_NODES ] = self.__hashAppPerfTotals[
-                self.I_RENDER_TOTAL_NODES ] + sapiAppStats.getRenderInformation(
-                'nodes', 1 )[0]
-            
-            self.__hashAppPerfTotals[ self.I_DISPLAY_TOTAL_BANDWIDTH ] = self.__hashAppPerfTotals[
-                self.I_DISPLAY_TOTAL_BANDWIDTH ] + sapiAppStats.getDisplayInformation(
-                'bandWidth', 1 )[0]
-            
-            fSumDisplayFrameRate = fSumRenderFrameRate + sapiAppStats.getDisplayInformation(
-                'frameRate', 1 )[0]             
-            
-            self.__hashAppPerfTotals[ self.I_DISPLAY_TOTAL_NODES ] = self.__hashAppPerfTotals[
-                self.I_DISPLAY_TOTAL_NODES ] + sapiAppStats.getDisplayInformation(
-                'nodes', 1 )[0]
-
-            
-            # Make sure to clear update flag since data has been processed
-            #self.__hashAppGraphUpdateFlag[ iKey ] = False
-            
-        # end of loop
+            # calculate totals (the sums are kept up to date above)
+        self.__hashAppPerfTotals[ self.I_RENDER_TOTAL_BANDWIDTH ] = self.__perfSums[ self.I_RENDER_TOTAL_BANDWIDTH ]
+        self.__hashAppPerfTotals[ self.I_RENDER_TOTAL_NODES ] = int( round( self.__perfSums[ self.I_RENDER_TOTAL_NODES ] ) )
+        self.__hashAppPerfTotals[ self.I_DISPLAY_TOTAL_BANDWIDTH ] = self.__perfSums[ self.I_DISPLAY_TOTAL_BANDWIDTH ]
+        self.__hashAppPerfTotals[ self.I_DISPLAY_TOTAL_NODES ] = int( round( self.__perfSums[ self.I_DISPLAY_TOTAL_NODES ] ) )
+        fSumRenderFrameRate = self.__perfSums[ self.I_RENDER_AVG_FRAME_RATE ]
+        fSumDisplayFrameRate = self.__perfSums[ self.I_DISPLAY_AVG_FRAME_RATE ]
 
         iAppCount = len( self.hashAppStatusInfo )
 
@@ -454,8 +596,8 @@ class SageData:
         self.__sapiPerfTotals.setRenderPerfInfo( float( self.__hashAppPerfTotals[
             self.I_RENDER_TOTAL_BANDWIDTH ] ), 0.0, 0.0, 0 )
 
-        self.__pgTotalRenderBandwidth.update( self.__sapiPerfTotals.getRenderInformation( 'bandWidth', 30 ) )
-        self.__pgTotalDisplayBandwidth.update( self.__sapiPerfTotals.getDisplayInformation( 'bandWidth', 30 ) )
+        self.__pgTotalRenderBandwidth.updateFromHistory( self.__sapiPerfTotals.getRenderHistory( 'bandWidth' ) )
+        self.__pgTotalDisplayBandwidth.updateFromHistory( self.__sapiPerfTotals.getDisplayHistory( 'bandWidth' ) )
 
 
         self.__lastTotalsUpdate = time.time()
@@ -467,38 +609,48 @@ class SageData:
 
     #----------------------------------------------------------------------
 
-    # saves the performance data totals into a file from this SAGE site only
+    # adds (sign=1) or removes (sign=-1) the latest values of an app to/from the running sums
+    def __addToPerfSums(self, appPerfInfo, sign):
+        render = appPerfInfo.getRenderHistory
+        display = appPerfInfo.getDisplayHistory
+        s = self.__perfSums
+        s[ self.I_RENDER_TOTAL_BANDWIDTH ] += sign * render( 'bandWidth' ).latest()
+        s[ self.I_RENDER_AVG_FRAME_RATE ] += sign * render( 'frameRate' ).latest()
+        s[ self.I_RENDER_TOTAL_NODES ] += sign * render( 'nodes' ).latest()
+        s[ self.I_DISPLAY_TOTAL_BANDWIDTH ] += sign * display( 'bandWidth' ).latest()
+        s[ self.I_DISPLAY_AVG_FRAME_RATE ] += sign * display( 'frameRate' ).latest()
+        s[ self.I_DISPLAY_TOTAL_NODES ] += sign * display( 'nodes' ).latest()
+
+
+    def __resetPerfSums(self):
+        for key in self.__hashAppPerfTotals:
+            self.__perfSums[ key ] = 0.0
+
+
+    #----------------------------------------------------------------------
+
+    # saves the performance data totals into the log from this SAGE site only
+    # (bandwidths in Mbps like the app records)
     def saveSiteTotals(self, siteName):
         totalsID = -10 # save the totals as appId = -10
         try:
-            if not totalsID in self.hashFileInfo and self.__bPerformanceLogging:  
-                stDateTime = time.strftime("%Y%m%d-%H%M%S", time.localtime())
-                stFilename = "SITE_TOTAL-" + siteName + '-' + stDateTime
-                #stPath = "./data/" + stFilename + ".txt"
-                stPath = opj(DATA_DIR, stFilename + ".txt")
-                stFilename = os.path.normpath( stPath )
-                fileObject = open(stFilename, "w")
-
-                fileObject.write( siteName + "\n" + time.asctime() + "\n" )
-                fileObject.write( '-' * 65 + "\n" )
-                tempString = (' Timestamp(s)    Disp BW(Gbps)    Rend BW(Gbps)\n')
-                fileObject.write(tempString)
-                fileObject.write( '-' * len(tempString) + "\n" )
-                self.hashFileInfo[totalsID] = fileObject
-                fileObject.flush()
-            # end of initialization
-            
             if ( self.__bPerformanceLogging ):
-                
-                fileObject = self.hashFileInfo[totalsID]
-                tempString = "%12d    %12.4f    %12.4f\n" % (getTimeStamp(),
-                                                            self.getDisplayBWTotal(),
-                                                            self.getRenderBWTotal())
-                fileObject.write(tempString)
-                fileObject.flush()
+                if not totalsID in self.__loggedNames:
+                    self.__loggedNames.add( totalsID )
+                    self.__getPerfLog().setName( totalsID, "SITE_TOTAL-" + siteName )
 
+                self.__getPerfLog().log( totalsID, (self.getDisplayBWTotal()*1000.0, 0, 0, 0,
+                                                    self.getRenderBWTotal()*1000.0, 0, 0, 0) )
         except:
             print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
+
+
+    # the log writer is only started once there's something to log
+    def __getPerfLog(self):
+        if not self.__perfLog:
+            stFilename = "PERF-" + self.displayName + '-' + self.timeStarted
+            self.__perfLog = perfLog.PerfLogWriter( os.path.normpath( opj(DATA_DIR, stFilename) ) )
+        return self.__perfLog
         
 
     #----------------------------------------------------------------------
@@ -594,6 +746,17 @@ class SageData:
             print("Invalid app instance ID")
 
 
+
+    ### Get the whole history of a sage app display/render item
+    ### (a PerfHistory with running statistics, for the graphs)
+    ### @arg windowId Instance id of the application
+    def getDisplayHistory(self, stItemName, windowId):
+        return self.hashAppPerfInfo[windowId].getDisplayHistory( stItemName )
+
+    def getRenderHistory(self, stItemName, windowId):
+        return self.hashAppPerfInfo[windowId].getRenderHistory( stItemName )
+
+
     #----------------------------------------------------------------------
 
     
@@ -612,6 +775,12 @@ class SageData:
     #----------------------------------------------------------------------
     
 
+    #### there is only one callback per message so other objects interested
+    #### in closed apps register here (the function must not block)
+    def addAppCloseListener(self, function):
+        self.__closeListeners.append(function)
+
+
     ### So that SageData knows what to call when a message arrives
     def registerCallbackFunction( self, iSageID, function ):
         self.hashCallback[ iSageID ] = function
@@ -689,10 +858,12 @@ class SageData:
     #----------------------------------------------------------------------
     
     ### (RJ 2005-5-18)
-    ### Stops the logging and closes all the logging files
+    ### Stops the logging and closes the log file
     def stopLogging(self):
-        for windowId, fileObject in self.getLogFileHash().iteritems():
-            fileObject.close()
+        if self.__perfLog:
+            self.__perfLog.close()
+            self.__perfLog = None
+            self.__loggedNames.clear()
 
     #----------------------------------------------------------------------
 
@@ -752,6 +923,9 @@ class SageData:
             print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
             return False
 
+        # autosaves happen on every app change, the catalogue catches up when it's listed
+        if not stateName.startswith("_autosave"):
+            self.__catalogue.update(stateName, description, appList)
         return True
 
 
@@ -769,37 +943,40 @@ class SageData:
             print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
 
 
-    def loadState(self, stateName):
-        """ tries to reload the apps from the saved state """
+    def loadState(self, stateName, closeFirst=False):
+        """ tries to reload the apps from the saved state (in a separate thread)
+            closeFirst closes all the apps currently running before that
+        """
         appList = []
         description = ""
 
         # load the state from a file
         try:
-            f = open( opj(SAVED_STATES_DIR, stateName+".state"), "r")
-            (description, appList) = pickle.Unpickler(f).load()
-            f.close()
+            (description, appList) = readStateFile( opj(SAVED_STATES_DIR, stateName+".state") )
         except:
             print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
             print "\nUnable to read saved state file: "+"saved-states/"+stateName+".state"
             return False
 
         # try re-running all the apps
-        count = 0
-        for appInfo in appList: 
-            launcherId, appName, configName, pos, size, optionalArgs = appInfo
-            self.sageGate.executeRemoteApp(launcherId, appName, configName, pos, size, optionalArgs)
-            count+=1
-            
+        restore = StateRestore(self, self.sageGate, appList, closeFirst)
+        self.__restores.append(restore)
+        restore.start()
         return True
 
 
+    def restoreDone(self, restore):
+        if restore in self.__restores:
+            self.__restores.remove(restore)
+
+
 
     def deleteState(self, stateName):
         """ tries to delete an existing state """
         try:
             filePath = opj(SAVED_STATES_DIR, stateName+".state")
             os.remove(filePath)
+            self.__catalogue.remove(stateName)
         except:
             print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
             print "\nUnable to delete the saved state: ", filePath
@@ -811,36 +988,31 @@ class SageData:
 
     def getStateList(self):
         """ returns a hash of key=stateName, value=description """
-        stateHash = {}
-        appList = []
-        description = ""
-
-        sd = SAVED_STATES_DIR
-        
-        # load all the states and read descriptions from them
-        for fileName in os.listdir( sd ):
-            filePath = opj(sd, fileName)
-            if os.path.isfile(filePath) and os.path.splitext(filePath)[1] == ".state":
-                try:
-                    stateName = os.path.splitext( os.path.split(filePath)[1] )[0]
-                    f = open(filePath, "rb")
-                    (description, appList) = pickle.Unpickler(f).load()
-                    f.close()
-                    stateHash[stateName] = description
-                except:
-                    print "\nUnable to read saved state file: "+filePath
-                    continue
+        return self.__catalogue.getStates()
 
-        return stateHash
 
 
+    def closeAllApps(self, timeout=0):
+        """ closes all the apps with one batch of messages. With a timeout it
+            waits until SAGE reports them closed (so don't wait in the wx thread
+            since that's where the reports come in). Returns True if they all closed.
+        """
+        windowIds = [app.getId() for app in self.hashAppStatusInfo.values() if app.getId() != -5]
+        self.sageGate.sendBatch([(str(windowId), 1002) for windowId in windowIds])
+        if not timeout:
+            return True
 
-    def closeAllApps(self):
-        for app in self.hashAppStatusInfo.itervalues():
-            if app.getId() == -5:
-                continue
-            self.sageGate.shutdownApp(app.getId())
-            time.sleep(0.5)
+        self.__appsCond.acquire()
+        try:
+            end = time.time() + timeout
+            while time.time() < end:
+                remaining = [w for w in windowIds if w in self.hashAppStatusInfo]
+                if not remaining:
+                    return True
+                self.__appsCond.wait(end - time.time())
+            return False
+        finally:
+            self.__appsCond.release()
 
 
 
@@ -38,8 +38,9 @@
 
 
 import sageGateBase as sgb
-import wx, socket, xmlrpclib, sys
+import wx, socket, xmlrpclib, sys, string
 from globals import *
+from perfStream import PerfStream
 import traceback as tb
 
 
@@ -66,7 +67,60 @@ class SageGate(sgb.SageGateBase):
                                   forceAppLauncher=getAppLauncher(),
                                   onDisconnect=self.initiateClosedConnectionDialog,
                                   verbose=True)
-        
+        self.perfApps = {}       # windowId --> sending rate of the apps we want the perf data of
+        self.perfStream = None   # the collector's stream if there's one on the SAGE machine
+
+
+    def connectToSage(self, host=socket.gethostname(), port=20001):
+        """ also connects to the perf collector if it's running there """
+        res = sgb.SageGateBase.connectToSage(self, host, port)
+        if self.connected:
+            self.perfApps = {}
+            stream = PerfStream(self.onMessage, self.onPerfStreamClosed)
+            if stream.connect(self.sageHost, self.sagePort):
+                self.perfStream = stream
+                print "getting the performance data from the collector on", self.sageHost
+        return res
+
+
+    def disconnectFromSage(self, isSocketError=False):
+        if self.perfStream:
+            self.perfStream.close()
+            self.perfStream = None
+        return sgb.SageGateBase.disconnectFromSage(self, isSocketError)
+
+
+    def onPerfStreamClosed(self):
+        wx.CallAfter(self.__fallBackToSagePerf)
+
+
+    def __fallBackToSagePerf(self):
+        """ the collector went away so we ask SAGE for the perf data ourselves """
+        if not self.perfStream:
+            return
+        self.perfStream = None
+        for windowId, rate in self.perfApps.items():
+            sgb.SageGateBase.startPerformance(self, windowId, rate)
+
+
+    def startPerformance(self, windowId, sendingrate=2):
+        """ with a collector running, SAGE already sends it the perf data of
+            every app so we just start passing that app's samples on
+        """
+        if self.connected == False: return 0
+        self.perfApps[windowId] = sendingrate
+        if self.perfStream:
+            return 1
+        return sgb.SageGateBase.startPerformance(self, windowId, sendingrate)
+
+
+    def stopPerformance(self, windowId):
+        if self.connected == False: return 0
+        self.perfApps.pop(windowId, None)
+        if self.perfStream:
+            return 1
+        return sgb.SageGateBase.stopPerformance(self, windowId)
+
 
     def showConnectionClosedDialog(self):
         """ informs the user when the connection breaks """
@@ -100,7 +154,11 @@ class SageGate(sgb.SageGateBase):
 
         # try running the app (return -1 if failed for whatever reason)
         try:
-            res = self.appLauncher.startDefaultApp(appName, sageIP, sagePort, useBridge, configName, pos, size, optionalArgs)
+            self.appLauncherLock.acquire()
+            try:
+                res = self.appLauncher.startDefaultApp(appName, sageIP, sagePort, useBridge, configName, pos, size, optionalArgs)
+            finally:
+                self.appLauncherLock.release()
         except:
             print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
             return -1
@@ -163,6 +221,17 @@ class SageGate(sgb.SageGateBase):
 
     def onMessage(self, code, data):
         """ handles the incoming messages """
+        if code == 40002 and self.perfStream:   # from the collector, only the apps we asked for
+            try:
+                if int(string.split(data, '\n', 1)[0]) not in self.perfApps:
+                    return
+            except ValueError:
+                return
+        elif code == 40003:
+            try:
+                self.perfApps.pop(int(string.split(data)[0]), None)
+            except (ValueError, IndexError):
+                pass
         if code in self.hashCallbackFunction:
             wx.CallAfter(self.hashCallbackFunction[ code ], data)
 
@@ -84,7 +84,6 @@
 from threading import Thread, RLock
 import socket, sys, string, os.path, xmlrpclib, time
 import traceback as tb
-from globals import *
 
 
 ### GLOBALS ###
@@ -96,6 +95,12 @@ APP_LAUNCHER_PORT = 19010  #the default port, usually retrieved from the sage se
 SAGE_SERVER_PORT = 8009  #the xmlrpc port of the sage server
 
 
+### the gate only needs this from globals so it doesn't import it (and wx with it)
+### which lets sessionReplay run without wx or SAGE_DIRECTORY
+def doRun():
+    return True
+
+
 
 class AppLauncher:
 
@@ -176,6 +181,7 @@ class SageGateBase:
         self.verbose = verbose                 # print the output?
         self.sageServerHost = sageServerHost           # where the sage server is running
         self.launchers={}                      # a hash of appLaunchers currently running
+        self.appLauncherLock = RLock()         # the xmlrpc connection to self.appLauncher can't be shared by threads
 
 	# used for printing out informative messages (on sending and receiving)
 	self.hashOutgoingMessages = {}  
@@ -365,7 +371,11 @@ class SageGateBase:
     def getAppList(self):
         appList = {}
 	try:
-	    appList = self.appLauncher.getAppList()
+            self.appLauncherLock.acquire()
+            try:
+                appList = self.appLauncher.getAppList()
+            finally:
+                self.appLauncherLock.release()
             self.hashCallbackFunction[ 40000 ]( appList )
 	except socket.error:
 	    self.hashCallbackFunction[ 40000 ]( appList ) #return appList  #the server is not running
@@ -422,6 +432,27 @@ class SageGateBase:
 	return totalcount
 
 
+    def sendBatch(self, msgs):
+        """ sends a list of (data, code) back to back in one write
+            (so that SAGE gets them all at once and nothing gets in between)
+        """
+        if not self.connected or not msgs:
+            return 0
+
+        batch = "".join([self.makemsg('',code,'',len(data),data) for (data, code) in msgs])
+        self.senderLock.acquire()
+        try:
+            try:
+                self.sock.sendall(batch)
+            except socket.error:
+                print 'SageGateBase: socket error on send'
+                self.disconnectFromSage( isSocketError=True )
+                return 0
+        finally:
+            self.senderLock.release()
+        return len(batch)
+
+
     ##################################################################	
     # Register
     ##################################################################	
@@ -449,7 +480,11 @@ class SageGateBase:
         
         # try running the app (return -1 if failed for whatever reason)
         try:
-            res = self.appLauncher.startDefaultApp(appName, sageIP, sagePort, useBridge, configName, pos, size, optionalArgs)
+            self.appLauncherLock.acquire()
+            try:
+                res = self.appLauncher.startDefaultApp(appName, sageIP, sagePort, useBridge, configName, pos, size, optionalArgs)
+            finally:
+                self.appLauncherLock.release()
         except:
             print "".join(tb.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
             return -1
@@ -465,8 +500,10 @@ class SageGateBase:
         if not sagePort: sagePort = self.sagePort+1
 
         # try running the app (return -1 if failed for whatever reason)
+        # (a connection of our own since many apps are launched at once when restoring a state)
 	if launcherId in self.launchers:
-            server = self.launchers[launcherId].getServerHandle()
+            launcher = self.launchers[launcherId]
+            server = xmlrpclib.ServerProxy("http://" + launcher.getIP() + ":" + str(launcher.getPort()))
             try:
                 res = server.startDefaultApp(appName, sageIP, sagePort, useBridge, configName, pos, size, optionalArgs)
             except:
@@ -500,7 +537,11 @@ class SageGateBase:
 	if self.connected == False: return 0
 
 	# the portNum is basically the windowId in the appLauncher context
-	return self.appLauncher.stopApp(portNum)   
+        self.appLauncherLock.acquire()
+        try:
+            return self.appLauncher.stopApp(portNum)
+        finally:
+            self.appLauncherLock.release()
 
 
     ##################################################################	
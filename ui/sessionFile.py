@@ -0,0 +1,498 @@
+############################################################################
+#
+# SAGE UI - A Graphical User Interface for SAGE
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+# Author: Ratko Jagodic
+#        
+############################################################################
+
+
+#
+# Binary session recordings. Every recorded action is a record with its
+# time on the playback timeline (the sum of the pauses before it) so a
+# reader never has to go through the file a line at a time to find out
+# where it is.
+#
+# A session file starts with a 16 byte header (MAGIC, version, 0) and is
+# followed by records. Every record starts with a 16 byte header (all
+# little endian): type (1 byte), flags (1 byte), code (2 bytes), time
+# (float64 seconds) and the length of the data that follows:
+#
+#   ACTION:    code is the SAGE message code (0 for words we don't know,
+#              then the data is the whole line) and data is what was sent.
+#   KEYFRAME:  the full state of the display (SessionState) just before the
+#              next record, stored as zlib compressed "word data" lines of
+#              the actions that bring an empty display to that state (after
+#              an "appids" line with the ids the apps had). One is
+#              written every keyframeInterval seconds of the session but
+#              never before the actions since the last one take as much
+#              space as it did (so keyframes can't grow the file more than
+#              twice however big the state gets).
+#
+# When the recording is closed, the time and offset of every keyframe
+# (INDEX_ENTRY) are appended followed by a TRAILER so a reader can bisect
+# the keyframes and get the state at any time by replaying at most one
+# keyframe interval. A file cut short by a crash has no trailer and is
+# scanned once to rebuild the index (an incomplete last record is ignored).
+#
+# The old text sessions ("pause N" and "word data" lines) convert to this
+# format and back without losing anything but the split of consecutive
+# pauses (they are added up):
+#    python sessionFile.py -o out.ses in.ses    (converts either way)
+#    python sessionFile.py -t 2400 in.ses       (the state at minute 40)
+#    python sessionFile.py in.ses               (duration, records...)
+#
+
+import sys, struct, zlib
+from bisect import bisect_right
+from optparse import OptionParser
+
+
+MAGIC = "SAGESESS"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sII")
+RECORD_HEADER = struct.Struct("<BBHdI")
+INDEX_ENTRY = struct.Struct("<dQ")
+TRAILER = struct.Struct("<QId8s")
+INDEX_MAGIC = "SESINDEX"
+
+ACTION = 1
+KEYFRAME = 2
+
+FLAG_PAUSE = 1    # there was a "pause" right before this action (even if it was 0)
+
+KEYFRAME_INTERVAL = 30.0   # seconds of session time between keyframes
+
+
+# the actions we record (code --> word used in the text sessions)
+ACTION_WORDS = {}  #RJ 2005-04-07
+ACTION_WORDS[1001] = "exec"
+ACTION_WORDS[1002] = "kill"
+ACTION_WORDS[1003] = "move"
+ACTION_WORDS[1004] = "resize"
+ACTION_WORDS[1007] = "bg"
+ACTION_WORDS[1008] = "depth"
+ACTION_WORDS[1100] = "shutdown"
+
+ACTION_CODES = {}
+for code, word in ACTION_WORDS.iteritems():
+    ACTION_CODES[word] = code
+
+
+
+def isBinarySession(path):
+    f = open(path, "rb")
+    try:
+        return f.read(len(MAGIC)) == MAGIC
+    finally:
+        f.close()
+
+
+def formatPause(seconds):
+    """ as few digits as possible so "pause 2" stays "pause 2" """
+    return ("%.6f" % seconds).rstrip("0").rstrip(".")
+
+
+
+class SessionState:
+    """ what the recorded actions did to the display up to some point.
+        Apps are only known by the id SAGE gave them when the session was
+        recorded and an exec doesn't say which id its app got (SAGE picks
+        it, other users' apps take ids too). So the first id an action uses
+        that we don't know yet belongs to the oldest exec without an id.
+        A keyframe starts with an "appids" line with the ids of the execs
+        in it ("-" if none of the actions used the app yet).
+    """
+
+    def __init__(self):
+        self.apps = []        # [appId or None, data of the exec that started it] of the running apps in exec order
+        self.__ids = []       # ids of the execs still to come from a keyframe
+        self.windows = {}     # key=appId, value=(left, right, bottom, top) from the last resize
+        self.offsets = {}     # key=appId, value=(distX, distY) for windows only moved so far
+        self.bg = None
+        self.depth = None
+        self.shutdown = False
+
+
+    def apply(self, code, data):
+        try:
+            self.__apply(code, data)
+        except (ValueError, IndexError):
+            pass   # a malformed action didn't change anything on the display either
+
+
+    def __apply(self, code, data):
+        if code == 1001:
+            appId = None
+            if self.__ids:   # from a keyframe
+                appId = self.__ids.pop(0)
+                if appId == "-":
+                    appId = None
+            self.apps.append([appId, data])
+        elif code == 1002:
+            appId = data.strip()
+            self.__learnId(appId)
+            self.apps = [app for app in self.apps if app[0] != appId]
+            self.windows.pop(appId, None)
+            self.offsets.pop(appId, None)
+        elif code == 1003:
+            (appId, distX, distY) = data.split()[:3]
+            self.__learnId(appId)
+            if appId in self.windows:
+                (l, r, b, t) = self.windows[appId]
+                self.windows[appId] = (l+int(distX), r+int(distX), b+int(distY), t+int(distY))
+            else:
+                (x, y) = self.offsets.get(appId, (0,0))
+                self.offsets[appId] = (x+int(distX), y+int(distY))
+        elif code == 1004:
+            params = data.split()
+            self.__learnId(params[0])
+            self.windows[params[0]] = tuple([int(p) for p in params[1:5]])
+            self.offsets.pop(params[0], None)
+        elif code == 1007:
+            self.bg = data
+        elif code == 1008:
+            for appId in data.split()[1::2]:   # numChanges appId z appId z...
+                self.__learnId(appId)
+            self.depth = data
+        elif code == 1100:
+            self.shutdown = True
+
+
+    def __learnId(self, appId):
+        """ an id we haven't seen before is the one of the oldest exec without an id """
+        for app in self.apps:
+            if app[0] == appId:
+                return
+        for app in self.apps:
+            if app[0] is None:
+                app[0] = appId
+                return
+
+
+    def getActions(self):
+        """ [(code, data)] that bring an empty display to this state """
+        actions = []
+        if self.bg is not None:
+            actions.append((1007, self.bg))
+        for (appId, data) in self.apps:
+            actions.append((1001, data))
+        for appId in sorted(self.windows):
+            actions.append((1004, appId + " " + " ".join([str(c) for c in self.windows[appId]])))
+        for appId in sorted(self.offsets):
+            actions.append((1003, "%s %d %d" % ((appId,) + self.offsets[appId])))
+        if self.depth is not None:
+            actions.append((1008, self.depth))
+        if self.shutdown:
+            actions.append((1100, ""))
+        return actions
+
+
+    def getAppIds(self):
+        """ ids of the running apps in the order they were started (None for the unknown ones) """
+        return [appId for (appId, data) in self.apps]
+
+
+    def toText(self):
+        return "".join([ACTION_WORDS[code]+" "+data+"\n" for (code, data) in self.getActions()])
+
+
+    def toKeyframe(self):
+        return "appids " + " ".join([appId or "-" for appId in self.getAppIds()]) + "\n" + self.toText()
+
+
+    def fromText(text):
+        """ reads toText or toKeyframe (without the appids line the ids are learned from the actions) """
+        state = SessionState()
+        for line in text.splitlines():
+            word, data = (line.split(" ", 1) + [""])[:2]
+            if word == "appids":
+                state.__ids = data.split()
+            else:
+                state.apply(ACTION_CODES[word], data)
+        return state
+    fromText = staticmethod(fromText)
+
+
+
+class SessionWriter:
+    """ writes the records one by one as they are recorded and the index on close """
+
+    def __init__(self, path, keyframeInterval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframeInterval = keyframeInterval
+        self.state = SessionState()
+        self.duration = 0.0
+        self.__index = []          # (time, offset) of every keyframe
+        self.__lastKeyframe = None
+        self.__lastKeyframeSize = 0
+        self.__bytesSinceKeyframe = 0
+        self.__file = open(path, "wb")
+        self.__file.write(FILE_HEADER.pack(MAGIC, VERSION, 0))
+
+
+    def write(self, t, code, data, flags=0):
+        if self.__lastKeyframe is None or \
+               (t - self.__lastKeyframe >= self.keyframeInterval and
+                self.__bytesSinceKeyframe >= self.__lastKeyframeSize):
+            self.__writeKeyframe(t)
+        self.__writeRecord(ACTION, flags, code, t, data)
+        self.__bytesSinceKeyframe += RECORD_HEADER.size + len(data)
+        if code:
+            self.state.apply(code, data)
+        self.duration = max(self.duration, t)
+
+
+    def setDuration(self, t):
+        """ for trailing pauses (the session goes on after the last action) """
+        self.duration = max(self.duration, t)
+
+
+    def close(self):
+        if self.__file.closed:
+            return
+        indexOffset = self.__file.tell()
+        for (t, offset) in self.__index:
+            self.__file.write(INDEX_ENTRY.pack(t, offset))
+        self.__file.write(TRAILER.pack(indexOffset, len(self.__index), self.duration, INDEX_MAGIC))
+        self.__file.close()
+
+
+    def __writeKeyframe(self, t):
+        self.__index.append((t, self.__file.tell()))
+        data = zlib.compress(self.state.toKeyframe())
+        self.__writeRecord(KEYFRAME, 0, 0, t, data)
+        self.__lastKeyframe = t
+        self.__lastKeyframeSize = RECORD_HEADER.size + len(data)
+        self.__bytesSinceKeyframe = 0
+        self.__file.flush()   # so that a crash doesn't lose more than one interval
+
+
+    def __writeRecord(self, recordType, flags, code, t, data):
+        self.__file.write(RECORD_HEADER.pack(recordType, flags, code, t, len(data)) + data)
+
+
+
+class SessionFile:
+    """ reads a binary session """
+
+    def __init__(self, path):
+        self.path = path
+        self.__file = open(path, "rb")
+        (magic, version, unused) = FILE_HEADER.unpack(self.__file.read(FILE_HEADER.size))
+        if magic != MAGIC:
+            self.__file.close()
+            raise IOError("Not a binary session file: " + str(path))
+        
+        self.__file.seek(0, 2)
+        size = self.__file.tell()
+        self.__end = None
+        if size >= FILE_HEADER.size + TRAILER.size:
+            self.__file.seek(size - TRAILER.size)
+            (indexOffset, count, duration, indexMagic) = TRAILER.unpack(self.__file.read(TRAILER.size))
+            if indexMagic == INDEX_MAGIC and indexOffset + count*INDEX_ENTRY.size + TRAILER.size == size:
+                self.__file.seek(indexOffset)
+                data = self.__file.read(count * INDEX_ENTRY.size)
+                self.index = [INDEX_ENTRY.unpack_from(data, i*INDEX_ENTRY.size) for i in range(count)]
+                self.duration = duration
+                self.__end = indexOffset
+        if self.__end is None:
+            self.__scan(size)
+        self.__times = [t for (t, offset) in self.index]
+
+
+    def getDuration(self):
+        return self.duration
+
+
+    def records(self, offset=FILE_HEADER.size):
+        """ yields (offset, type, flags, code, time, data) of all the records starting at offset """
+        f = self.__file
+        while offset + RECORD_HEADER.size <= self.__end:
+            f.seek(offset)
+            (recordType, flags, code, t, length) = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            if offset + RECORD_HEADER.size + length > self.__end:
+                break
+            data = f.read(length)
+            yield (offset, recordType, flags, code, t, data)
+            offset += RECORD_HEADER.size + length
+
+
+    def seek(self, t):
+        """ returns the state at time t and the offset of the first record after t """
+        i = max(0, bisect_right(self.__times, t) - 1)
+        if not self.index:
+            return (SessionState(), FILE_HEADER.size)
+        
+        state = None
+        for (offset, recordType, flags, code, rt, data) in self.records(self.index[i][1]):
+            if state is None:   # the keyframe itself
+                state = SessionState.fromText(zlib.decompress(data))
+            elif rt > t:
+                return (state, offset)
+            elif recordType == ACTION and code:
+                state.apply(code, data)
+        return (state, self.__end)
+
+
+    def getStateAt(self, t):
+        return self.seek(t)[0]
+
+
+    def close(self):
+        self.__file.close()
+
+
+    def __scan(self, size):
+        """ rebuilds the index of a recording that wasn't closed properly """
+        self.__end = size
+        self.index = []
+        self.duration = 0.0
+        end = FILE_HEADER.size
+        for (offset, recordType, flags, code, t, data) in self.records():
+            if recordType == KEYFRAME:
+                self.index.append((t, offset))
+            self.duration = max(self.duration, t)
+            end = offset + RECORD_HEADER.size + len(data)
+        self.__end = end
+
+
+
+def readActions(path):
+    """ yields (time, code, data) of every action in a binary or text session
+        (code is 0 and data the whole line for words we don't know)
+    """
+    if isBinarySession(path):
+        session = SessionFile(path)
+        try:
+            for (offset, recordType, flags, code, t, data) in session.records():
+                if recordType == ACTION:
+                    yield (t, code, data)
+        finally:
+            session.close()
+    else:
+        t = 0.0
+        for line in open(path, "r"):
+            line = line.strip()
+            if line == "":
+                continue
+            (word, data) = (line.split(" ", 1) + [""])[:2]
+            if word == "pause":
+                t += float(data)
+            elif word in ACTION_CODES:
+                yield (t, ACTION_CODES[word], data)
+            else:
+                yield (t, 0, line)
+
+
+
+def convertTextSession(textPath, binPath):
+    """ the old "pause N" / "word data" lines to a binary session """
+    writer = SessionWriter(binPath)
+    t = 0.0
+    flags = 0
+    for line in open(textPath, "r"):
+        line = line.strip()
+        if line == "":
+            continue
+        (word, data) = (line.split(" ", 1) + [""])[:2]
+        if word == "pause":
+            t += float(data)
+            flags = FLAG_PAUSE
+        elif word in ACTION_CODES:
+            writer.write(t, ACTION_CODES[word], data, flags)
+            flags = 0
+        else:
+            writer.write(t, 0, line, flags)   # keep it even if we don't know what it is
+            flags = 0
+    writer.setDuration(t)
+    writer.close()
+
+
+def convertBinarySession(binPath, textPath):
+    """ a binary session back to the text lines """
+    session = SessionFile(binPath)
+    out = open(textPath, "w")
+    prevTime = 0.0
+    for (offset, recordType, flags, code, t, data) in session.records():
+        if recordType != ACTION:
+            continue
+        if flags & FLAG_PAUSE or t > prevTime:
+            out.write("pause " + formatPause(t - prevTime) + "\n")
+        if code:
+            out.write(ACTION_WORDS.get(code, str(code)) + " " + data + "\n")
+        else:
+            out.write(data + "\n")
+        prevTime = t
+    if session.getDuration() > prevTime:
+        out.write("pause " + formatPause(session.getDuration() - prevTime) + "\n")
+    out.close()
+    session.close()
+
+
+
+def main():
+    parser = OptionParser(usage="python sessionFile.py [-o outFile | -t seconds] sessionFile")
+    parser.add_option("-o", dest="outFile", default=None,
+                      help="convert a text session to binary or a binary one to text")
+    parser.add_option("-t", dest="time", type="float", default=None,
+                      help="print the state of the display at this time of the session")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        sys.exit(0)
+
+    path = args[0]
+    if options.outFile:
+        if isBinarySession(path):
+            convertBinarySession(path, options.outFile)
+        else:
+            convertTextSession(path, options.outFile)
+        return
+
+    if not isBinarySession(path):
+        print "Text session, convert it first with -o"
+        sys.exit(1)
+        
+    session = SessionFile(path)
+    if options.time is not None:
+        sys.stdout.write(session.getStateAt(options.time).toText())
+    else:
+        numActions = len([r for r in session.records() if r[1] == ACTION])
+        print "duration: %.1fs   actions: %d   keyframes: %d" % \
+              (session.getDuration(), numActions, len(session.index))
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,464 @@
+############################################################################
+#
+# SAGE UI - A Graphical User Interface for SAGE
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+# Author: Ratko Jagodic
+#        
+############################################################################
+
+
+#
+# Replays recorded sessions without the UI to load test the control path.
+# Every replay has its own SageGate connection (like one UI would) and
+# sends the recorded actions at their recorded times divided by the speed
+# (or as fast as it can with speed 0). Many replays can run at the same
+# time to simulate many users.
+#
+# SAGE gave the apps different ids when the session was recorded so the
+# recorded ids are matched to our apps in the order they show up: the
+# first recorded id used gets the first app we started and so on (an
+# action waits up to WAIT_TIMEOUT for an app that isn't there yet). SAGE
+# doesn't say who started an app so a new app goes to the first replay
+# waiting for an app with that name that sees it (which replay moves
+# which window doesn't matter for the load).
+#
+# For every replay we report the message throughput, how long the gate
+# took to send a message, how long SAGE took to report the change (40001
+# for exec/move/resize, 40003 for kill) and how long after the last send
+# it took until SAGE reported everything (the convergence time).
+#
+# Without -s a FakeSage is started locally so the harness can run
+# anywhere (it needs neither wx nor SAGE_DIRECTORY):
+#    python sessionReplay.py [-s host:port] [-x speed] [-n replays] sessions...
+#
+
+import sys, socket, time
+from threading import Thread, Condition, Lock
+from optparse import OptionParser
+import sageGateBase as sgb
+from sessionFile import readActions
+
+
+WAIT_TIMEOUT = 5.0       # how long an action waits for the app it's for
+CONVERGE_TIMEOUT = 10.0  # how long we wait for SAGE to report everything at the end
+FAKE_SAGE_PORT = 20101
+
+# the messages SAGE answers and what it answers with
+REPLY_CODES = {1001: 40001, 1002: 40003, 1003: 40001, 1004: 40001}
+
+# the apps claimed by all the replays in this process (never released
+# since another replay may only hear about an app after it was killed)
+_claimedApps = {}
+_claimLock = Lock()
+
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values) * p / 100.0))]
+
+
+
+class ReplayGate(sgb.SageGateBase):
+    """ a SageGate that only hands the messages to the replay """
+
+    def __init__(self, onMessage):
+        sgb.SageGateBase.__init__(self, sageServerHost=None, useAppLauncher=False)
+        self.__onMessage = onMessage
+
+    def onMessage(self, code, data):
+        self.__onMessage(code, data)
+
+
+
+class ReplayStats:
+
+    def __init__(self, name):
+        self.name = name
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0          # actions for apps we never got
+        self.unanswered = 0       # SAGE never reported these
+        self.sendTimes = []       # seconds spent in sendmsg
+        self.replyTimes = []      # seconds from the send until SAGE reported it
+        self.duration = 0.0       # from the first to the last send
+        self.convergence = None   # from the last send until SAGE reported everything
+
+
+    def getThroughput(self):
+        if self.duration <= 0:
+            return 0.0
+        return self.sent / self.duration
+
+
+    def getReport(self):
+        report = "%s: %d sent in %.2fs (%.0f msg/s), %d received, %d dropped, %d unanswered\n" % \
+                 (self.name, self.sent, self.duration, self.getThroughput(),
+                  self.received, self.dropped, self.unanswered)
+        report += "    send    : mean %.3fms  p50 %.3fms  p99 %.3fms  max %.3fms\n" % \
+                  self.__summary(self.sendTimes)
+        report += "    reply   : mean %.3fms  p50 %.3fms  p99 %.3fms  max %.3fms\n" % \
+                  self.__summary(self.replyTimes)
+        if self.convergence is None:
+            report += "    converge: not within %ds\n" % CONVERGE_TIMEOUT
+        else:
+            report += "    converge: %.3fms\n" % (self.convergence*1000)
+        return report
+
+
+    def __summary(self, values):
+        if not values:
+            return (0.0, 0.0, 0.0, 0.0)
+        return (1000*sum(values)/len(values), 1000*percentile(values, 50),
+                1000*percentile(values, 99), 1000*max(values))
+
+
+
+class SessionReplay(Thread):
+    """ replays one session through its own gate, speed 0 means as fast as possible """
+
+    def __init__(self, sessionPath, host, port, speed=1.0, name=None):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.sessionPath = sessionPath
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.stats = ReplayStats(name or sessionPath)
+        self.__cond = Condition(Lock())
+        self.__myApps = []          # live ids of the apps we started (in order)
+        self.__idMap = {}           # key=recorded appId, value=live appId
+        self.__pendingExecs = []    # (appName, sendTime)
+        self.__pending = {}         # key=live appId, value=[sendTime] waiting for a 40001/40003
+        self.__known = {}           # live appIds SAGE told us about (so we know which ones are new)
+        self.__lastReply = 0
+        self.gate = ReplayGate(self.__onMessage)
+
+
+    def run(self):
+        if self.gate.connectToSage(self.host, self.port) != 1:
+            print "Can't replay ", self.sessionPath, " no connection to SAGE"
+            return
+        self.gate.registerSage()
+        time.sleep(0.2)   # let SAGE tell us about the apps that are already there
+        
+        start = time.time()
+        lastSend = start
+        for (t, code, data) in readActions(self.sessionPath):
+            if not code:
+                continue
+            if self.speed > 0:
+                delay = start + t/self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            data = self.__translate(code, data)
+            if data is None:
+                self.stats.dropped += 1
+                continue
+            
+            self.__cond.acquire()
+            t0 = time.time()
+            self.__expectReply(code, data, t0)
+            self.__cond.release()
+            self.gate.sendmsg(data, code)
+            lastSend = time.time()
+            self.stats.sendTimes.append(lastSend - t0)
+            self.stats.sent += 1
+        self.stats.duration = lastSend - start
+
+        # wait for SAGE to report everything we sent
+        self.__cond.acquire()
+        end = time.time() + CONVERGE_TIMEOUT
+        while self.__countPending() and time.time() < end:
+            self.__cond.wait(end - time.time())
+        self.stats.unanswered = self.__countPending()
+        if not self.stats.unanswered:
+            self.stats.convergence = max(0, self.__lastReply - lastSend)
+        self.__cond.release()
+        self.gate.disconnectFromSage()
+
+
+    def __countPending(self):
+        return len(self.__pendingExecs) + sum([len(p) for p in self.__pending.itervalues()])
+
+
+    def __expectReply(self, code, data, t):
+        if code == 1001:
+            self.__pendingExecs.append((data.split()[0], t))
+        elif code in REPLY_CODES:
+            self.__pending.setdefault(data.split()[0], []).append(t)
+
+
+    def __getLiveId(self, recordedId):
+        """ the app we started for this recorded id (waits for it if necessary) """
+        self.__cond.acquire()
+        try:
+            if recordedId not in self.__idMap:
+                end = time.time() + WAIT_TIMEOUT
+                while len(self.__myApps) <= len(self.__idMap) and time.time() < end:
+                    self.__cond.wait(end - time.time())
+                if len(self.__myApps) <= len(self.__idMap):
+                    return None
+                self.__idMap[recordedId] = self.__myApps[len(self.__idMap)]
+            return self.__idMap[recordedId]
+        finally:
+            self.__cond.release()
+
+
+    def __translate(self, code, data):
+        """ replaces the recorded app ids in the data with ours """
+        tokens = data.split()
+        if code in (1002, 1003, 1004):
+            positions = [0]
+        elif code == 1008:
+            positions = range(1, len(tokens), 2)   # numChanges appId z appId z...
+        else:
+            return data
+        for i in positions:
+            if i >= len(tokens):
+                return None
+            liveId = self.__getLiveId(tokens[i])
+            if liveId is None:
+                return None
+            tokens[i] = liveId
+        return " ".join(tokens)
+
+
+    def __onMessage(self, code, data):
+        now = time.time()
+        self.__cond.acquire()
+        try:
+            self.stats.received += 1
+            tokens = data.split()
+            if code == 40001 and len(tokens) > 1:
+                (appName, appId) = tokens[:2]
+                if appId not in self.__known:
+                    self.__known[appId] = appName
+                    for i in range(len(self.__pendingExecs)):
+                        if self.__pendingExecs[i][0] == appName and self.__claim(appId):
+                            self.__replied(self.__pendingExecs.pop(i)[1], now)
+                            self.__myApps.append(appId)
+                            break
+                elif self.__pending.get(appId):
+                    self.__replied(self.__pending[appId].pop(0), now)
+            elif code == 40003 and tokens:
+                appId = tokens[0]
+                self.__known.pop(appId, None)
+                if self.__pending.get(appId):
+                    self.__replied(self.__pending[appId].pop(0), now)
+                self.__pending.pop(appId, None)   # the rest will never be answered
+            self.__cond.notifyAll()
+        finally:
+            self.__cond.release()
+
+
+    def __claim(self, appId):
+        _claimLock.acquire()
+        try:
+            if appId in _claimedApps:
+                return False
+            _claimedApps[appId] = self
+            return True
+        finally:
+            _claimLock.release()
+
+
+    def __replied(self, sendTime, now):
+        self.stats.replyTimes.append(now - sendTime)
+        self.__lastReply = now
+
+
+
+############################################################################
+#
+#  CLASS: FakeSage
+#
+#  DESCRIPTION: Speaks enough of the SAGE UI protocol to replay sessions
+#               against: apps are created on exec, moved, resized and
+#               killed and every change is sent to all the connected UIs
+#               like SAGE does (40001, 40003, 40005).
+#
+############################################################################
+
+class FakeSage(Thread):
+
+    def __init__(self, port=FAKE_SAGE_PORT):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.port = port
+        self.apps = {}       # key=appId, value=[appName, left, right, bottom, top, z]
+        self.nextId = 0
+        self.clients = []
+        self.__lock = Lock()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("", port))
+        self.server.listen(64)
+
+
+    def run(self):
+        while True:
+            (sock, addr) = self.server.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            t = Thread(target=self.__serveClient, args=(sock,))
+            t.setDaemon(True)
+            t.start()
+
+
+    def __serveClient(self, sock):
+        self.__lock.acquire()
+        self.clients.append(sock)
+        self.__lock.release()
+        try:
+            while True:
+                size = self.__recvAll(sock, sgb.HEADER_ITEM_LEN + 1)
+                msg = self.__recvAll(sock, int(size.replace('\x00', '')) - len(size))
+                code = int(msg[9:17].replace('\x00', ' ').strip())
+                data = msg[27:].replace('\x00', ' ').strip()
+                self.__handle(sock, code, data)
+        except (socket.error, ValueError):
+            pass
+        self.__lock.acquire()
+        self.clients.remove(sock)
+        self.__lock.release()
+        sock.close()
+
+
+    def __recvAll(self, sock, size):
+        data = ""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise socket.error("connection closed")
+            data += chunk
+        return data
+
+
+    def __handle(self, sock, code, data):
+        self.__lock.acquire()
+        try:
+            tokens = data.split()
+            if code == 1000:   # send the new UI all the apps
+                for appId in self.apps:
+                    self.__send([sock], 40001, self.__appInfo(appId))
+            elif code == 1001 and tokens:
+                appId = str(self.nextId)
+                self.nextId += 1
+                self.apps[appId] = [tokens[0], 0, 800, 0, 600, 0]
+                self.__send(self.clients, 40001, self.__appInfo(appId))
+            elif code == 1002 and tokens and tokens[0] in self.apps:
+                del self.apps[tokens[0]]
+                self.__send(self.clients, 40003, tokens[0])
+            elif code == 1003 and len(tokens) >= 3 and tokens[0] in self.apps:
+                app = self.apps[tokens[0]]
+                (dx, dy) = (int(tokens[1]), int(tokens[2]))
+                app[1:5] = [app[1]+dx, app[2]+dx, app[3]+dy, app[4]+dy]
+                self.__send(self.clients, 40001, self.__appInfo(tokens[0]))
+            elif code == 1004 and len(tokens) >= 5 and tokens[0] in self.apps:
+                self.apps[tokens[0]][1:5] = [int(c) for c in tokens[1:5]]
+                self.__send(self.clients, 40001, self.__appInfo(tokens[0]))
+            elif code == 1008 and tokens:
+                for i in range(1, len(tokens)-1, 2):
+                    if tokens[i] in self.apps:
+                        self.apps[tokens[i]][5] = int(tokens[i+1])
+                self.__send(self.clients, 40005, data)
+        finally:
+            self.__lock.release()
+
+
+    def __appInfo(self, appId):
+        (appName, left, right, bottom, top, z) = self.apps[appId]
+        return "%s %s %d %d %d %d %s %d" % (appName, appId, left, right, bottom, top, appId, z)
+
+
+    def __send(self, socks, code, data):
+        msg = '%8s\0%8s\0%8s\0%s\0' % ('', code, '', data)
+        msg = '%8s\0%s' % (len(msg)+9, msg)
+        for s in socks:
+            try:
+                s.sendall(msg)
+            except socket.error:
+                pass
+
+
+
+def main():
+    parser = OptionParser(usage="python sessionReplay.py [-s host:port] [-x speed] [-n replays] sessionFile...")
+    parser.add_option("-s", dest="server", default=None,
+                      help="SAGE to replay to (host:port of its UI port), a FakeSage is started without it")
+    parser.add_option("-x", dest="speed", type="float", default=1.0,
+                      help="playback speed (2 is twice as fast, 0 is as fast as possible)")
+    parser.add_option("-n", dest="replays", type="int", default=1,
+                      help="how many replays of every session to run at the same time")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.print_help()
+        sys.exit(0)
+
+    if options.server:
+        (host, port) = options.server.split(":")
+        port = int(port)
+    else:
+        (host, port) = ("127.0.0.1", FAKE_SAGE_PORT)
+        FakeSage(port).start()
+
+    replays = []
+    for path in args:
+        for i in range(options.replays):
+            replays.append(SessionReplay(path, host, port, options.speed, "%s #%d" % (path, i+1)))
+    start = time.time()
+    for r in replays:
+        r.start()
+    for r in replays:
+        while r.isAlive():
+            r.join(1)
+    elapsed = time.time() - start
+
+    totalSent = 0
+    allSends = []
+    allReplies = []
+    for r in replays:
+        sys.stdout.write(r.stats.getReport())
+        totalSent += r.stats.sent
+        allSends.extend(r.stats.sendTimes)
+        allReplies.extend(r.stats.replyTimes)
+    print "\nALL: %d replays, %d messages in %.2fs (%.0f msg/s), send p99 %.3fms, reply p99 %.3fms" % \
+          (len(replays), totalSent, elapsed, totalSent/max(elapsed, 0.001),
+           1000*percentile(allSends, 99), 1000*percentile(allReplies, 99))
+
+
+if __name__ == '__main__':
+    main()
@@ -50,6 +50,10 @@ CHUNK_SIZE = 2048 #4096
 SOCKET_TIMEOUT = 1
 MSGLEN = CHUNK_SIZE
 SEPARATOR = '\0'
+RECV_SIZE = CHUNK_SIZE * 16   # read this much at once when messages pile up
+
+# for CleanBuffer: non-printable characters become spaces (except our separator)
+CLEAN_TABLE = "".join([ (chr(i) in string.printable+SEPARATOR) and chr(i) or " " for i in range(256) ])
 
 
 
@@ -188,8 +192,8 @@ class MachineListCtrl(wx.ListCtrl):
             #returns the last selected SAGEMachine, if none was selected, returns None
     def GetSelectedMachine(self):
         index  = self.GetFirstSelected()
-        if self.toolTipHash.has_key(index):
-            return self.toolTipHash[index]
+        if 0 <= index < len(self.rowMachines):
+            return self.rowMachines[index]
         return None
 
 
@@ -199,7 +203,12 @@ class MachineListCtrl(wx.ListCtrl):
             # if there are overlaps, the one from the server gets precedence
             # everything is keyed by the ID of each machine and the data
             # stored in every hash is actually a bunch of SAGEMachines
-    def RefreshMachineList(self, data=None):
+            # with changes (StatusChanges) only those rows are updated
+    def RefreshMachineList(self, changes=None):
+        if changes is not None and hasattr(self, "rowMachines"):
+            self.UpdateRows(changes)
+            return
+        
         self.DeleteAllItems()     #first delete everything
 
         #now update the hash holding all the machines
@@ -207,18 +216,58 @@ class MachineListCtrl(wx.ListCtrl):
         self.machineHash = self.usersData.GetMachinesStatus().copy()
 
         # insert the sorted list of machines into the control
-        self.toolTipHash = {}  # a hash of sageMachines indexed by their ListCtrl index
-        index = 0
+        self.rowMachines = []  # sageMachines in the order of the ListCtrl rows
         machines = self.machineHash.values()
         machines.sort(lambda x, y: cmp(x.GetName().lower(), y.GetName().lower()))
         for sageMachine in machines: 
-            self.toolTipHash[index] = sageMachine  #used for creation of correct tooltips
-            self.InsertRow(sageMachine, index)
-            index = index + 1
+            self.InsertRow(sageMachine, len(self.rowMachines))
 
         self.dialogClass.EnableButtons(False)
 
 
+            # updates, inserts and deletes only the rows of the machines that changed
+    def UpdateRows(self, changes):
+        machines = self.usersData.GetMachinesStatus()
+        for machineId in changes.removed + changes.changed + changes.added:
+            index = self.FindRow(machineId)
+            if not machineId in machines:   # removed
+                if index > -1:
+                    self.DeleteItem(index)
+                    del self.rowMachines[index]
+                if machineId in self.machineHash:
+                    del self.machineHash[machineId]
+                continue
+
+            sageMachine = machines[machineId]
+            self.machineHash[machineId] = sageMachine
+            if index > -1 and self.rowMachines[index].GetName() == sageMachine.GetName():
+                self.rowMachines[index] = sageMachine   # same place in the list, just update it
+                self.SetItemImage(index, self.GetImageIndex(sageMachine))
+            else:
+                if index > -1:
+                    self.DeleteItem(index)
+                    del self.rowMachines[index]
+                self.InsertRow(sageMachine, self.GetSortedIndex(sageMachine))
+
+        self.dialogClass.EnableButtons(self.GetFirstSelected() > -1)
+
+
+    def FindRow(self, machineId):
+        for index in range(len(self.rowMachines)):
+            if self.rowMachines[index].GetId() == machineId:
+                return index
+        return -1
+
+
+            # where the machine goes in the list sorted by name
+    def GetSortedIndex(self, sageMachine):
+        name = sageMachine.GetName().lower()
+        index = 0
+        while index < len(self.rowMachines) and self.rowMachines[index].GetName().lower() <= name:
+            index = index + 1
+        return index
+
+
 ##     def GetMachineForAutoload(self, name):
 ##         self.machineHash = {}
 ##         print "usersData machinestatus: ", self.usersData.GetMachinesStatus()
@@ -232,13 +281,8 @@ class MachineListCtrl(wx.ListCtrl):
         if index == -1:  #if true, insert at the end
             index = self.GetItemCount()
 
-        if self.usersData.HasMachine(sageMachine.GetId()):  # set the correct icon
-            if sageMachine.IsAlive():
-                self.InsertImageStringItem(index, sageMachine.GetName(), self.greenIndex )
-            else:               #the machine is not running but the room is still open since there are users in it
-                self.InsertImageStringItem(index, sageMachine.GetName(), self.redIndex )
-        else:                   #the machine is not even running
-            self.InsertImageStringItem(index, sageMachine.GetName(), self.redIndex )
+        self.InsertImageStringItem(index, sageMachine.GetName(), self.GetImageIndex(sageMachine))
+        self.rowMachines.insert(index, sageMachine)  #used for creation of correct tooltips
 
         if self.GetItemCount() > self.GetCountPerPage():  # a visual fix 
             self.SetColumnWidth(0, self.GetSize().width - 25 - 2)
@@ -246,6 +290,13 @@ class MachineListCtrl(wx.ListCtrl):
             self.SetColumnWidth(0, self.GetSize().width - 2)
             
 
+    def GetImageIndex(self, sageMachine):
+        if self.usersData.HasMachine(sageMachine.GetId()) and sageMachine.IsAlive():
+            return self.greenIndex
+        else:   #the machine is not running (but the room may still be open since there are users in it)
+            return self.redIndex
+            
+
     #---------------------------------------------------------------
     # for tooltips
     #---------------------------------------------------------------
@@ -258,7 +309,7 @@ class MachineListCtrl(wx.ListCtrl):
                 return
             self.currentIndex = index
             #sageMachine = self.GetMachineByName( self.GetItem(index).GetText() )
-            self.MakeToolTip(self.toolTipHash[index])
+            self.MakeToolTip(self.rowMachines[index])
 
 
     def GetMachineByName(self, name):    #returns the first machine with the specified name, or None
@@ -644,7 +695,8 @@ class ChatRoom(wx.Panel):
 
         # create the users list
         self.userListLabel = wx.StaticText(self, -1, "Connected Users:")
-        self.userList = wx.ListBox(self, -1, choices=self.usersData.GetUsernames(self.machineId))#, style=wx.LB_SINGLE)
+        self.shownUsers = self.usersData.GetUsernames(self.machineId)  # in the same order as in self.userList
+        self.userList = wx.ListBox(self, -1, choices=self.shownUsers)#, style=wx.LB_SINGLE)
         self.userList.SetSizeHints(-1, -1, -1, maxH = 200)
         
         # create the chat window
@@ -704,9 +756,24 @@ class ChatRoom(wx.Panel):
 #  MESSAGE CALLBACKS
 #-------------------------------------------------------
 
-    def OnUsersStatus(self):
+    def OnUsersStatus(self, changes=None):
         # update the ListBox control with the new data from UsersDatastructure
-        self.userList.Set(self.usersData.GetUsernames(self.GetId()))
+        if changes is None:
+            self.shownUsers = self.usersData.GetUsernames(self.GetId())
+            self.userList.Set(self.shownUsers)
+            return
+
+        # only add/remove the users that changed
+        for username in changes.removed + changes.changed + changes.added:
+            inRoom = self.usersData.IsUserConnectedTo(username, self.GetId())
+            shown = username in self.shownUsers
+            if shown and not inRoom:
+                index = self.shownUsers.index(username)
+                self.userList.Delete(index)
+                del self.shownUsers[index]
+            elif inRoom and not shown:
+                self.userList.Append(username)
+                self.shownUsers.append(username)
         
 
         #just write the message to the screen with the right font properties
@@ -842,7 +909,11 @@ class UsersPanel(wx.Frame):
 #  MESSAGE CALLBACKS
 #-------------------------------------------------------
 
-    def OnMachinesStatus(self):
+    def OnMachinesStatus(self, changes=None):
+        if changes is not None:
+            self.UpdateChatRooms(changes)
+            return
+        
         # first create new pages for new machines
         for machineId in self.usersData.GetMachinesStatus():
             if not self.chatRooms.has_key(machineId): #if the room doesnt exist already...
@@ -867,13 +938,38 @@ class UsersPanel(wx.Frame):
         if pageIndexToDelete > -1:
             self.notebook.DeletePage(pageIndexToDelete)
             del self.chatRooms[pageIdToDelete]
+
+
+        # adds, updates the icons of and removes only the pages of the machines that changed
+    def UpdateChatRooms(self, changes):
+        for machineId in changes.removed + changes.changed + changes.added:
+            if not self.chatRooms.has_key(machineId):
+                if self.usersData.HasMachine(machineId):
+                    self.AddChatRoom(machineId)
+                continue
             
+            pageIndex = self.GetPageIndex(machineId)
+            if not self.usersData.HasMachine(machineId): #the machine died and there are no more people in that room, so remove the tab
+                self.notebook.DeletePage(pageIndex)
+                del self.chatRooms[machineId]
+            elif self.usersData.GetMachine(machineId).IsAlive():
+                self.notebook.SetPageImage(pageIndex, 0)
+            else:
+                self.notebook.SetPageImage(pageIndex, 1)  #the machine died but there are still people in that room, so keep it open
 
-    def OnUsersStatus(self):
+
+    def GetPageIndex(self, machineId):
+        for pageIndex in range(self.notebook.GetPageCount()):
+            if self.notebook.GetPage(pageIndex).GetId() == machineId:
+                return pageIndex
+        return -1
+            
+
+    def OnUsersStatus(self, changes=None):
         # update all the chatRooms with the new data from UsersDatastructure
         try:
             for chatRoom in self.chatRooms.itervalues():
-                chatRoom.OnUsersStatus()
+                chatRoom.OnUsersStatus(changes)
         except wx.PyDeadObjectError:  # a fix so that the error doesnt show up on exit (it happens because some events might still be in the queue)
             pass
 
@@ -1030,18 +1126,22 @@ class UsersClient:
     # this runs in a thread, loops forever and receives messages
     def Receiver(self):
 
+        buf = ""   # what we received but didn't handle yet
         while not self.threadKilled:
             try:
                 
-                msg = self.socket.recv(CHUNK_SIZE)  #retrieve the message from the socket
-                if len( msg ) < 2:
-                    print "UsersClient: connection closed"
-                    break
-
-                # since recv is not guaranteed to receive exactly CHUNK_SIZE bytes
-                # so keep receiving until it gets the whole chunk
-                while len( msg ) < CHUNK_SIZE:
-                    msg = msg + self.socket.recv(CHUNK_SIZE - len( msg))
+                # messages are always CHUNK_SIZE long so take as many as have
+                # arrived in one recv and keep the rest for the next round
+                if len( buf ) < CHUNK_SIZE:
+                    data = self.socket.recv(RECV_SIZE)  #retrieve the messages from the socket
+                    if len( data ) == 0:
+                        print "UsersClient: connection closed"
+                        break
+                    buf = buf + data
+                    if len( buf ) < CHUNK_SIZE:
+                        continue
+                msg = buf[:CHUNK_SIZE]
+                buf = buf[CHUNK_SIZE:]
 
                 if self.threadKilled:
                     break
@@ -1094,16 +1194,7 @@ class UsersClient:
     # converts all non-printable characters from the buffer to white spaces
     # (so that they can be removed using string.strip() function)
     def CleanBuffer( self, stBuffer ):
-        stNewBuffer = ""
-        
-        for ch in stBuffer:
-            if ch == '\0':   #this is our message separator so handle it separately
-                stNewBuffer += ch
-            elif ch in string.printable:
-                stNewBuffer += ch
-            else:
-                stNewBuffer += " "
-        return stNewBuffer
+        return stBuffer.translate(CLEAN_TABLE)
         
 
         # when user tries to register, it first has to check the username so
@@ -1115,12 +1206,32 @@ class UsersClient:
 
 
 
+# what changed with one status message (lists of machineIds or usernames)
+class StatusChanges:
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    def IsEmpty(self):
+        return not (self.added or self.changed or self.removed)
+
+
+
 # a data structure to hold all the machines, users and so on
+# the server always sends the whole status, so every message is compared
+# (block by block) with the previous one and only the machines/users that
+# actually changed are parsed, updated and passed on to the ui
+# (usersFeed.py measures and checks this with a synthetic feed)
 class UsersDatastructure:
 
     def __init__(self):
         self.usersStatusHash = {}
         self.machinesStatusHash = {}
+        self.machineBlocks = {}   # key=machineId, value=status text from the server it was made from
+        self.userBlocks = {}      # key=username, value=status text from the server it was made from
+        self.machineUsers = {}    # key=machineId, value=hash of usernames connected to it
         self.uiCallback = {}   # functions for updating the UI
         self.myconnections = []    # the machines this user is connected to (SAGEMachine objects keyed by machineId)
         self._username = "No Name"  # this user's username
@@ -1140,43 +1251,64 @@ class UsersDatastructure:
     ##### UPDATE DATA  -----------------------------------------------------
 
             # updates the data structure when the new machine status comes in
+            # the machines from the preferences are there unless the server reports them
     def OnMachinesStatus(self, data):
-        machines = string.split(data, SEPARATOR)
-        self.ClearMachinesStatus()
+        blocks = self.__SplitBlocks(data, 3)   # machineId is the 4th line
+        changes = StatusChanges()
 
-        # first add the machines from the preferences
-        self.machinesStatusHash.update(prefs.machines.GetMachineHash().copy())
-        if data != "":   # when no machines are reported we get an empty message from the server
-            # now add the machines from the server (but they first need to be created)
-            for machine in machines:
-                machineData = machine.splitlines()
-                name = machineData[0]
-                ip = machineData[1]
-                port = machineData[2]
-                machineId = machineData[3]
-                alive = bool( int(machineData[4]) )
-                displayInfo = str(machineData[5])
-                displayData = string.split(displayInfo)    #extract the data from the displayInfo string
-                if len(machineData) > 6: # the first time we connect we dont get the system port/ip
-                    (sysIP, sysPort) = machineData[6].split()
-                else:
-                    (sysIP, sysPort) = (ip, port+str(1))
-                self.AddNewMachine(name, ip, port, sysIP, sysPort, machineId, alive, displayData) 
+        # new or changed machines from the server (but they first need to be created)
+        for machineId, machine in blocks.iteritems():
+            if self.machineBlocks.get(machineId) == machine:
+                continue
+            if machineId in self.machinesStatusHash:
+                changes.changed.append(machineId)
+            else:
+                changes.added.append(machineId)
+            machineData = machine.splitlines()
+            name = machineData[0]
+            ip = machineData[1]
+            port = machineData[2]
+            alive = bool( int(machineData[4]) )
+            displayInfo = str(machineData[5])
+            displayData = string.split(displayInfo)    #extract the data from the displayInfo string
+            if len(machineData) > 6: # the first time we connect we dont get the system port/ip
+                (sysIP, sysPort) = machineData[6].split()
+            else:
+                (sysIP, sysPort) = (ip, port+str(1))
+            self.AddNewMachine(name, ip, port, sysIP, sysPort, machineId, alive, displayData) 
+
+        # machines the server doesn't report anymore
+        gone = [machineId for machineId in self.machineBlocks if machineId not in blocks]
+        if gone:
+            prefsMachines = prefs.machines.GetMachineHash()
+            for machineId in gone:
+                if machineId in prefsMachines:   # back to the one from the preferences
+                    self.machinesStatusHash[machineId] = prefsMachines[machineId]
+                    changes.changed.append(machineId)
+                elif machineId in self.machinesStatusHash:
+                    del self.machinesStatusHash[machineId]
+                    changes.removed.append(machineId)
+        self.machineBlocks = blocks
 
         # update the ui
-        if 30000 in self.uiCallback:
-                wx.CallAfter(self.uiCallback[30000])
+        if 30000 in self.uiCallback and not changes.IsEmpty():
+                wx.CallAfter(self.uiCallback[30000], changes)
         
 
-        # updates the data structure when the new machine status comes in
+        # updates the data structure when the new users status comes in
     def OnUsersStatus(self, data):
-        users = string.split(data, SEPARATOR)  #split it into individual client's status
-        self.ClearUsersStatus()  #recreate the hash from scratch
-        for user in users:
-            if user == "":
-                break
+        blocks = self.__SplitBlocks(data, 0)   # username is the 1st line
+        changes = StatusChanges()
+
+        # new or changed users
+        for username, user in blocks.iteritems():
+            if self.userBlocks.get(username) == user:
+                continue
+            if username in self.usersStatusHash:
+                changes.changed.append(username)
+            else:
+                changes.added.append(username)
             userData = string.split(user, "\n",2)
-            username = userData[0]
             info = userData[1]
             if len(userData) > 2:
                 machineList = string.split(userData[2], "\n")  #split the machines into a list
@@ -1184,9 +1316,28 @@ class UsersDatastructure:
                 machineList = []
             self.AddNewUser(username, info, machineList)  #store info about all the users in a hash
 
+        # users that left
+        for username in self.userBlocks.keys():
+            if username not in blocks:
+                self.RemoveUser(username)
+                changes.removed.append(username)
+        self.userBlocks = blocks
+
         # update the ui
-        if 30001 in self.uiCallback:
-            self.uiCallback[30001]()
+        if 30001 in self.uiCallback and not changes.IsEmpty():
+            self.uiCallback[30001](changes)
+
+
+        # splits the status message into blocks (one per machine or user)
+        # keyed by their keyLine-th line
+    def __SplitBlocks(self, data, keyLine):
+        blocks = {}
+        for block in string.split(data, SEPARATOR):
+            block = block.strip("\n")   # the last one was stripped with the message so make them all the same
+            lines = block.split("\n", keyLine+1)
+            if len(lines) > keyLine and block != "":
+                blocks[ lines[keyLine] ] = block
+        return blocks
 
 
         # actually just relays the message to the appropriate UI component
@@ -1252,14 +1403,19 @@ class UsersDatastructure:
 
     def AddNewSAGEMachine(self, newMachine):
         self.machinesStatusHash[ newMachine.GetId() ] = newMachine
+        if newMachine.GetId() in self.machineBlocks:   # so that the next status from the server takes over again
+            del self.machineBlocks[ newMachine.GetId() ]
 
     def RemoveMachine(self, machine):
         if machine.GetId() in self.machinesStatusHash:
             del self.machinesStatusHash[ machine.GetId() ]
+        if machine.GetId() in self.machineBlocks:   # so that it comes back if the server still reports it
+            del self.machineBlocks[ machine.GetId() ]
 
     def ClearMachinesStatus(self):
         del self.machinesStatusHash
         self.machinesStatusHash = {}
+        self.machineBlocks = {}
 
         
     ##### USERS  -------------------------------------------------------------
@@ -1274,23 +1430,38 @@ class UsersDatastructure:
         if machine == "all":
             return self.GetUsersStatus().keys()
         else:
-            tempList = []
-            # loop through all the users and see if the machine they are connected to matches
-            # the machine we passed in here
-            for username, sageUser in self.GetUsersStatus().iteritems():
-                if machine in sageUser.GetMachines():
-                    tempList.append(username)
-            return tempList
+            return self.machineUsers.get(machine, {}).keys()
 
     def GetUsersStatus(self):   #returns SAGEUsers
         return self.usersStatusHash
 
+    def IsUserConnectedTo(self, username, machine):
+        if machine == "all":
+            return self.HasUsername(username)
+        return username in self.machineUsers.get(machine, {})
+
     def AddNewUser(self, username, info, machineList=[]):
+        self.RemoveUser(username)
         self.usersStatusHash[ username ] = SAGEUser(username, info, machineList)
+        for machineId in machineList:
+            self.machineUsers.setdefault(machineId, {})[username] = True
+
+    def RemoveUser(self, username):
+        if username in self.usersStatusHash:
+            for machineId in self.usersStatusHash[username].GetMachines():
+                if username in self.machineUsers.get(machineId, {}):
+                    del self.machineUsers[machineId][username]
+                    if not self.machineUsers[machineId]:
+                        del self.machineUsers[machineId]
+            del self.usersStatusHash[username]
+        if username in self.userBlocks:
+            del self.userBlocks[username]
             
     def ClearUsersStatus(self):
         del self.usersStatusHash
         self.usersStatusHash = {}
+        self.userBlocks = {}
+        self.machineUsers = {}
 
 
 
@@ -0,0 +1,212 @@
+############################################################################
+#
+# SAGE UI - A Graphical User Interface for SAGE
+# Copyright (C) 2005 Electronic Visualization Laboratory,
+# University of Illinois at Chicago
+#
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the distribution.
+#  * Neither the name of the University of Illinois at Chicago nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Direct questions, comments etc about SAGE UI to www.evl.uic.edu/cavern/forum
+#
+# Author: Ratko Jagodic
+#        
+############################################################################
+
+
+#
+# Replays a synthetic users server feed through UsersDatastructure to
+# measure (and check) the incremental status updates of users.py without
+# a users server. No windows are opened but users.py still needs what the
+# UI needs to import it (wx, numpy and the UI modules) and reads the
+# preferences for the list of machines:
+#    python usersFeed.py [-u users] [-m machines] [-n snapshots] [-s seed]
+#
+# Every snapshot is the full machines and users status message the users
+# server would send after a few random changes (users joining, leaving or
+# moving to other machines and machines going up or down). A chat room
+# for one machine and the "all" room follow the changes with a stand-in
+# for the wx.ListBox that counts the list operations. At the end the
+# incrementally updated data must be the same as a fresh
+# UsersDatastructure that only got the last snapshot. The defaults (5000
+# users, 300 snapshots) are the ones the incremental updates were tuned
+# with so the numbers are comparable between versions.
+#
+
+import random, time, sys
+from optparse import OptionParser
+import users
+import preferences as prefs
+from globals import setUsersData
+
+
+
+class CountingListBox:
+    """ has the parts of wx.ListBox the ChatRoom uses and counts the operations """
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.ops = 0
+
+    def Set(self, items):
+        self.items = list(items)
+        self.ops += len(items)
+
+    def Delete(self, i):
+        del self.items[i]
+        self.ops += 1
+
+    def Append(self, s):
+        self.items.append(s)
+        self.ops += 1
+
+
+
+class SyntheticFeed:
+    """ the status messages of a users server with random changes between them """
+
+    def __init__(self, numUsers, numMachines, seed):
+        self.random = random.Random(seed)
+        self.machines = ["10.0.%d.1:20001" % i for i in range(numMachines)]
+        self.alive = dict([(m, 1) for m in self.machines])
+        self.users = {}    # key=username, value=(info, [machineIds])
+        for i in range(numUsers):
+            self.users["user%05d" % i] = ("info %d" % i, self.random.sample(self.machines, self.random.randint(1, 2)))
+
+
+    def next(self):
+        """ makes a few changes and returns (machinesMessage, usersMessage) """
+        for k in range(self.random.randint(1, 3)):
+            r = self.random.random()
+            if r < 0.3:
+                self.users["new%06d" % self.random.randint(0, 999999)] = ("new", [self.random.choice(self.machines)])
+            elif r < 0.6 and self.users:
+                del self.users[self.random.choice(self.users.keys())]
+            elif r < 0.8 and self.users:
+                u = self.random.choice(self.users.keys())
+                self.users[u] = (self.users[u][0], [self.random.choice(self.machines)])
+            else:
+                m = self.random.choice(self.machines)
+                self.alive[m] = 1 - self.alive[m]
+        return (self.machinesMessage(), self.usersMessage())
+
+
+    def usersMessage(self):
+        blocks = []
+        for username in sorted(self.users):
+            (info, machines) = self.users[username]
+            blocks.append("".join([line+"\n" for line in [username, info] + machines]))
+        return "\0".join(blocks).strip()   # the receiver strips the whole message
+
+
+    def machinesMessage(self):
+        blocks = []
+        for m in self.machines:
+            ip = m.split(":")[0]
+            lines = ["wall"+m, ip, "20001", m, str(self.alive[m]), "2 2 2000 2000 1000 1000", ip+" 20002"]
+            blocks.append("".join([line+"\n" for line in lines]))
+        return "\0".join(blocks).strip()
+
+
+
+def makeRoom(usersData, machineId):
+    """ a ChatRoom without the window, only what OnUsersStatus needs """
+    room = users.ChatRoom.__new__(users.ChatRoom)
+    room.machineId = machineId
+    room.usersData = usersData
+    room.shownUsers = usersData.GetUsernames(machineId)
+    room.userList = CountingListBox(room.shownUsers)
+    return room
+
+
+def sameData(a, b):
+    def norm(d):
+        return dict([(u, (x.GetInfo(), sorted([m for m in x.GetMachines() if m])))
+                     for u, x in d.GetUsersStatus().items()])
+    if norm(a) != norm(b):
+        return False
+    ma, mb = a.GetMachinesStatus(), b.GetMachinesStatus()
+    if sorted(ma.keys()) != sorted(mb.keys()):
+        return False
+    for machineId, m in ma.items():
+        if m.IsAlive() != mb[machineId].IsAlive() or \
+               sorted(a.GetUsernames(machineId)) != sorted(b.GetUsernames(machineId)):
+            return False
+    return True
+
+
+def main(argv):
+    parser = OptionParser(usage="python usersFeed.py [-u users] [-m machines] [-n snapshots] [-s seed]")
+    parser.add_option("-u", dest="users", type="int", default=5000)
+    parser.add_option("-m", dest="machines", type="int", default=40)
+    parser.add_option("-n", dest="snapshots", type="int", default=300)
+    parser.add_option("-s", dest="seed", type="int", default=1)
+    (options, args) = parser.parse_args(argv[1:])
+
+    prefs.readAllPreferences()   # UsersDatastructure wants prefs.machines
+    feed = SyntheticFeed(options.users, options.machines, options.seed)
+    snapshots = [feed.next() for i in range(options.snapshots)]
+    print "%d snapshots, users message %d bytes" % (len(snapshots), len(snapshots[-1][1]))
+
+    data = users.UsersDatastructure()
+    setUsersData(data)
+    changes = []
+    data.RegisterUICallback(30001, changes.append)
+    data.RegisterUICallback(30000, changes.append)
+    (machinesMsg, usersMsg) = snapshots[0]
+    data.OnMachinesStatus(machinesMsg)
+    data.OnUsersStatus(usersMsg)
+    rooms = [makeRoom(data, feed.machines[0]), makeRoom(data, "all")]
+
+    t = time.time()
+    for (machinesMsg, usersMsg) in snapshots[1:]:
+        data.OnMachinesStatus(machinesMsg)
+        del changes[:]
+        data.OnUsersStatus(usersMsg)
+        for room in rooms:
+            room.OnUsersStatus(changes and changes[0] or users.StatusChanges())
+    took = time.time() - t
+    print "%.3fs for %d snapshots (%.2fms each)" % (took, len(snapshots)-1, took*1000/max(1, len(snapshots)-1))
+
+    # the same as starting from the last snapshot?
+    fresh = users.UsersDatastructure()
+    setUsersData(fresh)
+    fresh.OnMachinesStatus(snapshots[-1][0])
+    fresh.OnUsersStatus(snapshots[-1][1])
+    ok = sameData(data, fresh)
+    for room in rooms:
+        roomOk = sorted(room.userList.items) == sorted(data.GetUsernames(room.machineId))
+        print "room %s: %d users, %d list box operations%s" % \
+              (room.machineId, len(room.userList.items), room.userList.ops, (not roomOk and "  WRONG") or "")
+        ok = ok and roomOk
+    print ok and "PASSED" or "FAILED"
+    return ok
+
+
+
+if __name__ == '__main__':
+    if not main(sys.argv):
+        sys.exit(1)